@@ -0,0 +1,25 @@
+# Finding Roboclaws: serial ports that may have one attached, and the
+# packet serial addresses answering on a port.
+
+from collections import OrderedDict
+import os
+
+# Packet serial addresses a Roboclaw can be set to.
+allAddresses = range(0x80, 0x88)
+
+# Roboclaw directly connected on USB usually show up as /dev/ttyACM0
+# and sometimes /dev/ttyACM1 on Raspberry Pi & PC. On MacOS it has
+# shown up as /dev/ttyusbmodem. In both cases USB serial bridges
+# announce themselves as ttyUSB. Put all the possibilities in a list
+def potentialDevices():
+	return [dev for dev in os.listdir("/dev") if dev.startswith(("ttyACM", "ttyUSB", "tty.usbmodem"))]
+
+# Addresses on an opened port that answer ReadVersion, as an OrderedDict
+# of address to version string.
+def findAddresses(rc, addresses=allAddresses):
+	found = OrderedDict()
+	for address in addresses:
+		version = rc.ReadVersion(address)
+		if version[0]:
+			found[address] = version[1]
+	return found
@@ -0,0 +1,353 @@
+# Deliberate serial link faults, for seeing how the Roboclaw driver and its
+# retry loops hold up on a noisy cable before it happens in the field.
+
+# FaultyPort goes in place of a Roboclaw's serial port (rc._port) and
+# damages the traffic according to FaultSchedules:
+#   drop      a byte goes missing, the bytes behind it move up
+#   corrupt   a bit of a byte is flipped
+#   delay     the reply comes late
+#   truncate  the reply stops part way
+#   stuck     nothing gets through at all, for a run of transactions
+# drop and corrupt hit the reply, or the request with direction="request".
+# Each write to the port starts a transaction (the driver writes each
+# packet in one call), and every schedule decides from a seeded random
+# generator whether it hits that transaction, so a run can be repeated
+# exactly.
+
+# FaultyPort works on a real serial port too. For measurements it is
+# usually put around a SimulatedPort: a Roboclaw_stub answering the packet
+# serial protocol byte for byte, with a simulated clock charging the time
+# the bytes, the turnaround and the read timeouts would take. A benchmark
+# run then takes seconds, not hours.
+
+# Benchmark, run as a script: throughput and latency of a mix of reads and
+# writes at each fault rate.
+#   python fault_injection.py [--calls 2000] [--baudrate 115200] [--seed 1]
+
+import argparse
+from collections import Counter
+import random
+import sys
+import time
+
+from flight_recorder import crc16
+from roboclaw import Roboclaw
+from roboclaw_stub import Roboclaw_stub, SimulatedClock
+
+DROP = "drop"
+CORRUPT = "corrupt"
+DELAY = "delay"
+TRUNCATE = "truncate"
+STUCK = "stuck"
+allFaults = (DROP, CORRUPT, DELAY, TRUNCATE, STUCK)
+
+# Read commands SimulatedPort answers: command to method name and reply
+# layout, for the reads Roboclaw_stub implements. Anything else (such as a
+# command byte damaged by a fault) goes unanswered, as a controller
+# ignores a packet it cannot make sense of.
+_reads = dict((cmd, (name, layout)) for name, (cmd, layout, make) in Roboclaw._PIPELINED.items()
+	if hasattr(Roboclaw_stub, name))
+
+# A Roboclaw on the other end of a serial port, with the timing of the
+# link. Read commands are answered from a Roboclaw_stub. Write commands
+# with a valid CRC are acknowledged, their arguments are not interpreted.
+# Other packets get no reply.
+class SimulatedPort:
+	def __init__(self, stub=None, clock=None, baudrate=115200, turnaround=0.0005,
+			timeout=1.0, interCharTimeout=0.01, addresses=(0x80,)):
+		self.clock = clock if clock is not None else SimulatedClock()
+		self.stub = stub if stub is not None else Roboclaw_stub(clock=self.clock)
+		self.baudrate = baudrate
+		self.turnaround = turnaround
+		self.timeout = timeout
+		self.inter_byte_timeout = interCharTimeout
+		self.addresses = addresses
+		self._rx = bytearray()
+		# Writes taken, one per packet or pipelined batch.
+		self.writes = 0
+
+	def _byteTime(self, count):
+		return count * 10.0 / self.baudrate
+
+	# Bytes arrived and not yet read, as pyserial has it.
+	@property
+	def in_waiting(self):
+		return len(self._rx)
+
+	def flushInput(self):
+		del self._rx[:]
+
+	def write(self, data):
+		data = bytearray(data)
+		self.writes += 1
+		self.clock.sleep(self._byteTime(len(data)))
+		index = 0
+		while index + 1 < len(data):
+			address, cmd = data[index], data[index + 1]
+			request = data[index:index + 2]
+			if cmd == Roboclaw.Cmd.GETVERSION or cmd in _reads:
+				index += 2
+				if address not in self.addresses:
+					continue
+				if cmd == Roboclaw.Cmd.GETVERSION:
+					body = bytearray(self.stub.ReadVersion(address)[1].encode('ascii')) + bytearray(1)
+				else:
+					body = bytearray(self._readBody(address, *_reads[cmd]))
+			else:
+				# A write packet is the rest of what was written.
+				packet = data[index:]
+				index = len(data)
+				if (address not in self.addresses or len(packet) < 4 or
+					crc16(packet[:-2]) != (packet[-2] << 8 | packet[-1])):
+					continue
+				self._rx.append(0xFF)
+				continue
+			crc = crc16(request + body)
+			self._rx.extend(body)
+			self._rx.extend((crc >> 8, crc & 0xFF))
+		return len(data)
+
+	# Reply data of a read, as the controller would send it.
+	def _readBody(self, address, name, layout):
+		values = list(getattr(self.stub, name)(address)[1:])
+		if name.endswith('VelocityPID'):
+			values = [int(v * 65536) for v in values[:3]] + values[3:]
+		elif name.endswith('PositionPID'):
+			values = [int(v * 1024) for v in values[:3]] + values[3:]
+		elif name.endswith('MaxCurrent'):
+			values.append(0)
+		return layout.pack(*values)
+
+	# Like a serial port: returns what arrives, waiting up to the timeout
+	# for the first byte and the inter character timeout between bytes.
+	def read(self, size=1):
+		count = min(size, len(self._rx))
+		data = bytes(self._rx[:count])
+		del self._rx[:count]
+		if count:
+			self.clock.sleep(self.turnaround + self._byteTime(count))
+		if count < size:
+			self.clock.sleep(self.inter_byte_timeout if count else self.timeout)
+		return data
+
+# When a fault strikes.
+class FaultSchedule:
+	# kind: one of allFaults.
+	# rate: chance of striking each transaction.
+	# at: transaction numbers (counting from 1) to strike in any case.
+	# burst: transactions affected each time it strikes.
+	# delay: seconds a delayed reply is late.
+	# direction: "reply" or "request", for drop and corrupt.
+	def __init__(self, kind, rate=0.0, at=(), burst=1, delay=0.05, direction="reply"):
+		if kind not in allFaults:
+			raise ValueError("Unknown fault " + kind)
+		self.kind = kind
+		self.rate = rate
+		self.at = set(at)
+		self.burst = burst
+		self.delay = delay
+		self.direction = direction
+		self._until = 0
+
+	# Whether transaction number n is hit.
+	def strikes(self, n, rng):
+		if n <= self._until:
+			return True
+		if n in self.at or (self.rate and rng.random() < self.rate):
+			self._until = n + self.burst - 1
+			return True
+		return False
+
+class FaultyPort:
+	# port: the port to wrap.
+	# schedules: FaultSchedules to follow.
+	# sleep: how to wait out a delay, the simulated clock's sleep when
+	#   wrapping a SimulatedPort.
+	def __init__(self, port, schedules, seed=0, sleep=None):
+		self._port = port
+		self.schedules = schedules
+		self._random = random.Random(seed)
+		if sleep is None:
+			clock = getattr(port, 'clock', None)
+			sleep = clock.sleep if clock is not None else time.sleep
+		self._sleep = sleep
+		self.transactions = 0
+		# Fault kind to number of transactions it hit.
+		self.injected = Counter()
+		# Faults still to be applied to the reply of this transaction.
+		self._pending = {}
+		self._stuck = False
+		self._replyLeft = None
+		# Reply bytes still to pass before the dropped one.
+		self._dropIn = None
+
+	def _interCharTimeout(self):
+		value = getattr(self._port, 'inter_byte_timeout', None)
+		if value is None:
+			value = getattr(self._port, 'interCharTimeout', None)
+		return value or 0.0
+
+	def _damage(self, data, kind):
+		index = self._random.randrange(len(data))
+		if kind == DROP:
+			del data[index]
+		else:
+			data[index] ^= 1 << self._random.randrange(8)
+
+	# Take the dropped byte out of data once the reads get to it. Like on
+	# the wire, the byte behind it takes its place: the reply stream stays
+	# one byte out of step, into the following reads and pipelined replies.
+	def _drop(self, data, received, size):
+		waiting = getattr(self._port, 'in_waiting', 0)
+		if self._dropIn is None:
+			self._dropIn = self._random.randrange(len(data) + waiting)
+		if self._dropIn >= len(data):
+			self._dropIn -= len(data)
+			return
+		del data[self._dropIn]
+		del self._pending[DROP]
+		if received == size and waiting:
+			data.extend(self._port.read(1))
+
+	def write(self, data):
+		self.transactions += 1
+		self._pending = {}
+		self._dropIn = None
+		for schedule in self.schedules:
+			if schedule.strikes(self.transactions, self._random):
+				self.injected[schedule.kind] += 1
+				self._pending[schedule.kind] = schedule
+		self._stuck = STUCK in self._pending
+		self._replyLeft = None
+		if self._stuck:
+			return len(data)
+		data = bytearray(data)
+		for kind in (DROP, CORRUPT):
+			schedule = self._pending.get(kind)
+			if schedule is not None and schedule.direction == "request":
+				self._damage(data, kind)
+				del self._pending[kind]
+		return self._port.write(data)
+
+	def read(self, size=1):
+		data = bytearray(self._port.read(size))
+		received = len(data)
+		if self._stuck:
+			return b""
+		if data and DELAY in self._pending:
+			self._sleep(self._pending.pop(DELAY).delay)
+		if data and DROP in self._pending:
+			self._drop(data, received, size)
+		if data and CORRUPT in self._pending:
+			self._damage(data, CORRUPT)
+			del self._pending[CORRUPT]
+		if TRUNCATE in self._pending and data:
+			if self._replyLeft is None:
+				self._replyLeft = self._random.randrange(len(data))
+			data = data[:self._replyLeft]
+			self._replyLeft -= len(data)
+		# The port would have waited for the bytes taken out here.
+		if len(data) < received == size:
+			self._sleep(self._interCharTimeout())
+		return bytes(data)
+
+	def readinto(self, buf):
+		data = self.read(len(buf))
+		buf[:len(data)] = data
+		return len(data)
+
+	def flushInput(self):
+		return self._port.flushInput()
+
+	def __getattr__(self, name):
+		return getattr(self._port, name)
+
+# Calls of the benchmark: the reads a page or poll loop makes, a motion
+# command and a pipelined settings sweep.
+benchmarkCalls = [
+	('ReadEncM1', ()),
+	('ReadEncM2', ()),
+	('ReadSpeedM1', ()),
+	('GetConfig', ()),
+	('SpeedM1M2', (0, 0)),
+	('ReadM1VelocityPID', ()),
+	('ReadPipelined', (['ReadMinMaxMainVoltages', 'ReadPWMMode', 'ReadPinFunctions'],)),
+]
+
+def _correct(name, args, result, stub, address):
+	if name == 'ReadPipelined':
+		return all(_correct(read, (), value, stub, address) for read, value in zip(args[0], result))
+	if not isinstance(result, tuple):
+		return True
+	return tuple(result) == tuple(getattr(stub, name)(address))
+
+# Run calls round robin through benchmarkCalls on a Roboclaw whose port
+# has the given faults. Returns a dict of the figures, times in simulated
+# seconds.
+def benchmark(schedules, calls=2000, baudrate=115200, seed=1, retries=3, address=0x80):
+	clock = SimulatedClock()
+	port = SimulatedPort(clock=clock, baudrate=baudrate)
+	faulty = FaultyPort(port, schedules, seed, clock.sleep)
+	rc = Roboclaw("simulated", baudrate, port.inter_byte_timeout, retries)
+	rc._port = faulty
+	latencies = []
+	failed = wrong = 0
+	for index in range(calls):
+		name, args = benchmarkCalls[index % len(benchmarkCalls)]
+		start = clock.time()
+		result = getattr(rc, name)(address, *args)
+		latencies.append(clock.time() - start)
+		if name == 'ReadPipelined':
+			ok = all(value[0] for value in result)
+		else:
+			ok = result is True or (isinstance(result, tuple) and result[0])
+		if not ok:
+			failed += 1
+		elif not _correct(name, args, result, port.stub, address):
+			wrong += 1
+	latencies.sort()
+	def percentile(fraction):
+		return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+	elapsed = clock.time()
+	return {
+		'calls': calls,
+		'perSecond': calls / elapsed,
+		'failed': failed,
+		'wrong': wrong,
+		'writes': port.writes,
+		'injected': sum(faulty.injected.values()),
+		'p50': percentile(0.5),
+		'p95': percentile(0.95),
+		'p99': percentile(0.99),
+	}
+
+def main():
+	parser = argparse.ArgumentParser(description="Throughput and latency of the Roboclaw driver with link faults")
+	parser.add_argument("--calls", type=int, default=2000, help="calls per run")
+	parser.add_argument("--baudrate", type=int, default=115200)
+	parser.add_argument("--seed", type=int, default=1)
+	parser.add_argument("--rates", default="0.001,0.01,0.05,0.1", help="fault rates to try, comma separated")
+	args = parser.parse_args()
+
+	rates = [float(rate) for rate in args.rates.split(",")]
+	runs = [("none", 0.0, [])]
+	for kind in allFaults:
+		for rate in rates:
+			# A stuck line lasts a few transactions once it strikes.
+			runs.append((kind, rate, [FaultSchedule(kind, rate, burst=5 if kind == STUCK else 1)]))
+		if kind in (DROP, CORRUPT):
+			runs.append((kind + " req", rates[-1], [FaultSchedule(kind, rates[-1], direction="request")]))
+
+	print("{0:12} {1:>6} {2:>9} {3:>7} {4:>6} {5:>7} {6:>8} {7:>8} {8:>8}".format(
+		"fault", "rate", "calls/s", "failed", "wrong", "writes", "p50 ms", "p95 ms", "p99 ms"))
+	for kind, rate, schedules in runs:
+		figures = benchmark(schedules, args.calls, args.baudrate, args.seed)
+		print("{0:12} {1:6.3f} {2:9.1f} {3:7} {4:6} {5:7} {6:8.2f} {7:8.2f} {8:8.2f}".format(
+			kind, rate, figures['perSecond'], figures['failed'], figures['wrong'], figures['writes'],
+			figures['p50'] * 1000, figures['p95'] * 1000, figures['p99'] * 1000))
+	print("failed: calls that returned failure after retries; wrong: calls that succeeded with wrong values;")
+	print("writes: packets sent for {0} calls, retries included. Times are simulated.".format(args.calls))
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
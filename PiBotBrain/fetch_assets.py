@@ -0,0 +1,59 @@
+# Download the third party CSS the pages use into static/vendor, so the
+# kiosk can load every page without network access. Run once while online,
+# e.g. during setup:
+#   python fetch_assets.py
+# Each file is checked against the same subresource integrity hash the
+# pages used to give the CDN. Afterwards every compressible file under
+# static/ gets a precompressed .gz copy.
+
+import base64
+import hashlib
+import os
+import sys
+
+try:
+	from urllib.request import urlopen
+except ImportError:
+	# Python 2
+	from urllib2 import urlopen
+
+from static_assets import compressAssets
+
+staticFolder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+# (file under static/, URL, SRI hash)
+vendorAssets = [
+	("vendor/bootstrap.min.css",
+		"https://maxcdn.bootstrapcdn.com/bootstrap/4.0.0/css/bootstrap.min.css",
+		"sha384-Gn5384xqQ1aoWXA+058RXPxPg6fy4IWvTNh0E263XmFcJlSAwiGgFAW/dAiS6JXm"),
+]
+
+def integrity(data, algorithm):
+	digest = hashlib.new(algorithm, data).digest()
+	return "{0}-{1}".format(algorithm, base64.b64encode(digest).decode("ascii"))
+
+def fetch(filename, url, expected):
+	data = urlopen(url).read()
+	actual = integrity(data, expected.split("-", 1)[0])
+	if actual != expected:
+		raise ValueError("{0} integrity mismatch: expected {1} got {2}".format(url, expected, actual))
+	path = os.path.join(staticFolder, filename)
+	if not os.path.isdir(os.path.dirname(path)):
+		os.makedirs(os.path.dirname(path))
+	with open(path, "wb") as f:
+		f.write(data)
+
+def main():
+	failed = False
+	for filename, url, expected in vendorAssets:
+		try:
+			fetch(filename, url, expected)
+			print("Fetched " + filename)
+		except Exception as e:
+			print("Could not fetch {0}: {1}".format(filename, e))
+			failed = True
+	print("Compressed {0} file(s)".format(compressAssets(staticFolder)))
+	return 1 if failed else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,244 @@
+# Always-on record of the most recent Roboclaw packet serial transactions,
+# kept so an intermittent link failure can be examined after the fact
+# instead of only seeing the (0,0) tuple a failed read returns.
+
+# Storage is preallocated when the recorder is created: parallel arrays hold
+# the per-transaction fields and two flat bytearrays hold the raw bytes sent
+# and received, one fixed size slot per transaction. Recording a transaction
+# only stores a handful of numbers and copies bytes into its slot. The work
+# of classifying results (CRC check, retry detection) is deferred until the
+# recorder is dumped.
+
+from array import array
+import json
+import signal
+import sys
+import time
+
+# Result codes reported by dump()
+RESULT_OK = "ok"
+RESULT_CRC = "crc_mismatch"
+RESULT_NACK = "nack"
+RESULT_TIMEOUT = "timeout"
+RESULT_TRUNCATED = "truncated"
+
+# Roboclaw packet serial checksum: CRC16 with polynomial 0x1021, seed 0.
+def crc16(data):
+	crc = 0
+	for byte in bytearray(data):
+		crc = crc ^ (byte << 8)
+		for bit in range(0, 8):
+			if crc & 0x8000:
+				crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+			else:
+				crc = (crc << 1) & 0xFFFF
+	return crc
+
+# Stands in for the serial port object of a Roboclaw so every byte written
+# and read is copied into the recorder. Anything else is passed through.
+class RecordingPort:
+	def __init__(self, port, recorder):
+		self._port = port
+		self._recorder = recorder
+
+	def write(self, data):
+		self._recorder.sent(data)
+		return self._port.write(data)
+
+	def read(self, size=1):
+		data = self._port.read(size)
+		self._recorder.received(data)
+		return data
+
+	def readinto(self, buf):
+		readinto = getattr(self._port, 'readinto', None)
+		if readinto is None:
+			data = self._port.read(len(buf))
+			count = len(data)
+			buf[:count] = data
+		else:
+			count = readinto(buf) or 0
+		self._recorder.received(buf[:count])
+		return count
+
+	def flushInput(self):
+		return self._port.flushInput()
+
+	# The wrapped port, for bytes the caller records itself.
+	@property
+	def unrecorded(self):
+		return self._port
+
+	def __getattr__(self, name):
+		return getattr(self._port, name)
+
+class FlightRecorder:
+	'Fixed size ring of recent Roboclaw transactions'
+
+	def __init__(self, size=256, slotBytes=64):
+		self.size = size
+		self.slotBytes = slotBytes
+
+		self.timestamps = array('d', [0.0]) * size
+		self.durations = array('d', [0.0]) * size
+		self.addresses = array('B', [0]) * size
+		self.commands = array('B', [0]) * size
+		self.outLengths = array('H', [0]) * size
+		self.inLengths = array('H', [0]) * size
+		self.outBytes = bytearray(size * slotBytes)
+		self.inBytes = bytearray(size * slotBytes)
+
+		# Total number of transactions ever started. The slot in use is
+		# always (count-1) % size.
+		self.count = 0
+		self._slot = 0
+		self._start = 0.0
+
+	# Make this recorder see all traffic of the given Roboclaw object. Must be
+	# called after Open() since that is when the serial port is created.
+	# Objects without a serial port (like Roboclaw_stub) are left alone.
+	def attach(self, rc):
+		if not hasattr(rc, '_port'):
+			return False
+		if not isinstance(rc._port, RecordingPort):
+			rc._port = RecordingPort(rc._port, self)
+		rc._recorder = self
+		return True
+
+	# Called by Roboclaw._sendcommand at the start of every attempt,
+	# including retries.
+	def begin(self, address, command):
+		slot = self.count % self.size
+		self.count += 1
+		self._slot = slot
+		self._start = now = time.time()
+		self.timestamps[slot] = now
+		self.durations[slot] = 0.0
+		self.addresses[slot] = address & 0xFF
+		self.commands[slot] = command & 0xFF
+		self.outLengths[slot] = 0
+		self.inLengths[slot] = 0
+
+	def sent(self, data):
+		if self.count:
+			self.outLengths[self._slot] = self._copy(self.outBytes, self.outLengths[self._slot], data)
+
+	def received(self, data):
+		if self.count:
+			self.inLengths[self._slot] = self._copy(self.inBytes, self.inLengths[self._slot], data)
+
+	# Copy data into the current slot of the given buffer, starting at
+	# offset. Bytes beyond the slot size are counted but not kept.
+	def _copy(self, buf, offset, data):
+		length = len(data)
+		if offset < self.slotBytes:
+			start = self._slot * self.slotBytes + offset
+			keep = min(length, self.slotBytes - offset)
+			buf[start:start+keep] = data[:keep]
+		self.durations[self._slot] = time.time() - self._start
+		return min(offset + length, 0xFFFF)
+
+	# Figure out how a transaction went from its raw bytes alone.
+	# Read commands send only address and command, then receive data
+	# followed by CRC. Write commands send data with CRC and receive
+	# a single 0xFF acknowledgement.
+	def _classify(self, out, received, inLength):
+		if inLength == 0:
+			return RESULT_TIMEOUT
+		if inLength > self.slotBytes:
+			return RESULT_TRUNCATED
+		if len(out) > 2:
+			if inLength == 1 and received[0] == 0xFF:
+				return RESULT_OK
+			return RESULT_NACK
+		# Some reply bytes arrived, but not even a CRC's worth.
+		if inLength < 3:
+			return RESULT_TRUNCATED
+		expected = crc16(out + received[:-2])
+		if expected != (received[-2] << 8 | received[-1]):
+			return RESULT_CRC
+		return RESULT_OK
+
+	# The recorded transaction with the given index as a dict, its retry
+	# count left at 0.
+	def _record(self, index):
+		slot = index % self.size
+		base = slot * self.slotBytes
+		outLength = self.outLengths[slot]
+		inLength = self.inLengths[slot]
+		out = self.outBytes[base:base + min(outLength, self.slotBytes)]
+		received = self.inBytes[base:base + min(inLength, self.slotBytes)]
+		return {
+			"index": index,
+			"timestamp": self.timestamps[slot],
+			"duration": self.durations[slot],
+			"address": self.addresses[slot],
+			"command": self.commands[slot],
+			"out": "".join("{0:02x}".format(b) for b in out),
+			"in": "".join("{0:02x}".format(b) for b in received),
+			"outLength": outLength,
+			"inLength": inLength,
+			"result": self._classify(out, received, inLength),
+			"retry": 0,
+		}
+
+	# A retry is the same command to the same address immediately after a
+	# failed attempt.
+	def _isRetry(self, previous, record):
+		return (previous["result"] != RESULT_OK and
+			previous["address"] == record["address"] and
+			previous["command"] == record["command"])
+
+	# Returns the recorded transactions, oldest first, as a list of dicts.
+	# first: index of the oldest transaction wanted, for callers that keep
+	# up with the recorder (ones already overwritten are skipped).
+	def dump(self, first=0):
+		first = max(first, self.count - self.size)
+		records = []
+		previous = None
+		for index in range(first, self.count):
+			record = self._record(index)
+			if previous is not None and self._isRetry(previous, record):
+				record["retry"] = previous["retry"] + 1
+			records.append(record)
+			previous = record
+		return records
+
+	# Short human readable description of the most recent transaction, for
+	# inclusion in error messages. Returns None if nothing was recorded.
+	# Only that transaction is classified, plus the failed attempts right
+	# before it when it is a retry.
+	def last(self):
+		if self.count == 0:
+			return None
+		record = self._record(self.count - 1)
+		oldest = max(0, self.count - self.size)
+		current = record
+		for index in range(self.count - 2, oldest - 1, -1):
+			previous = self._record(index)
+			if not self._isRetry(previous, current):
+				break
+			record["retry"] += 1
+			current = previous
+		return "last transaction: address {0} command {1} {2} retry {3} ({4:.1f} ms)".format(
+			record["address"], record["command"], record["result"], record["retry"],
+			record["duration"] * 1000)
+
+	def write(self, stream):
+		for record in self.dump():
+			stream.write(json.dumps(record, sort_keys=True))
+			stream.write("\n")
+		stream.flush()
+
+	# Dump to stderr on SIGUSR1. Signal handlers can only be installed from
+	# the main thread, so this quietly does nothing anywhere else.
+	def installSignalHandler(self, signum=None):
+		if signum is None:
+			signum = getattr(signal, 'SIGUSR1', None)
+		if signum is None:
+			return False
+		try:
+			signal.signal(signum, lambda s, frame: self.write(sys.stderr))
+		except ValueError:
+			return False
+		return True
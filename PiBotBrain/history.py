@@ -0,0 +1,214 @@
+# Recent encoder and speed history of each Roboclaw address, for charts.
+
+# A SampleHistory reads both encoders and both speeds of an address every
+# period seconds in a background thread and keeps the samples in a fixed
+# size ring (preallocated arrays, like the flight recorder). Addresses are
+# only sampled while someone is looking: watch() is called by each chart
+# request, and an address nobody asked about for idle seconds is left
+# alone, so the history costs no serial traffic when no chart is open.
+# With no address to sample the thread sleeps until the next watch().
+
+# series() returns chart ready data: each series downsampled with Largest
+# Triangle Three Buckets (LTTB) to about one point per pixel of the chart.
+# LTTB keeps the peaks and steps a plain decimation would skip, so an
+# overshoot during PID tuning still shows however long the window is.
+# Downsampling needs numpy; without it series() raises HistoryError. It is
+# imported on the first chart request rather than with this module, so it
+# adds nothing to the app's startup.
+
+from array import array
+from collections import OrderedDict
+import threading
+import time
+
+# Values kept per sample, in ring order.
+seriesNames = ("m1enc", "m2enc", "m1speed", "m2speed")
+
+class HistoryError(ValueError):
+	pass
+
+def _numpy():
+	try:
+		import numpy
+	except ImportError:
+		raise HistoryError("Charts need numpy (pip install numpy)")
+	return numpy
+
+# Largest Triangle Three Buckets downsampling of the points x, y (numpy
+# arrays, x ascending) to threshold points. The first and last point are
+# kept; every bucket in between contributes the point forming the largest
+# triangle with the point picked from the bucket before and the average of
+# the bucket after. Returns the picked x and y.
+def lttb(x, y, threshold):
+	numpy = _numpy()
+	count = len(x)
+	if threshold >= count or threshold < 3:
+		return x, y
+	every = (count - 2) / float(threshold - 2)
+	# Bucket i holds points edges[i] up to edges[i+1]. The last edge is the
+	# final point, which acts as the bucket after the last real one.
+	edges = numpy.append(numpy.floor(numpy.arange(threshold - 1) * every).astype(numpy.intp) + 1, count)
+	sizes = numpy.diff(edges)
+	averageX = numpy.add.reduceat(x, edges[:-1]) / sizes
+	averageY = numpy.add.reduceat(y, edges[:-1]) / sizes
+
+	picked = numpy.empty(threshold, dtype=numpy.intp)
+	picked[0] = 0
+	picked[-1] = count - 1
+	previous = 0
+	for bucket in range(threshold - 2):
+		start = edges[bucket]
+		end = edges[bucket + 1]
+		nextX = averageX[bucket + 1]
+		nextY = averageY[bucket + 1]
+		areas = numpy.abs((x[previous] - nextX) * (y[start:end] - y[previous])
+			- (x[previous] - x[start:end]) * (nextY - y[previous]))
+		previous = start + int(numpy.argmax(areas))
+		picked[bucket + 1] = previous
+	return x[picked], y[picked]
+
+class _Ring:
+	def __init__(self, size):
+		self.size = size
+		self.times = array('d', [0.0]) * size
+		self.values = [array('d', [0.0]) * size for name in seriesNames]
+		# Total number of samples ever added.
+		self.count = 0
+
+	def add(self, timestamp, values):
+		slot = self.count % self.size
+		self.times[slot] = timestamp
+		for column, value in zip(self.values, values):
+			column[slot] = value
+		self.count += 1
+
+	# Copies of the times and the given columns, oldest first.
+	def ordered(self, columns):
+		numpy = _numpy()
+		stored = min(self.count, self.size)
+		split = self.count % self.size if self.count > self.size else 0
+		def unroll(column):
+			data = numpy.array(column[:stored])
+			return numpy.concatenate((data[split:], data[:split]))
+		return unroll(self.times), [unroll(self.values[index]) for index in columns]
+
+class SampleHistory:
+	'Encoder and speed history of the Roboclaw addresses being charted'
+
+	# rc: Roboclaw API object, period: seconds between samples of an
+	# address, size: samples kept per address (the default holds ten
+	# minutes at 0.1 s), idle: seconds without a chart request before an
+	# address is no longer sampled.
+	def __init__(self, rc, period=0.1, size=6000, idle=30.0):
+		self.rc = rc
+		self.period = period
+		self.size = size
+		self.idle = idle
+		self._rings = {}
+		# Address to time of the last watch() call.
+		self._watched = {}
+		self._lock = threading.Lock()
+		# Wakes the sampling thread when there is something to sample.
+		self._condition = threading.Condition(self._lock)
+		self._stopped = False
+		self._thread = None
+		# Samples skipped because the read failed or raised.
+		self.failed = 0
+
+	# Keep sampling the address for the next idle seconds.
+	def watch(self, address):
+		with self._lock:
+			self._watched[address] = time.time()
+			if address not in self._rings:
+				self._rings[address] = _Ring(self.size)
+			self._condition.notify()
+
+	# Read one sample of the address. A failed read skips the sample rather
+	# than storing a bogus zero the chart would show as a spike.
+	def sample(self, address):
+		results = readMotion(self.rc, address)
+		if not all(result[0] for result in results):
+			return False
+		enc1, enc2, speed1, speed2 = results
+		values = (enc1[1], enc2[1], signedSpeed(speed1), signedSpeed(speed2))
+		with self._lock:
+			self._rings[address].add(time.time(), values)
+		return True
+
+	# Downsampled history of the address over the last seconds. names picks
+	# from seriesNames, width is the number of points wanted per series.
+	# Returns an OrderedDict of name to (times, values) lists, times in
+	# seconds relative to now (so all negative).
+	def series(self, address, names, seconds=60.0, width=300):
+		_numpy()
+		unknown = [name for name in names if name not in seriesNames]
+		if unknown:
+			raise HistoryError("Unknown series " + ", ".join(unknown))
+		if width < 3:
+			raise HistoryError("Chart width must be at least 3")
+		self.watch(address)
+		with self._lock:
+			times, columns = self._rings[address].ordered([seriesNames.index(name) for name in names])
+		now = time.time()
+		recent = times >= now - seconds
+		times = times[recent] - now
+		result = OrderedDict()
+		for name, values in zip(names, columns):
+			x, y = lttb(times, values[recent], width)
+			result[name] = (x.tolist(), y.tolist())
+		return result
+
+	def start(self):
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def stop(self):
+		with self._lock:
+			self._stopped = True
+			self._condition.notify()
+		if self._thread is not None:
+			self._thread.join()
+
+	def _run(self):
+		while True:
+			with self._lock:
+				while True:
+					if self._stopped:
+						return
+					cutoff = time.time() - self.idle
+					addresses = [address for address, watched in self._watched.items() if watched >= cutoff]
+					if addresses:
+						break
+					self._condition.wait()
+			start = time.time()
+			for address in addresses:
+				# One bad read, or a Roboclaw object that throws, costs a
+				# sample and not the sampling thread.
+				try:
+					ok = self.sample(address)
+				except Exception:
+					ok = False
+				if not ok:
+					self.failed += 1
+			with self._lock:
+				# A watch() meanwhile must not cut the period short.
+				while not self._stopped:
+					left = start + self.period - time.time()
+					if left <= 0:
+						break
+					self._condition.wait(left)
+
+# Results of ReadEncM1, ReadEncM2, ReadSpeedM1 and ReadSpeedM2, in one
+# batch if the Roboclaw object can.
+def readMotion(rc, address):
+	reads = ["ReadEncM1", "ReadEncM2", "ReadSpeedM1", "ReadSpeedM2"]
+	pipelined = getattr(rc, "ReadPipelined", None)
+	if pipelined is not None:
+		return pipelined(address, reads)
+	return [getattr(rc, read)(address) for read in reads]
+
+# Speed from a ReadSpeedM1/M2 result as a signed number. The direction is
+# in bit 0 of the status byte.
+def signedSpeed(result):
+	return -abs(result[1]) if result[2] & 1 else result[1]
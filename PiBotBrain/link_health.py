@@ -0,0 +1,346 @@
+# Watches the quality of a Roboclaw serial link and adapts the link to it.
+
+# On its own a failing link is invisible. A CRC mismatch makes a read return
+# (0,0) and a missing acknowledgement makes a write return False, the same
+# as any other failure. LinkHealth follows the transactions seen by the
+# flight recorder. Over a sliding window it keeps:
+# - the error rate, by kind: CRC mismatch, NACK, timeout, or a reply cut
+#   short;
+# - the latency of successful transactions;
+# - the number of timeouts.
+# A link whose error rate reaches degradedErrorRate is flagged "degraded".
+# A link where the last several transactions all failed is flagged "down".
+# Traffic to addresses that never answered (a mistyped address, discovery)
+# is not counted.
+
+# Within the configured bounds it then adapts the link.
+# Baud rate:
+# - Too many errors step the rate down one notch. A long clean run steps
+#   it up one notch.
+# - The Roboclaw is switched with the packet serial baud bits (5-7) of
+#   its config word, then the port follows and the link is probed. If
+#   the probe fails, both ends go back to the old rate, and the failed
+#   rate is not tried again for a while.
+# - The new rate is not saved to NVM, so a power cycle brings back the
+#   saved rate. A link that goes down is recovered by trying each allowed
+#   rate in turn.
+# Inter character timeout:
+# - Replies cut short mean the port gave up waiting between bytes too
+#   early, so the timeout is doubled.
+# - After a clean run it is halved again, down to a few character times,
+#   so a lost byte is noticed sooner.
+
+# Baud rates only matter on a UART: the Raspberry Pi serial pins or a
+# USB-serial bridge. A Roboclaw on its own USB port ignores them, so there
+# only the timeout is adapted. Units in multi-unit mode share the bus and
+# its rate, so the baud rate is also left alone when more than one address
+# answers on the port.
+
+from collections import OrderedDict, deque
+import threading
+import time
+
+from flight_recorder import RESULT_CRC, RESULT_NACK, RESULT_OK, RESULT_TIMEOUT, RESULT_TRUNCATED
+from roboclaw import Roboclaw
+
+# Reply received, but fewer bytes than the command returns.
+RESULT_PARTIAL = "partial"
+
+# Packet serial baud rates and their value in the config word.
+configBaudRates = OrderedDict([
+	(2400, 0x0000), (9600, 0x0020), (19200, 0x0040), (38400, 0x0060),
+	(57600, 0x0080), (115200, 0x00A0), (230400, 0x00C0), (460800, 0x00E0)])
+CONFIG_BAUD_MASK = 0x00E0
+CONFIG_MODE_MASK = 0x0003
+CONFIG_PACKET_SERIAL = 0x0003
+CONFIG_MULTI_UNIT = 0x8000
+
+# Bytes in the reply to each fixed layout read command, data plus CRC.
+_replyLengths = dict((cmd, layout.size + 2) for cmd, layout, make in Roboclaw._PIPELINED.values())
+
+# Roboclaw's own USB port, as opposed to a UART.
+def isUsbPort(comport):
+	return "ttyACM" in comport or "usbmodem" in comport
+
+class LinkHealth:
+	# rc: Roboclaw on a serial port, with recorder attached to it.
+	# lock: lock serializing all use of rc (LockedRoboclaw.lock), held while
+	#   the link is checked and adapted.
+	# minBaud, maxBaud: bounds for the baud rate.
+	# minInterCharTimeout, maxInterCharTimeout: bounds for the inter
+	#   character timeout, in seconds.
+	# window: number of recent transactions the statistics cover.
+	def __init__(self, rc, recorder, lock=None, minBaud=38400, maxBaud=460800,
+			minInterCharTimeout=0.002, maxInterCharTimeout=0.1, window=200):
+		self.rc = rc
+		self.recorder = recorder
+		self.lock = lock if lock is not None else threading.RLock()
+		self.baudRates = [rate for rate in configBaudRates if minBaud <= rate <= maxBaud]
+		self.minInterCharTimeout = minInterCharTimeout
+		self.maxInterCharTimeout = maxInterCharTimeout
+		self.adaptBaud = not isUsbPort(rc.comport)
+
+		# Thresholds, as fractions of the transactions in the window.
+		self.degradedErrorRate = 0.01
+		self.stepDownErrorRate = 0.05
+		# Transactions needed in the window before stepping down.
+		self.minSamples = 50
+		# Consecutive failures meaning the link is down.
+		self.downAfter = 10
+		# Consecutive successes before stepping up or halving the timeout.
+		self.stepUpAfter = 2000
+		self.shrinkAfter = 500
+		# Seconds before a rate that failed is tried again, and between
+		# attempts to recover a down link.
+		self.retryRateAfter = 600.0
+		self.recoverEvery = 10.0
+		# Port read timeout while probing, in seconds.
+		self.probeTimeout = 0.05
+
+		self.results = deque(maxlen=window)
+		self.latencies = deque(maxlen=window)
+		self.totals = OrderedDict((result, 0) for result in
+			(RESULT_OK, RESULT_CRC, RESULT_NACK, RESULT_TIMEOUT, RESULT_PARTIAL, RESULT_TRUNCATED))
+		# Addresses that have answered on this port.
+		self.addresses = set()
+		# Consecutive successes, overall and since the timeout last changed.
+		self.clean = 0
+		self._cleanSinceTune = 0
+		self._partials = 0
+		self.failedRates = {}
+		self._lastRecover = 0.0
+		self.events = deque(maxlen=20)
+		self._next = recorder.count
+		self._thread = None
+		self._stopped = threading.Event()
+
+	# The serial port itself, past the flight recorder.
+	@property
+	def port(self):
+		return getattr(self.rc._port, 'unrecorded', self.rc._port)
+
+	def _event(self, message):
+		self.events.append((time.time(), message))
+
+	# How one recorded transaction went.
+	def _result(self, record):
+		result = record["result"]
+		if result == RESULT_OK or record["inLength"] == 0:
+			return result
+		expected = 1 if record["outLength"] > 2 else _replyLengths.get(record["command"])
+		if expected is not None and record["inLength"] < expected:
+			return RESULT_PARTIAL
+		return result
+
+	# Take in the transactions recorded since the last call.
+	def update(self):
+		with self.lock:
+			records = self.recorder.dump(self._next)
+			self._next = self.recorder.count
+			for record in records:
+				result = self._result(record)
+				if result == RESULT_OK:
+					self.addresses.add(record["address"])
+					self.latencies.append(record["duration"])
+					self.clean += 1
+					self._cleanSinceTune += 1
+				elif record["address"] in self.addresses:
+					self.clean = 0
+					self._cleanSinceTune = 0
+					if result == RESULT_PARTIAL:
+						self._partials += 1
+				else:
+					continue
+				self.results.append(result)
+				self.totals[result] += 1
+
+	def errorRate(self):
+		if not self.results:
+			return 0.0
+		return 1.0 - float(self.results.count(RESULT_OK)) / len(self.results)
+
+	def state(self):
+		recent = list(self.results)[-self.downAfter:]
+		if len(recent) == self.downAfter and RESULT_OK not in recent:
+			return "down"
+		if self.errorRate() >= self.degradedErrorRate:
+			return "degraded"
+		return "good"
+
+	def stats(self):
+		self.update()
+		latencies = sorted(self.latencies)
+		def percentile(fraction):
+			if not latencies:
+				return None
+			return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000
+		window = OrderedDict((result, self.results.count(result)) for result in self.totals)
+		return OrderedDict([
+			("port", self.rc.comport),
+			("state", self.state()),
+			("baudrate", self.rc.rate),
+			("interCharTimeout", self.rc.timeout),
+			("adaptBaud", self.adaptBaud and len(self.addresses) <= 1),
+			("transactions", len(self.results)),
+			("errorRate", self.errorRate()),
+			("window", window),
+			("totals", self.totals),
+			("latencyMs", OrderedDict([("p50", percentile(0.5)), ("p95", percentile(0.95))])),
+			("events", ["{0}: {1}".format(time.strftime("%H:%M:%S", time.localtime(when)), message)
+				for when, message in self.events]),
+		])
+
+	# Bring the statistics up to date and adapt the link if called for.
+	def check(self):
+		with self.lock:
+			self.update()
+			state = self.state()
+			if self.adaptBaud and len(self.addresses) == 1:
+				if state == "down":
+					if time.time() - self._lastRecover >= self.recoverEvery:
+						self._lastRecover = time.time()
+						self.recover()
+				elif len(self.results) >= self.minSamples and self.errorRate() >= self.stepDownErrorRate:
+					self._stepBaud(-1, "{0:.0%} errors".format(self.errorRate()))
+				elif self.clean >= self.stepUpAfter:
+					self._stepBaud(1, "{0} clean transactions".format(self.clean))
+			self._tuneInterCharTimeout()
+
+	def _tuneInterCharTimeout(self):
+		current = self.rc.timeout
+		if self._partials:
+			value = min(current * 2, self.maxInterCharTimeout)
+			reason = "{0} replies cut short".format(self._partials)
+		elif self._cleanSinceTune >= self.shrinkAfter:
+			# Never below four character times at the current rate.
+			value = max(current / 2, self.minInterCharTimeout, 40.0 / self.rc.rate)
+			reason = "{0} clean transactions".format(self._cleanSinceTune)
+		else:
+			return
+		self._partials = 0
+		self._cleanSinceTune = 0
+		if value != current:
+			self.setInterCharTimeout(value)
+			self._event("inter character timeout {0:.1f} ms ({1})".format(value * 1000, reason))
+
+	def setInterCharTimeout(self, value):
+		port = self.port
+		if hasattr(port, 'inter_byte_timeout'):
+			port.inter_byte_timeout = value
+		else:
+			port.interCharTimeout = value
+		self.rc.timeout = value
+
+	def _setPortBaud(self, rate):
+		self.port.baudrate = rate
+		self.rc.rate = rate
+
+	def _stepBaud(self, direction, reason):
+		rates = self.baudRates
+		if not rates:
+			return
+		# Position of the current rate, or of the nearest allowed one.
+		index = min(range(len(rates)), key=lambda i: abs(rates[i] - self.rc.rate))
+		if rates[index] == self.rc.rate or (rates[index] > self.rc.rate) != (direction > 0):
+			index += direction
+		if index < 0 or index >= len(rates):
+			return
+		rate = rates[index]
+		if direction < 0:
+			self.failedRates[self.rc.rate] = time.time()
+		elif time.time() - self.failedRates.get(rate, 0) < self.retryRateAfter:
+			self.clean = 0
+			return
+		self.switchBaud(rate, reason)
+
+	# Read the config word a few times at the current rate. expected: value
+	# it must read, or None for any.
+	def _probe(self, address, expected=None, count=3):
+		port = self.port
+		timeout = port.timeout
+		port.timeout = self.probeTimeout
+		try:
+			for i in range(count):
+				config = self.rc.GetConfig(address)
+				if not config[0] or (expected is not None and config[1] != expected):
+					return False
+			return True
+		finally:
+			port.timeout = timeout
+
+	# Start over with statistics for a new link setting.
+	def _reset(self):
+		self._next = self.recorder.count
+		self.results.clear()
+		self.latencies.clear()
+		self.clean = 0
+		self._cleanSinceTune = 0
+		self._partials = 0
+
+	# Move both ends of the link to the given baud rate. Returns True if the
+	# link works at the new rate, otherwise it is back at the old one.
+	def switchBaud(self, rate, reason="requested"):
+		with self.lock:
+			address = min(self.addresses)
+			old = self.rc.rate
+			config = self.rc.GetConfig(address)
+			if not config[0]:
+				return False
+			config = config[1]
+			if config & CONFIG_MODE_MASK != CONFIG_PACKET_SERIAL or config & CONFIG_MULTI_UNIT:
+				self.adaptBaud = False
+				self._event("baud rate left alone, config {0:#06x} is not single unit packet serial".format(config))
+				return False
+			newConfig = (config & ~CONFIG_BAUD_MASK) | configBaudRates[rate]
+			# Acknowledged at the old rate, if at all.
+			self.rc.SetConfig(address, newConfig)
+			time.sleep(0.02)
+			self._setPortBaud(rate)
+			if self._probe(address, newConfig):
+				self._reset()
+				self._event("baud rate {0} -> {1} ({2})".format(old, rate, reason))
+				return True
+
+			# No answer at the new rate. Either the Roboclaw stayed where it
+			# was, or it switched and the cable cannot carry the new rate, in
+			# which case it is told to switch back.
+			self._setPortBaud(old)
+			if not self._probe(address):
+				self._setPortBaud(rate)
+				self.rc.SetConfig(address, config)
+				time.sleep(0.02)
+				self._setPortBaud(old)
+				self._probe(address)
+			self.failedRates[rate] = time.time()
+			self._reset()
+			self._event("baud rate {0} failed, staying at {1} ({2})".format(rate, old, reason))
+			return False
+
+	# Find the Roboclaw again after the link went down, trying the current
+	# rate first and then every allowed rate. Returns True if it answered.
+	def recover(self):
+		with self.lock:
+			address = min(self.addresses)
+			old = self.rc.rate
+			for rate in [old] + [rate for rate in reversed(self.baudRates) if rate != old]:
+				self._setPortBaud(rate)
+				if self._probe(address, count=1):
+					self._reset()
+					if rate != old:
+						self._event("link recovered at baud rate {0}, was {1}".format(rate, old))
+					return True
+			self._setPortBaud(old)
+			self._event("no answer at any baud rate")
+			return False
+
+	# Check the link every interval seconds on a background thread.
+	def start(self, interval=1.0):
+		def run():
+			while not self._stopped.wait(interval):
+				self.check()
+		self._thread = threading.Thread(target=run)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def stop(self):
+		self._stopped.set()
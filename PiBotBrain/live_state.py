@@ -0,0 +1,174 @@
+# Shared memory segment holding the latest live values of every Roboclaw
+# on a port, so other processes can read them without serial I/O.
+
+# The process that owns the Roboclaw link runs a LiveStatePoller, which
+# reads encoders, speeds, currents, battery voltage and error status in a
+# loop and stores them here. Web workers, loggers and control code open a
+# LiveStateReader on the same file and read the current values in
+# microseconds.
+
+# Each address has a fixed size slot guarded by a sequence counter (a
+# seqlock): the writer makes the counter odd before changing the slot and
+# even again after. A reader copies the slot and retries if the counter was
+# odd or changed meanwhile, so readers never block the writer. A slot that
+# stays odd means the writer died part way through an update; a read then
+# gives up after timeout seconds and raises LiveStateError.
+
+# A read that failed is stored as 0 with its bit clear in the valid field
+# (bit n for the n-th value after the timestamp, as in telemetry frames),
+# and LiveStateReader returns None for it, so a failed encoder read is not
+# mistaken for an encoder at 0.
+
+from collections import namedtuple
+import mmap
+import os
+import struct
+import threading
+import time
+
+firstAddress = 128
+addressCount = 8
+
+_MAGIC = b"RCLS"
+_VERSION = 2
+_HEADER = struct.Struct("<4sHHH")
+_SEQUENCE = struct.Struct("<L")
+_SAMPLE = struct.Struct("<diiiihhBBHLH")
+_SLOT_SIZE = 64
+_SLOT_OFFSET = 16
+_SIZE = _SLOT_OFFSET + addressCount * _SLOT_SIZE
+
+LiveSample = namedtuple("LiveSample", "timestamp m1enc m2enc m1speed m2speed "
+	"m1current m2current m1encStatus m2encStatus mainBattery error valid")
+
+class LiveStateError(ValueError):
+	pass
+
+def defaultPath(port):
+	directory = "/dev/shm" if os.path.isdir("/dev/shm") else "/tmp"
+	return os.path.join(directory, "roboclaw-{0}.state".format(os.path.basename(port)))
+
+def _slotOffset(address):
+	index = address - firstAddress
+	if index < 0 or index >= addressCount:
+		raise ValueError("Address {0} out of range".format(address))
+	return _SLOT_OFFSET + index * _SLOT_SIZE
+
+class LiveStateWriter:
+	'Owner side of the live state segment'
+
+	def __init__(self, path):
+		self.path = path
+		fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+		try:
+			os.ftruncate(fd, _SIZE)
+			self._map = mmap.mmap(fd, _SIZE)
+		finally:
+			os.close(fd)
+		_HEADER.pack_into(self._map, 0, _MAGIC, _VERSION, addressCount, _SLOT_SIZE)
+		self._sequences = [_SEQUENCE.unpack_from(self._map, _slotOffset(firstAddress + i))[0] & ~1
+			for i in range(addressCount)]
+
+	def update(self, address, sample):
+		offset = _slotOffset(address)
+		index = address - firstAddress
+		sequence = self._sequences[index] + 1
+		_SEQUENCE.pack_into(self._map, offset, sequence & 0xFFFFFFFF)
+		_SAMPLE.pack_into(self._map, offset + 8, *sample)
+		sequence += 1
+		_SEQUENCE.pack_into(self._map, offset, sequence & 0xFFFFFFFF)
+		self._sequences[index] = sequence
+
+	def close(self):
+		self._map.close()
+
+class LiveStateReader:
+	'Reader side of the live state segment, any number per process'
+
+	def __init__(self, path):
+		self.path = path
+		fd = os.open(path, os.O_RDONLY)
+		try:
+			self._map = mmap.mmap(fd, _SIZE, access=mmap.ACCESS_READ)
+		finally:
+			os.close(fd)
+		magic, version, count, slotSize = _HEADER.unpack_from(self._map, 0)
+		if magic != _MAGIC or version != _VERSION:
+			raise ValueError("{0} is not a live state segment".format(path))
+
+	# Latest sample for the address, or None if nothing was written yet.
+	# Values whose read failed are None. Raises LiveStateError if no
+	# consistent copy of the slot could be made within timeout seconds.
+	def read(self, address, timeout=0.1):
+		offset = _slotOffset(address)
+		deadline = None
+		while True:
+			before = _SEQUENCE.unpack_from(self._map, offset)[0]
+			if not before & 1:
+				sample = _SAMPLE.unpack_from(self._map, offset + 8)
+				if _SEQUENCE.unpack_from(self._map, offset)[0] == before:
+					break
+			if deadline is None:
+				deadline = time.time() + timeout
+			elif time.time() >= deadline:
+				raise LiveStateError("Live state of address {0} kept changing for {1} s, "
+					"the writer may have stopped part way".format(address, timeout))
+		if before == 0:
+			return None
+		valid = sample[-1]
+		return LiveSample(sample[0], *[value if valid & (1 << bit) else None
+			for bit, value in enumerate(sample[1:-1])] + [valid])
+
+	def close(self):
+		self._map.close()
+
+class LiveStatePoller:
+	'Keeps a live state segment updated from a Roboclaw'
+
+	# rc: Roboclaw API object, addresses: Roboclaw addresses to poll,
+	# interval: seconds between sweeps over all addresses.
+	def __init__(self, rc, writer, addresses, interval=0.05):
+		self.rc = rc
+		self.writer = writer
+		self.addresses = list(addresses)
+		self.interval = interval
+		self._stop = threading.Event()
+		self._thread = None
+
+	# Read everything for one address, in one batch if the Roboclaw object
+	# can. Values whose read fails are stored as invalid rather than
+	# holding up the rest.
+	def poll(self, address):
+		reads = ["ReadEncM1", "ReadEncM2", "ReadSpeedM1", "ReadSpeedM2",
+			"ReadCurrents", "ReadMainBatteryVoltage", "ReadError"]
+		pipelined = getattr(self.rc, "ReadPipelined", None)
+		if pipelined is not None:
+			results = pipelined(address, reads)
+		else:
+			results = [getattr(self.rc, read)(address) for read in reads]
+		enc1, enc2, speed1, speed2, currents, battery, error = results
+		# Each value after the timestamp with the result it comes from.
+		values = [(enc1, 1), (enc2, 1), (speed1, 1), (speed2, 1), (currents, 1), (currents, 2),
+			(enc1, 2), (enc2, 2), (battery, 1), (error, 1)]
+		valid = 0
+		for bit, (result, field) in enumerate(values):
+			if result[0]:
+				valid |= 1 << bit
+		self.writer.update(address, [time.time()] +
+			[result[field] if result[0] else 0 for result, field in values] + [valid])
+
+	def start(self):
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def stop(self):
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join()
+
+	def _run(self):
+		while not self._stop.is_set():
+			for address in self.addresses:
+				self.poll(address)
+			self._stop.wait(self.interval)
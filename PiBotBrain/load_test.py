@@ -0,0 +1,202 @@
+# Load test of the app: many simulated browsers against a simulated
+# Roboclaw, to find how many clients and what polling rate the app can
+# serve before latency falls apart.
+
+# The app from testconfig.py is served on a local port (threaded, like
+# flask run) with the test stub given a LatencyModel, which makes each
+# command take as long as it does on a serial link at --baudrate. Each
+# simulated client picks requests from trafficMix: mostly the encoder_json
+# polling the basic motor page does, plus page loads and motion commands.
+# It waits for the reply, then waits out the rest of its polling interval.
+# All clients share one simulated bus, as they would share one Roboclaw.
+
+# Reported per route: requests, errors, throughput and p50/p95/p99 latency,
+# plus how busy the simulated bus was. --json saves the same figures for
+# comparing runs.
+
+# Usage:
+#   python load_test.py [--clients 10] [--duration 20] [--interval 1.0] [--baudrate 115200] [--json results.json]
+# --interval 0 sends the next request as soon as the last one is answered.
+
+import argparse
+from collections import OrderedDict
+import json
+import logging
+import random
+import sys
+import threading
+import time
+
+try:
+	from urllib.request import Request, urlopen
+	from urllib.error import HTTPError, URLError
+except ImportError:
+	# Python 2
+	from urllib2 import HTTPError, Request, URLError, urlopen
+
+# (route name, method, path, JSON body, weight). Weights are relative.
+trafficMix = [
+	('encoder_json', 'GET', '/encoder_json?address=0x80', None, 80),
+	('api_encoders', 'GET', '/api/encoders?address=0x80', None, 5),
+	('config', 'GET', '/config?address=0x80', None, 4),
+	('velocity', 'GET', '/velocity?address=0x80', None, 4),
+	('run_velocity', 'POST', '/api/run_velocity?address=0x80', {'m1speed': 200, 'm2speed': 200}, 4),
+	('stop', 'POST', '/api/stop?address=0x80', {}, 3),
+]
+
+class Results:
+	def __init__(self):
+		self.lock = threading.Lock()
+		# Route name to list of latencies in seconds, and to error count.
+		self.latencies = OrderedDict((route[0], []) for route in trafficMix)
+		self.errors = OrderedDict((route[0], 0) for route in trafficMix)
+
+	def add(self, name, latency, ok):
+		with self.lock:
+			self.latencies[name].append(latency)
+			if not ok:
+				self.errors[name] += 1
+
+def percentile(sortedValues, fraction):
+	if not sortedValues:
+		return None
+	return sortedValues[min(len(sortedValues) - 1, int(fraction * len(sortedValues)))]
+
+def _request(baseUrl, method, path, body):
+	data = None
+	headers = {}
+	if method == 'POST':
+		data = json.dumps(body).encode('utf-8')
+		headers['Content-Type'] = 'application/json'
+	request = Request(baseUrl + path, data, headers)
+	try:
+		response = urlopen(request, timeout=30)
+		reply = response.read()
+	except HTTPError:
+		return False
+	except URLError:
+		return False
+	# Page routes redirect to the root page on failure, the JSON routes
+	# report failures in the body.
+	if response.geturl() != baseUrl + path:
+		return False
+	if path.startswith(('/api/', '/encoder_json')):
+		return json.loads(reply.decode('utf-8')).get('result') == 'success'
+	return True
+
+# One simulated browser, sending requests until deadline.
+def runClient(baseUrl, results, deadline, interval, rng):
+	total = sum(route[4] for route in trafficMix)
+	while time.time() < deadline:
+		pick = rng.uniform(0, total)
+		for name, method, path, body, weight in trafficMix:
+			pick -= weight
+			if pick <= 0:
+				break
+		start = time.time()
+		ok = _request(baseUrl, method, path, body)
+		latency = time.time() - start
+		results.add(name, latency, ok)
+		if interval > latency:
+			time.sleep(interval - latency)
+
+# Serve the app with a stub as slow as the given link and run the clients
+# against it. Returns (results, elapsed seconds, bus busy seconds).
+def runLoadTest(clients=10, duration=20.0, interval=1.0, baudrate=115200, turnaround=0.0005,
+		jitter=0.0, seed=1):
+	from werkzeug.serving import make_server
+	import testconfig
+	from roboclaw_stub import LatencyModel, Roboclaw_stub
+
+	logging.getLogger('werkzeug').setLevel(logging.ERROR)
+	app = testconfig.create_app(discover=False)
+	bus = LatencyModel(baudrate, turnaround, jitter, seed=seed)
+	testconfig.setRoboclaw(Roboclaw_stub(bus))
+	server = make_server('127.0.0.1', 0, app, threaded=True)
+	serverThread = threading.Thread(target=server.serve_forever)
+	serverThread.daemon = True
+	serverThread.start()
+	baseUrl = "http://127.0.0.1:{0}".format(server.server_port)
+
+	results = Results()
+	start = time.time()
+	deadline = start + duration
+	threads = []
+	for index in range(clients):
+		# Spread the clients over the first interval, as real ones would be.
+		thread = threading.Thread(target=runClient, args=(baseUrl, results, deadline, interval,
+			random.Random(seed + index)))
+		thread.daemon = True
+		threads.append(thread)
+		thread.start()
+		time.sleep(interval / clients if interval else 0)
+	for thread in threads:
+		thread.join()
+	elapsed = time.time() - start
+	server.shutdown()
+	return results, elapsed, bus.busy
+
+# Per route figures, latencies in milliseconds.
+def summarize(results, elapsed, busy):
+	routes = OrderedDict()
+	allLatencies = []
+	for name, latencies in results.latencies.items():
+		allLatencies.extend(latencies)
+		routes[name] = _figures(latencies, results.errors[name], elapsed)
+	summary = OrderedDict()
+	summary['seconds'] = elapsed
+	summary['busUtilization'] = busy / elapsed
+	summary['all'] = _figures(allLatencies, sum(results.errors.values()), elapsed)
+	summary['routes'] = routes
+	return summary
+
+def _figures(latencies, errors, elapsed):
+	latencies = sorted(latencies)
+	figures = OrderedDict()
+	figures['requests'] = len(latencies)
+	figures['errors'] = errors
+	figures['perSecond'] = len(latencies) / elapsed
+	for label, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+		value = percentile(latencies, fraction)
+		figures[label] = None if value is None else value * 1000
+	return figures
+
+def _printSummary(summary):
+	print("{0:14} {1:>8} {2:>6} {3:>8} {4:>8} {5:>8} {6:>8}".format(
+		"route", "requests", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms"))
+	rows = list(summary['routes'].items()) + [('all', summary['all'])]
+	for name, figures in rows:
+		if not figures['requests']:
+			continue
+		print("{0:14} {1:8} {2:6} {3:8.1f} {4:8.1f} {5:8.1f} {6:8.1f}".format(name,
+			figures['requests'], figures['errors'], figures['perSecond'],
+			figures['p50'], figures['p95'], figures['p99']))
+	print("{0:.1f} s, simulated bus busy {1:.0%} of the time".format(summary['seconds'], summary['busUtilization']))
+
+def main():
+	parser = argparse.ArgumentParser(description="Load test the app against a simulated Roboclaw")
+	parser.add_argument("--clients", type=int, default=10, help="simulated browsers")
+	parser.add_argument("--duration", type=float, default=20.0, help="seconds to run")
+	parser.add_argument("--interval", type=float, default=1.0,
+		help="seconds between the requests of one client, 0 for back to back")
+	parser.add_argument("--baudrate", type=int, default=115200, help="simulated serial link speed")
+	parser.add_argument("--turnaround", type=float, default=0.0005,
+		help="seconds the simulated controller takes to start replying")
+	parser.add_argument("--jitter", type=float, default=0.0, help="up to this many seconds added to each command")
+	parser.add_argument("--json", help="also write the results to this file")
+	args = parser.parse_args()
+
+	results, elapsed, busy = runLoadTest(args.clients, args.duration, args.interval, args.baudrate,
+		args.turnaround, args.jitter)
+	summary = summarize(results, elapsed, busy)
+	summary['clients'] = args.clients
+	summary['interval'] = args.interval
+	summary['baudrate'] = args.baudrate
+	_printSummary(summary)
+	if args.json:
+		with open(args.json, "w") as f:
+			json.dump(summary, f, indent=2)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
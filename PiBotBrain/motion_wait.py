@@ -0,0 +1,224 @@
+# Finds out when buffered moves (SpeedAccelDeccelPositionM1M2, the distance
+# commands) have finished, without the caller sleeping and guessing.
+
+# MotionWatcher.expect() is called right after sending a move and returns
+# a concurrent.futures.Future that resolves to a MotionResult once the
+# controller reports both command buffers idle (ReadBuffers 0x80) and both
+# motors stopped. Block on future.result(), chain with
+# add_done_callback(), or await asyncio.wrap_future(future) in asyncio
+# code. (Python 2 needs the futures backport: pip install futures.)
+
+# Polling is adaptive. The expected end of the move is worked out from its
+# acceleration, speed and deceleration, and each poll is scheduled half the
+# time to that end away (never closer than minInterval, never further than
+# maxInterval). So a ten second move is polled twice a second at first and
+# every few milliseconds around its end, and a move that runs late is
+# polled less and less often again. For moves to an absolute position the
+# distance is taken from the encoders at the first poll.
+
+# One background thread serves every pending move. A move replaced by a
+# newer buffered command resolves when the newer one finishes, as that is
+# when the motors come to rest. A move replaced by continuous driving
+# (a velocity or duty command) may never finish: cancel its future, which
+# stops the polling. A move with a known expected end that was given no
+# timeout fails lateness seconds after that end, so a forgotten future is
+# not polled forever either.
+
+from collections import namedtuple
+from concurrent.futures import CancelledError, Future, TimeoutError as FutureTimeout
+import math
+import threading
+import time
+
+from history import signedSpeed
+from trajectory import BUFFER_IDLE
+
+MotionResult = namedtuple("MotionResult", "m1enc m2enc seconds")
+
+class MotionError(ValueError):
+	pass
+
+# One motor's part of a move. Give either distance (encoder counts to
+# travel) or position (absolute encoder target). decel defaults to accel,
+# as in the commands without a separate deceleration.
+class MotorMove(namedtuple("MotorMove", "accel speed decel distance position")):
+	__slots__ = ()
+
+	def __new__(cls, accel, speed, decel=None, distance=None, position=None):
+		return super(MotorMove, cls).__new__(cls, accel, speed, accel if decel is None else decel,
+			distance, position)
+
+# Result of a future from expect() if it resolves within seconds, else
+# None. Raises MotionError if the wait failed or the future was cancelled.
+def resultWithin(future, seconds):
+	try:
+		return future.result(seconds)
+	except FutureTimeout:
+		return None
+	except CancelledError:
+		raise MotionError("The move was replaced by another command")
+
+# Seconds a trapezoidal move from standstill takes: accelerate to speed,
+# cruise, decelerate to a stop after distance encoder counts. Short moves
+# never reach speed and take the triangular profile instead.
+def moveDuration(accel, speed, decel, distance):
+	speed = abs(speed)
+	distance = abs(distance)
+	if speed == 0 or distance == 0:
+		return 0.0
+	if accel <= 0 or decel <= 0:
+		return distance / float(speed)
+	rampDistance = speed * speed / (2.0 * accel) + speed * speed / (2.0 * decel)
+	if distance >= rampDistance:
+		return speed / float(accel) + speed / float(decel) + (distance - rampDistance) / float(speed)
+	peak = math.sqrt(2.0 * distance * accel * decel / (accel + decel))
+	return peak / accel + peak / decel
+
+class _Watch:
+	def __init__(self, address, moves, timeout):
+		self.address = address
+		self.moves = moves
+		self.future = Future()
+		self.start = time.time()
+		self.timeout = timeout
+		self.failures = 0
+		# Expected end, once known.
+		self.end = None
+		if all(move.distance is not None for move in moves):
+			self.end = self.start + max([0.0] + [moveDuration(move.accel, move.speed, move.decel, move.distance)
+				for move in moves])
+		self.nextPoll = self.start
+
+class MotionWatcher:
+	'Resolves futures when Roboclaw moves finish'
+
+	# rc: Roboclaw API object. minInterval, maxInterval: bounds of the time
+	# between polls of a move. settleSpeed: speeds (quadrature pulses per
+	# second) at or below which a motor counts as stopped. failures: read
+	# failures in a row after which a wait gives up. lateness: seconds past
+	# its expected end after which a move without a timeout fails.
+	def __init__(self, rc, minInterval=0.01, maxInterval=0.5, settleSpeed=10, failures=5, lateness=10.0):
+		self.rc = rc
+		self.minInterval = minInterval
+		self.maxInterval = maxInterval
+		self.settleSpeed = settleSpeed
+		self.failures = failures
+		self.lateness = lateness
+		self._watches = []
+		self._condition = threading.Condition()
+		self._closed = False
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+
+	# Watch a move just sent to address. moves: MotorMove of each motor
+	# (may be empty if nothing is known about the move; polling then backs
+	# off as it goes on). timeout: seconds after which the future fails
+	# with MotionError, None for lateness seconds past the expected end
+	# (or as long as it takes if the end is not known).
+	def expect(self, address, moves=(), timeout=None):
+		watch = _Watch(address, list(moves), timeout)
+		with self._condition:
+			if self._closed:
+				watch.future.set_exception(MotionError("Motion watcher is closed"))
+				return watch.future
+			if watch.end is not None:
+				watch.nextPoll = self._nextPoll(watch, watch.start)
+			else:
+				# Read the encoders soon, to work out the expected end.
+				watch.nextPoll = watch.start + self.minInterval
+			self._watches.append(watch)
+			self._condition.notify()
+		return watch.future
+
+	# Stop the thread. Pending futures fail with MotionError.
+	def close(self):
+		with self._condition:
+			self._closed = True
+			self._condition.notify()
+		self._thread.join()
+		for watch in self._watches:
+			self._finish(watch, error=MotionError("Stopped watching address {0}".format(watch.address)))
+		self._watches = []
+
+	def _nextPoll(self, watch, now):
+		end = watch.start if watch.end is None else watch.end
+		delay = max(self.minInterval, min(self.maxInterval, abs(end - now) / 2.0))
+		return now + delay
+
+	def _run(self):
+		while True:
+			with self._condition:
+				while not self._closed:
+					self._watches = [watch for watch in self._watches if not watch.future.done()]
+					now = time.time()
+					due = [watch for watch in self._watches if watch.nextPoll <= now]
+					if due:
+						break
+					if self._watches:
+						self._condition.wait(min(watch.nextPoll for watch in self._watches) - now)
+					else:
+						self._condition.wait()
+				if self._closed:
+					return
+			# Moves on the same address share one set of reads. Whatever the
+			# reads throw fails the moves of that address, not this thread.
+			byAddress = {}
+			for watch in due:
+				byAddress.setdefault(watch.address, []).append(watch)
+			for address, watches in byAddress.items():
+				try:
+					results = self._read(address)
+					for watch in watches:
+						self._check(watch, results)
+				except Exception as e:
+					error = MotionError("Reading motion state of address {0} failed: {1}".format(address, e))
+					for watch in watches:
+						self._finish(watch, error=error)
+
+	def _read(self, address):
+		reads = ["ReadBuffers", "ReadSpeedM1", "ReadSpeedM2", "ReadEncM1", "ReadEncM2"]
+		pipelined = getattr(self.rc, "ReadPipelined", None)
+		if pipelined is not None:
+			return pipelined(address, reads)
+		return [getattr(self.rc, read)(address) for read in reads]
+
+	def _check(self, watch, results):
+		now = time.time()
+		buffers, speed1, speed2, enc1, enc2 = results
+		if not all(result[0] for result in results):
+			watch.failures += 1
+			if watch.failures >= self.failures:
+				self._finish(watch, error=MotionError("Reading motion state of address {0} failed {1} times".format(
+					watch.address, watch.failures)))
+				return
+		else:
+			watch.failures = 0
+			if watch.end is None and watch.moves:
+				encoders = (enc1[1], enc2[1])
+				watch.end = watch.start + max([0.0] + [moveDuration(move.accel, move.speed, move.decel,
+					move.distance if move.position is None else move.position - encoder)
+					for move, encoder in zip(watch.moves, encoders)])
+			idle = buffers[1] == BUFFER_IDLE and buffers[2] == BUFFER_IDLE
+			stopped = abs(signedSpeed(speed1)) <= self.settleSpeed and abs(signedSpeed(speed2)) <= self.settleSpeed
+			if idle and stopped:
+				self._finish(watch, MotionResult(enc1[1], enc2[1], now - watch.start))
+				return
+		if watch.timeout is not None and now - watch.start >= watch.timeout:
+			self._finish(watch, error=MotionError("Move on address {0} not finished after {1} s".format(
+				watch.address, watch.timeout)))
+			return
+		if watch.timeout is None and watch.end is not None and now - watch.end >= self.lateness:
+			self._finish(watch, error=MotionError("Move on address {0} not finished {1} s after its expected end".format(
+				watch.address, self.lateness)))
+			return
+		watch.nextPoll = self._nextPoll(watch, now)
+
+	def _finish(self, watch, result=None, error=None):
+		# False if the caller cancelled the future meanwhile.
+		if watch.future.done() or not watch.future.set_running_or_notify_cancel():
+			return
+		if error is not None:
+			watch.future.set_exception(error)
+		else:
+			watch.future.set_result(result)
@@ -0,0 +1,153 @@
+# Compiles a drive path for a two wheel (differential drive) robot into
+# buffered distance segments, ready for TrajectoryStreamer. All planning
+# happens up front so executing the path is nothing but streaming.
+
+# Conventions follow the drive page: motor 1 is the left wheel, motor 2 the
+# right wheel, distances are in wheel rotations and positive angles turn
+# clockwise (to the right).
+
+import math
+import re
+
+from trajectory import DistanceSegment
+
+# Path elements
+
+# Straight line, negative distance drives backwards.
+class Line:
+	def __init__(self, distance):
+		self.distance = float(distance)
+
+	# Signed wheel travel in encoder pulses as (left, right).
+	def wheelPulses(self, geometry):
+		pulses = self.distance * geometry.pulsesPerUnit
+		return pulses, pulses
+
+# Turn in place, positive is clockwise.
+class Rotate:
+	def __init__(self, degrees):
+		self.degrees = float(degrees)
+
+	def wheelPulses(self, geometry):
+		pulses = self.degrees * geometry.eppr / 360.0
+		return pulses, -pulses
+
+# Drive along a circular arc of the given radius (distance from arc center
+# to robot center) through the given angle. Positive angle turns the robot
+# clockwise. A negative radius drives the arc backwards.
+class Arc:
+	def __init__(self, radius, degrees):
+		self.radius = float(radius)
+		self.degrees = float(degrees)
+
+	def wheelPulses(self, geometry):
+		center = abs(self.radius) * geometry.pulsesPerUnit * math.radians(abs(self.degrees))
+		if self.radius < 0:
+			center = -center
+		offset = self.degrees * geometry.eppr / 360.0
+		return center + offset, center - offset
+
+class PathError(ValueError):
+	'Raised when a path description cannot be parsed'
+
+# Robot dimensions expressed in encoder pulses.
+class DriveGeometry:
+	# pulsesPerUnit: encoder pulses for one unit (wheel rotation) of travel.
+	# eppr: encoder pulses each wheel travels while the robot turns a full
+	#   circle in place.
+	def __init__(self, pulsesPerUnit=7200, eppr=6200):
+		self.pulsesPerUnit = pulsesPerUnit
+		self.eppr = eppr
+
+_elementTypes = {
+	"L": (Line, 1), "LINE": (Line, 1),
+	"R": (Rotate, 1), "ROTATE": (Rotate, 1),
+	"A": (Arc, 2), "ARC": (Arc, 2),
+}
+
+# Parse a path like "L 2; R 90; A 1.5 -45" into path elements. Elements are
+# separated by semicolons or newlines, each is a letter (or word) followed
+# by its numbers.
+def parsePath(text):
+	path = []
+	for part in re.split(r"[;\n]", text):
+		tokens = part.split()
+		if not tokens:
+			continue
+		kind = _elementTypes.get(tokens[0].upper())
+		if kind is None:
+			raise PathError("Unknown path element '{0}'".format(tokens[0]))
+		elementType, argCount = kind
+		if len(tokens) != argCount + 1:
+			raise PathError("'{0}' expects {1} number(s)".format(part.strip(), argCount))
+		try:
+			path.append(elementType(*[float(token) for token in tokens[1:]]))
+		except ValueError:
+			raise PathError("Invalid number in '{0}'".format(part.strip()))
+	return path
+
+# Turn a path into DistanceSegments.
+# speed: pulses per second of whichever wheel travels further in a segment.
+# accel: acceleration of that wheel, in pulses per second per second.
+# accelLimits: optional (left, right) maximum acceleration of each wheel.
+# The slower wheel's speed and acceleration are scaled down by the ratio of
+# the distances, so both wheels finish each segment together. Consecutive
+# elements with the same wheel ratio are merged into one segment, and wheel
+# positions are tracked cumulatively so rounding never accumulates drift.
+# Raises PathError unless speed is positive, as a segment at speed 0 would
+# never finish.
+def planPath(path, geometry, speed, accel, accelLimits=None):
+	if speed <= 0:
+		raise PathError("Path speed must be positive, not {0}".format(speed))
+	moves = []
+	for element in path:
+		left, right = element.wheelPulses(geometry)
+		if abs(left) < 0.5 and abs(right) < 0.5:
+			continue
+		if moves and _sameDirection(moves[-1], left, right):
+			moves[-1][0] += left
+			moves[-1][1] += right
+		else:
+			moves.append([left, right])
+
+	segments = []
+	target1 = target2 = 0.0
+	sent1 = sent2 = 0
+	for left, right in moves:
+		target1 += left
+		target2 += right
+		delta1 = int(round(target1)) - sent1
+		delta2 = int(round(target2)) - sent2
+		sent1 += delta1
+		sent2 += delta2
+		if delta1 == 0 and delta2 == 0:
+			continue
+
+		lead = float(max(abs(delta1), abs(delta2)))
+		ratio1 = abs(delta1) / lead
+		ratio2 = abs(delta2) / lead
+		leadAccel = accel
+		if accelLimits is not None:
+			for ratio, limit in ((ratio1, accelLimits[0]), (ratio2, accelLimits[1])):
+				if ratio > 0:
+					leadAccel = min(leadAccel, limit / ratio)
+
+		segments.append(DistanceSegment(
+			max(1, int(leadAccel * ratio1)), _signed(speed * ratio1, delta1), abs(delta1),
+			max(1, int(leadAccel * ratio2)), _signed(speed * ratio2, delta2), abs(delta2)))
+	return segments
+
+# Speed of a wheel with the sign of its travel. A wheel that travels at
+# all gets at least speed 1, or the controller would never finish its move.
+def _signed(speed, direction):
+	speed = int(round(speed))
+	if direction != 0:
+		speed = max(1, speed)
+	return -speed if direction < 0 else speed
+
+# Two moves can be merged when the wheels turn in the same directions with
+# the same ratio between them.
+def _sameDirection(move, left, right):
+	if (move[0] < 0) != (left < 0) or (move[1] < 0) != (right < 0):
+		return False
+	return abs(move[0] * right - move[1] * left) <= 1e-6 * max(abs(move[0] * right), abs(move[1] * left), 1.0)
@@ -0,0 +1,293 @@
+# Brings a Roboclaw's settings in line with a profile file.
+
+# A profile lists desired settings by the names in settings.py. Applying
+# it reads the current values in one sweep (each read command once), writes
+# only the settings that differ, reads those back to verify them, and calls
+# WriteNVM only if something was written. NVM writes are slow and wear the
+# controller's flash, so re-applying an unchanged profile costs nothing but
+# the reads.
+
+# Usage:
+#   python provision.py /dev/ttyACM0 profiles/roger_motor.json [--dry-run]
+# The port may also be Test_Stub or a roboclaw_daemon socket.
+
+# Fleet mode, for commissioning a batch of controllers:
+#   python provision.py /dev/ttyACM0 /dev/ttyACM1 profiles/roger_motor.json --discover
+# applies the profile to every address answering on every port. Ports are
+# worked on concurrently, one thread each; the units sharing a multi-unit
+# bus take turns, one complete unit after another in address order, since
+# the bus carries one transaction at a time anyway. Wall time grows with
+# the controllers on the busiest bus, not with the total. A port named
+# "auto" stands for every serial port that looks like a Roboclaw.
+
+# Profile format (JSON):
+#   {
+#     "address": "0x80",
+#     "settings": {
+#       "mainVoltages": [110, 340],
+#       "m1MaxCurrent": 500,
+#       "pinFunctions": {"s3": 2, "s4": 0, "s5": 0},
+#       "config": {"set": "0x8003", "clear": "0x0000"}
+#     }
+#   }
+# A setting is a list of its values, a single value if it has one field,
+# or an object by field name. A single-value setting may instead give
+# "set" and "clear" bit masks, applied to the current value. Numbers may be
+# written as strings like "0x8003".
+
+import argparse
+from collections import OrderedDict
+import json
+import sys
+import threading
+import time
+
+from discovery import allAddresses, findAddresses, potentialDevices
+from settings import SettingError, allSettings, readSettings, writeSetting
+
+class ProfileError(ValueError):
+	'Raised when a profile file is not valid'
+
+def _number(value, where):
+	if isinstance(value, str) or type(value).__name__ == "unicode":
+		try:
+			return int(value, 0)
+		except ValueError:
+			raise ProfileError("{0}: '{1}' is not a number".format(where, value))
+	if isinstance(value, (int, float)) and not isinstance(value, bool):
+		return value
+	raise ProfileError("{0}: {1!r} is not a number".format(where, value))
+
+# Desired values of one setting. Returns either a tuple of values, or a
+# (set, clear) pair of masks marked by the "bits" tag.
+def _desired(name, value):
+	setting = allSettings.get(name)
+	if setting is None:
+		raise ProfileError("Unknown setting '{0}'".format(name))
+	fields = setting.fields
+	if isinstance(value, dict):
+		if set(value) <= set(["set", "clear"]) and value:
+			if len(fields) != 1:
+				raise ProfileError("{0}: set/clear only applies to single value settings".format(name))
+			return ("bits", _number(value.get("set", 0), name), _number(value.get("clear", 0), name))
+		if set(value) != set(fields):
+			raise ProfileError("{0}: expected fields {1}".format(name, ", ".join(fields)))
+		value = [value[field] for field in fields]
+	elif not isinstance(value, list):
+		value = [value]
+	if len(value) != len(fields):
+		raise ProfileError("{0}: expected {1} value(s)".format(name, len(fields)))
+	return tuple(_number(v, name) for v in value)
+
+class Profile:
+	# settings: OrderedDict of setting name to desired values.
+	# exact: PID gains are given as the controller's fixed point integers
+	#   (see settings.Setting), as snapshots keep them.
+	def __init__(self, settings, address=0x80, name=None, exact=False):
+		self.settings = settings
+		self.address = address
+		self.name = name
+		self.exact = exact
+
+	@classmethod
+	def parse(cls, data, name=None):
+		if not isinstance(data, dict) or not isinstance(data.get("settings"), dict):
+			raise ProfileError("Profile needs a 'settings' object")
+		address = _number(data.get("address", 0x80), "address")
+		settings = OrderedDict()
+		# Apply in table order so e.g. config always goes first.
+		for settingName in allSettings:
+			if settingName in data["settings"]:
+				settings[settingName] = _desired(settingName, data["settings"][settingName])
+		for settingName in data["settings"]:
+			if settingName not in allSettings:
+				raise ProfileError("Unknown setting '{0}'".format(settingName))
+		return cls(settings, address, name)
+
+	@classmethod
+	def load(cls, path):
+		with open(path) as f:
+			try:
+				data = json.load(f)
+			except ValueError as e:
+				raise ProfileError("{0}: {1}".format(path, e))
+		return cls.parse(data, path)
+
+	# Values to write given the current ones, or None if they already match.
+	def target(self, name, current):
+		desired = self.settings[name]
+		if desired[0] == "bits":
+			desired = ((current[0] | desired[1]) & ~desired[2],)
+		return None if tuple(desired) == tuple(current) else desired
+
+class ProvisionResult:
+	def __init__(self, address):
+		self.address = address
+		# Setting name to (old values, new values) for each setting written.
+		self.changed = OrderedDict()
+		self.unchanged = []
+		self.nvmWritten = False
+
+	def __str__(self):
+		lines = ["Address {0:#x}: {1} changed, {2} unchanged{3}".format(self.address,
+			len(self.changed), len(self.unchanged), ", saved to NVM" if self.nvmWritten else "")]
+		for name, (old, new) in self.changed.items():
+			lines.append("  {0}: {1} -> {2}".format(name, old, new))
+		return "\n".join(lines)
+
+# Apply the profile to the Roboclaw at address (default: the profile's).
+# Raises SettingError if a read, write or verification fails; nothing is
+# saved to NVM in that case.
+def provision(rc, profile, address=None, dryRun=False):
+	if address is None:
+		address = profile.address
+	result = ProvisionResult(address)
+	current = readSettings(rc, address, profile.settings, profile.exact)
+	for name, values in current.items():
+		target = profile.target(name, values)
+		if target is None:
+			result.unchanged.append(name)
+		else:
+			result.changed[name] = (values, target)
+	if dryRun or not result.changed:
+		return result
+
+	for name, (old, new) in result.changed.items():
+		writeSetting(rc, address, name, new, profile.exact)
+
+	# Verify against the controller itself, not a settings cache.
+	refresh = getattr(rc, 'refresh', None)
+	if refresh is not None:
+		refresh(address)
+	verified = readSettings(rc, address, result.changed, profile.exact)
+	for name, (old, new) in result.changed.items():
+		if tuple(verified[name]) != tuple(new):
+			raise SettingError("{0} reads back {1} after writing {2}".format(name, verified[name], new))
+
+	if not rc.WriteNVM(address):
+		raise SettingError("WriteNVM failed")
+	result.nvmWritten = True
+	return result
+
+# Open the Roboclaw API object for a port name as the connect page accepts
+# it: a serial port, Test_Stub, or a roboclaw_daemon socket.
+def openRoboclaw(port, baudrate=115200, timeout=0.01, retries=3):
+	if port == "Test_Stub":
+		from roboclaw_stub import Roboclaw_stub
+		rc = Roboclaw_stub()
+	elif port.endswith(".sock"):
+		from roboclaw_daemon import RoboclawClient
+		rc = RoboclawClient(port)
+	else:
+		from roboclaw import Roboclaw
+		rc = Roboclaw(port, baudrate, timeout, retries)
+	if not rc.Open():
+		raise IOError("Could not open " + port)
+	return rc
+
+# Release what openRoboclaw opened. RoboclawClient closes its socket,
+# Roboclaw has no close of its own so its serial port is closed directly.
+def closeRoboclaw(rc):
+	close = getattr(rc, "close", None)
+	if close is None:
+		close = getattr(getattr(rc, "_port", None), "close", None)
+	if close is not None:
+		close()
+
+# Outcome for one unit of a fleet.
+class UnitReport:
+	def __init__(self, port, address, version=None, result=None, error=None):
+		self.port = port
+		self.address = address
+		self.version = version
+		# ProvisionResult if provisioning ran to completion.
+		self.result = result
+		# Error message otherwise.
+		self.error = error
+
+	def __str__(self):
+		where = self.port if self.address is None else "{0} {1:#x}".format(self.port, self.address)
+		if self.error is not None:
+			return "{0}: FAILED {1}".format(where, self.error)
+		lines = str(self.result).split("\n")
+		lines[0] = "{0} ({1}): {2}".format(where, self.version, lines[0].split(": ", 1)[1])
+		return "\n".join(lines)
+
+# Provision the units on one port, one after another.
+# addresses: addresses to probe for units, or None for just the profile's.
+def provisionBus(port, profile, addresses=None, dryRun=False, openPort=openRoboclaw):
+	try:
+		rc = openPort(port)
+	except IOError as e:
+		return [UnitReport(port, None, error=str(e))]
+	try:
+		units = findAddresses(rc, [profile.address] if addresses is None else addresses)
+		if not units:
+			return [UnitReport(port, None, error="No Roboclaw answered")]
+		reports = []
+		for address, version in units.items():
+			try:
+				reports.append(UnitReport(port, address, version, provision(rc, profile, address, dryRun)))
+			except ValueError as e:
+				reports.append(UnitReport(port, address, version, error=str(e)))
+		return reports
+	finally:
+		closeRoboclaw(rc)
+
+# Provision every port concurrently. Returns UnitReports ordered by port
+# (as given) then address.
+def provisionFleet(ports, profile, addresses=None, dryRun=False, openPort=openRoboclaw):
+	reports = {}
+	def work(port):
+		try:
+			reports[port] = provisionBus(port, profile, addresses, dryRun, openPort)
+		except Exception as e:
+			reports[port] = [UnitReport(port, None, error="{0}: {1}".format(type(e).__name__, e))]
+	threads = [threading.Thread(target=work, args=(port,)) for port in ports]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	return [report for port in ports for report in reports[port]]
+
+def main():
+	parser = argparse.ArgumentParser(description="Apply a settings profile to one or more Roboclaws")
+	parser.add_argument("ports", nargs="+", metavar="port",
+		help="serial port, Test_Stub, roboclaw_daemon socket, or auto for all serial ports")
+	parser.add_argument("profile", help="profile JSON file")
+	parser.add_argument("--address", type=lambda text: int(text, 0), help="override the profile's address")
+	parser.add_argument("--discover", action="store_true",
+		help="provision every address that answers on each port")
+	parser.add_argument("--baudrate", type=int, default=115200)
+	parser.add_argument("--dry-run", action="store_true", help="only report what would change")
+	args = parser.parse_args()
+
+	ports = []
+	for port in args.ports:
+		if port == "auto":
+			ports.extend("/dev/" + device for device in potentialDevices())
+		else:
+			ports.append(port)
+	if not ports:
+		parser.error("No serial ports found")
+
+	try:
+		profile = Profile.load(args.profile)
+	except (IOError, ValueError) as e:
+		print("Provisioning failed: {0}".format(e))
+		return 1
+	if args.address is not None:
+		profile.address = args.address
+
+	start = time.time()
+	reports = provisionFleet(ports, profile, allAddresses if args.discover else None, args.dry_run,
+		lambda port: openRoboclaw(port, args.baudrate))
+	for report in reports:
+		print(report)
+	failed = sum(1 for report in reports if report.error is not None)
+	print("{0} unit(s) on {1} port(s), {2} failed, {3:.1f} s".format(
+		len(reports) - failed, len(ports), failed, time.time() - start))
+	return 1 if failed else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
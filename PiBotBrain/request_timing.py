@@ -0,0 +1,185 @@
+# Where the time of each request goes: serial I/O, template rendering or
+# the application logic in between.
+
+# A slow page can be waiting on the Roboclaw (pyserial reads, including
+# the retries inside each command), rendering its template, or doing its
+# own work. RequestTimings times every request and splits it three ways:
+#   serial    time inside Roboclaw commands, per command, as measured by
+#             TimingRoboclaw around the Roboclaw object
+#   template  time inside Jinja template rendering
+#   app       the rest of the request
+# Each response gets a Server-Timing header with the split (browser
+# developer tools show it next to the request), and summary() aggregates
+# it per route so the routes worth optimizing, and what to optimize in
+# them, stand out. Commands are only counted while a request is being
+# handled; background threads sharing the Roboclaw are left out.
+# WebSocket routes are not timed, since one request lasts the session.
+
+from collections import OrderedDict
+import threading
+import time
+
+from flask import g, has_request_context, request
+from jinja2 import Template
+
+class _RequestTiming:
+	def __init__(self):
+		self.start = time.time()
+		# Command name to [calls, seconds, retries].
+		self.commands = OrderedDict()
+		self.template = 0.0
+
+	def command(self, name, seconds, retries):
+		entry = self.commands.get(name)
+		if entry is None:
+			entry = self.commands[name] = [0, 0.0, 0]
+		entry[0] += 1
+		entry[1] += seconds
+		entry[2] += retries
+
+	def serial(self):
+		return sum(entry[1] for entry in self.commands.values())
+
+def _current():
+	if not has_request_context():
+		return None
+	return getattr(g, 'requestTiming', None)
+
+# Wraps a Roboclaw API object and adds the time of each command to the
+# request being handled. Wrap the object doing the serial I/O (inside
+# LockedRoboclaw and SettingsCache), so lock waits and cache hits do not
+# count as serial time. With a flight recorder attached, attempts beyond
+# the first are counted as retries.
+class TimingRoboclaw:
+	def __init__(self, rc):
+		self._rc = rc
+
+	def __getattr__(self, name):
+		attr = getattr(self._rc, name)
+		if not callable(attr) or not name[0].isupper() or name == 'Open':
+			return attr
+		rc = self._rc
+		def timed(*args):
+			timing = _current()
+			if timing is None:
+				return attr(*args)
+			recorder = getattr(rc, '_recorder', None)
+			attempts = recorder.count if recorder is not None else 0
+			start = time.time()
+			try:
+				return attr(*args)
+			finally:
+				seconds = time.time() - start
+				retries = 0
+				if recorder is not None:
+					expected = len(args[1]) if name == 'ReadPipelined' else 1
+					retries = max(0, recorder.count - attempts - expected)
+				timing.command(name, seconds, retries)
+		# Cache so later lookups do not come through __getattr__ again.
+		self.__dict__[name] = timed
+		return timed
+
+# Template class of the app's Jinja environment, timing each render.
+# Included and extended templates render as part of the outer one.
+class TimedTemplate(Template):
+	def render(self, *args, **kwargs):
+		timing = _current()
+		start = time.time()
+		try:
+			return Template.render(self, *args, **kwargs)
+		finally:
+			if timing is not None:
+				timing.template += time.time() - start
+
+class _RouteTotals:
+	def __init__(self):
+		self.requests = 0
+		self.total = 0.0
+		self.serial = 0.0
+		self.template = 0.0
+		self.slowest = 0.0
+		# Command name to [calls, seconds, retries].
+		self.commands = {}
+
+	def add(self, total, timing):
+		self.requests += 1
+		self.total += total
+		self.serial += timing.serial()
+		self.template += timing.template
+		self.slowest = max(self.slowest, total)
+		for name, (calls, seconds, retries) in timing.commands.items():
+			entry = self.commands.setdefault(name, [0, 0.0, 0])
+			entry[0] += calls
+			entry[1] += seconds
+			entry[2] += retries
+
+class RequestTimings:
+	def __init__(self, app=None):
+		self._lock = threading.Lock()
+		# "METHOD endpoint" to _RouteTotals.
+		self._routes = {}
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		app.jinja_env.template_class = TimedTemplate
+		app.before_request(self._begin)
+		app.after_request(self._end)
+
+	def _begin(self):
+		rule = request.url_rule
+		if rule is not None and getattr(rule, 'websocket', False):
+			return
+		g.requestTiming = _RequestTiming()
+
+	def _end(self, response):
+		timing = getattr(g, 'requestTiming', None)
+		if timing is None:
+			return response
+		total = time.time() - timing.start
+		serial = timing.serial()
+		metrics = ['total;dur={0:.2f}'.format(total * 1000),
+			'serial;dur={0:.2f};desc="{1} commands"'.format(serial * 1000,
+				sum(entry[0] for entry in timing.commands.values())),
+			'template;dur={0:.2f}'.format(timing.template * 1000),
+			'app;dur={0:.2f}'.format(max(0.0, total - serial - timing.template) * 1000)]
+		for name, (calls, seconds, retries) in timing.commands.items():
+			metrics.append('{0};dur={1:.2f};desc="{2} calls, {3} retries"'.format(name, seconds * 1000, calls, retries))
+		response.headers['Server-Timing'] = ", ".join(metrics)
+
+		route = "{0} {1}".format(request.method, request.endpoint)
+		with self._lock:
+			totals = self._routes.get(route)
+			if totals is None:
+				totals = self._routes[route] = _RouteTotals()
+			totals.add(total, timing)
+		return response
+
+	# Per route averages in milliseconds, the route with the most total
+	# time first. Each lists its commands the same way.
+	def summary(self):
+		with self._lock:
+			routes = sorted(self._routes.items(), key=lambda item: item[1].total, reverse=True)
+			result = OrderedDict()
+			for route, totals in routes:
+				count = float(totals.requests)
+				entry = OrderedDict()
+				entry['requests'] = totals.requests
+				entry['totalSeconds'] = totals.total
+				entry['meanMs'] = totals.total / count * 1000
+				entry['slowestMs'] = totals.slowest * 1000
+				entry['serialMs'] = totals.serial / count * 1000
+				entry['templateMs'] = totals.template / count * 1000
+				entry['appMs'] = max(0.0, totals.total - totals.serial - totals.template) / count * 1000
+				commands = OrderedDict()
+				for name, (calls, seconds, retries) in sorted(totals.commands.items(),
+						key=lambda item: item[1][1], reverse=True):
+					commands[name] = OrderedDict([('callsPerRequest', calls / count),
+						('msPerRequest', seconds / count * 1000), ('retries', retries)])
+				entry['commands'] = commands
+				result[route] = entry
+			return result
+
+	def reset(self):
+		with self._lock:
+			self._routes = {}
@@ -0,0 +1,306 @@
+# Hardware daemon that owns Roboclaw serial ports and shares them with
+# other processes over Unix domain sockets.
+
+# Only one process can sensibly talk to a serial port at a time. Running
+# this daemon lets the web app run under a multi-worker server, and lets
+# scripts like roger_motor.py use the hardware while the app is up, since
+# every one of them goes through the daemon instead of opening the port.
+
+# Usage:
+#   python roboclaw_daemon.py /dev/ttyACM0 [/dev/ttyACM1 ...] [--baudrate 115200]
+# Each port gets a socket named /tmp/roboclaw-<port name>.sock. A port named
+# Test_Stub serves a Roboclaw_stub instead of hardware. In Python:
+#   rc = RoboclawClient("/tmp/roboclaw-ttyACM0.sock")
+#   rc.Open()
+#   rc.ReadEncM1(0x80)
+# RoboclawClient has the same methods as Roboclaw and returns the same results.
+
+# Wire protocol: every message is a 4 byte big-endian length followed by
+# that many bytes. A request is a 2 byte method number followed by the
+# encoded arguments. A response is one encoded value. Method numbers index
+# the method table the client fetches once, right after connecting.
+
+import argparse
+import os
+import socket
+import struct
+import threading
+
+try:
+	import socketserver
+except ImportError:
+	# Python 2
+	import SocketServer as socketserver
+
+import live_state
+import roboclaw
+from roboclaw_lock import LockedRoboclaw
+from roboclaw_stub import Roboclaw_stub
+
+defaultSocketDirectory = "/tmp"
+
+# Method number of the request for the method table.
+METHOD_TABLE = 0xFFFF
+
+_LENGTH = struct.Struct(">L")
+_METHOD = struct.Struct(">H")
+_INT = struct.Struct(">q")
+_FLOAT = struct.Struct(">d")
+_COUNT = struct.Struct(">H")
+_STRLEN = struct.Struct(">H")
+
+# Result types travel by name so the client can rebuild them.
+resultTypes = dict((name, value) for name, value in vars(roboclaw).items()
+	if name.endswith("Result") and hasattr(value, "_fields"))
+
+class RoboclawDaemonError(IOError):
+	'Raised by RoboclawClient when the daemon reports an error'
+
+def socketPath(port, directory=defaultSocketDirectory):
+	return os.path.join(directory, "roboclaw-{0}.sock".format(os.path.basename(port)))
+
+# Sockets of daemons currently running.
+def daemonSockets(directory=defaultSocketDirectory):
+	try:
+		names = os.listdir(directory)
+	except OSError:
+		return []
+	return [os.path.join(directory, name) for name in sorted(names)
+		if name.startswith("roboclaw-") and name.endswith(".sock")]
+
+# All public commands of rc, in a fixed order. Clients see exactly what the
+# served object has, so a stub without ReadPipelined is not offered one.
+def methodNames(rc):
+	return sorted(name for name in dir(rc)
+		if not name.startswith("_") and name != "Cmd" and callable(getattr(rc, name)))
+
+# Value encoding: one tag byte, then the value.
+def encode(value, out):
+	if value is None:
+		out.append(b"N")
+	elif value is True:
+		out.append(b"T")
+	elif value is False:
+		out.append(b"F")
+	elif isinstance(value, int) or type(value).__name__ == "long":
+		out.append(b"i")
+		out.append(_INT.pack(value))
+	elif isinstance(value, float):
+		out.append(b"d")
+		out.append(_FLOAT.pack(value))
+	elif isinstance(value, (tuple, list)):
+		name = type(value).__name__
+		if name in resultTypes:
+			out.append(b"r")
+			_encodeString(name, out)
+		else:
+			out.append(b"t")
+		out.append(_COUNT.pack(len(value)))
+		for item in value:
+			encode(item, out)
+	else:
+		out.append(b"s")
+		_encodeString(value, out)
+
+def _encodeString(value, out):
+	if not isinstance(value, bytes):
+		value = value.encode("utf-8")
+	out.append(_STRLEN.pack(len(value)))
+	out.append(value)
+
+# Decode one value from data starting at offset, returns (value, new offset).
+def decode(data, offset=0):
+	tag = data[offset:offset+1]
+	offset += 1
+	if tag == b"N":
+		return None, offset
+	if tag == b"T":
+		return True, offset
+	if tag == b"F":
+		return False, offset
+	if tag == b"i":
+		return _INT.unpack_from(data, offset)[0], offset + _INT.size
+	if tag == b"d":
+		return _FLOAT.unpack_from(data, offset)[0], offset + _FLOAT.size
+	if tag == b"s" or tag == b"e":
+		value, offset = _decodeString(data, offset)
+		if tag == b"e":
+			raise RoboclawDaemonError(value)
+		return value, offset
+	if tag == b"t" or tag == b"r":
+		resultType = None
+		if tag == b"r":
+			name, offset = _decodeString(data, offset)
+			resultType = resultTypes[name]
+		count = _COUNT.unpack_from(data, offset)[0]
+		offset += _COUNT.size
+		items = []
+		for i in range(count):
+			item, offset = decode(data, offset)
+			items.append(item)
+		if resultType is not None:
+			return resultType(*items), offset
+		return tuple(items), offset
+	raise RoboclawDaemonError("Unknown value tag {0!r}".format(tag))
+
+def _decodeString(data, offset):
+	length = _STRLEN.unpack_from(data, offset)[0]
+	offset += _STRLEN.size
+	return bytes(data[offset:offset+length]).decode("utf-8"), offset + length
+
+def sendMessage(sock, payload):
+	sock.sendall(_LENGTH.pack(len(payload)) + payload)
+
+# Returns the payload of the next message, or None if the peer closed.
+def receiveMessage(sock):
+	header = _receiveExactly(sock, _LENGTH.size)
+	if header is None:
+		return None
+	return _receiveExactly(sock, _LENGTH.unpack(header)[0])
+
+def _receiveExactly(sock, length):
+	data = bytearray()
+	while len(data) < length:
+		chunk = sock.recv(length - len(data))
+		if not chunk:
+			return None
+		data.extend(chunk)
+	return bytes(data)
+
+# Serves one client connection: read requests and answer them until the
+# client disconnects.
+class _RequestHandler(socketserver.BaseRequestHandler):
+	def handle(self):
+		rc = self.server.rc
+		methods = self.server.methods
+		while True:
+			request = receiveMessage(self.request)
+			if request is None:
+				return
+			method = _METHOD.unpack_from(request)[0]
+			out = []
+			try:
+				if method == METHOD_TABLE:
+					encode(tuple(methods), out)
+				else:
+					args = []
+					offset = _METHOD.size
+					while offset < len(request):
+						arg, offset = decode(request, offset)
+						args.append(arg)
+					encode(getattr(rc, methods[method])(*args), out)
+			except Exception as e:
+				out = [b"e"]
+				_encodeString("{0}: {1}".format(type(e).__name__, e), out)
+			sendMessage(self.request, b"".join(out))
+
+class RoboclawServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+	# rc: opened Roboclaw API object, shared by every client connection.
+	def __init__(self, path, rc):
+		if os.path.exists(path):
+			os.unlink(path)
+		socketserver.UnixStreamServer.__init__(self, path, _RequestHandler)
+		self.rc = LockedRoboclaw(rc)
+		self.methods = methodNames(rc)
+
+class RoboclawClient:
+	'Roboclaw API that forwards every command to roboclaw_daemon'
+
+	def __init__(self, path):
+		self.path = path
+		self._sock = None
+		self._lock = threading.Lock()
+		self._methods = {}
+
+	def Open(self):
+		try:
+			self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			self._sock.connect(self.path)
+			names = self._call(METHOD_TABLE, ())
+		except (socket.error, RoboclawDaemonError):
+			self._sock = None
+			return 0
+		self._methods = dict((name, number) for number, name in enumerate(names))
+		return 1
+
+	def close(self):
+		if self._sock is not None:
+			self._sock.close()
+			self._sock = None
+
+	def _call(self, method, args):
+		out = [_METHOD.pack(method)]
+		for arg in args:
+			encode(arg, out)
+		with self._lock:
+			sendMessage(self._sock, b"".join(out))
+			response = receiveMessage(self._sock)
+		if response is None:
+			raise RoboclawDaemonError("Daemon closed the connection")
+		return decode(response)[0]
+
+	def __getattr__(self, name):
+		if name.startswith("_") or name not in self._methods:
+			raise AttributeError(name)
+		method = self._methods[name]
+		def command(*args):
+			return self._call(method, args)
+		self.__dict__[name] = command
+		return command
+
+def main():
+	parser = argparse.ArgumentParser(description="Share Roboclaw serial ports over Unix domain sockets")
+	parser.add_argument("ports", nargs="+", help="serial ports to own, e.g. /dev/ttyACM0")
+	parser.add_argument("--baudrate", type=int, default=115200)
+	parser.add_argument("--timeout", type=float, default=0.01, help="inter-byte timeout in seconds")
+	parser.add_argument("--retries", type=int, default=3)
+	parser.add_argument("--socket-dir", default=defaultSocketDirectory)
+	parser.add_argument("--live-state", type=lambda text: [int(a, 0) for a in text.split(",")],
+		metavar="ADDRESSES", help="publish live values of these comma separated addresses "
+		"(e.g. 0x80,0x81) to shared memory for LiveStateReader")
+	parser.add_argument("--live-interval", type=float, default=0.05, help="seconds between live state sweeps")
+	args = parser.parse_args()
+
+	servers = []
+	pollers = []
+	for port in args.ports:
+		if port == "Test_Stub":
+			rc = Roboclaw_stub()
+		else:
+			rc = roboclaw.Roboclaw(port, args.baudrate, args.timeout, args.retries)
+		if not rc.Open():
+			parser.error("Could not open " + port)
+		path = socketPath(port, args.socket_dir)
+		server = RoboclawServer(path, rc)
+		servers.append(server)
+		print("Serving {0} on {1}".format(port, path))
+		if args.live_state:
+			statePath = live_state.defaultPath(port)
+			poller = live_state.LiveStatePoller(server.rc, live_state.LiveStateWriter(statePath),
+				args.live_state, args.live_interval)
+			poller.start()
+			pollers.append(poller)
+			print("Publishing live state of {0} to {1}".format(port, statePath))
+
+	threads = []
+	for server in servers:
+		thread = threading.Thread(target=server.serve_forever)
+		thread.daemon = True
+		thread.start()
+		threads.append(thread)
+	try:
+		for thread in threads:
+			while thread.is_alive():
+				thread.join(1)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		for poller in pollers:
+			poller.stop()
+		for server in servers:
+			os.unlink(server.server_address)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,26 @@
+# Serializes access to a Roboclaw API object shared between threads.
+
+# A packet serial transaction is a command followed by its reply. If two
+# threads (say a page request and a background trajectory) talk to the same
+# port at once, their bytes interleave and both transactions fail. Wrapping
+# the shared object in LockedRoboclaw makes each API call run to completion
+# before the next one starts.
+
+import threading
+
+class LockedRoboclaw:
+	def __init__(self, rc):
+		self._rc = rc
+		self.lock = threading.RLock()
+
+	def __getattr__(self, name):
+		attr = getattr(self._rc, name)
+		if not callable(attr):
+			return attr
+		lock = self.lock
+		def locked(*args):
+			with lock:
+				return attr(*args)
+		# Cache so later lookups do not come through __getattr__ again.
+		self.__dict__[name] = locked
+		return locked
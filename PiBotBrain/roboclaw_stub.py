@@ -5,15 +5,136 @@
 # The functional fidelity of this class only needs to be enough to 
 # exercise features of the control application.
 
+# By default every call returns at once. Given a LatencyModel, each call
+# takes as long as the same command would on a serial link, so the cost of
+# the app's bus traffic can be measured without hardware. Given a
+# SimulatedClock as well, that time is added to the clock instead of slept,
+# and the stub's simulated motion follows the same clock.
+
 import random
-import serial
 import struct
 import time
+from roboclaw import (Roboclaw, ValueResult, VersionResult, EncoderResult, SpeedResult, CurrentsResult,
+	VoltagesResult, BuffersResult, DeadBandResult,
+	EncoderModesResult, PinFunctionsResult, VelocityPIDResult, PositionPIDResult)
+
+# Clock that only moves when told to, standing in for time.time() and
+# time.sleep().
+class SimulatedClock:
+	def __init__(self, start=0.0):
+		self.now = start
+
+	def time(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.now += seconds
+
+# Port that acknowledges every write command and counts the bytes sent,
+# for measuring write packets with the real Roboclaw class.
+class _MeasuringPort:
+	def __init__(self):
+		self.sent = 0
+
+	def write(self, data):
+		self.sent += len(data)
+		return len(data)
+
+	def read(self, size=1):
+		return b"\xff" * size
+
+	def flushInput(self):
+		pass
+
+# Time a command keeps the serial link busy: the bytes of the request and
+# the reply at the given baud rate (8N1, ten bits a byte), plus the
+# controller's turnaround between the two and optional random jitter.
+# Packet sizes come from the protocol as implemented by Roboclaw: reads send
+# address and command and get their reply layout plus CRC back, writes send
+# address, command, arguments and CRC and get a one byte acknowledgement.
+class LatencyModel:
+	# baudrate: serial link speed.
+	# turnaround: seconds between the end of a request and the reply.
+	# jitter: up to this many seconds are added at random to each command.
+	# extra: command name to additional seconds, for commands the
+	#   controller is slow to carry out.
+	# clock: SimulatedClock to advance, or None to really sleep.
+	def __init__(self, baudrate=115200, turnaround=0.0005, jitter=0.0, extra=None, clock=None, seed=None):
+		self.baudrate = baudrate
+		self.turnaround = turnaround
+		self.jitter = jitter
+		self.extra = extra or {}
+		self.clock = clock
+		self._random = random.Random(seed)
+		self._writeBytes = {}
+		# Totals over every command charged.
+		self.transactions = 0
+		self.bytesOut = 0
+		self.bytesIn = 0
+		self.busy = 0.0
+
+	# Bytes sent and received by a command.
+	def packetBytes(self, name, args, result):
+		if name in Roboclaw._PIPELINED:
+			return 2, Roboclaw._PIPELINED[name][1].size + 2
+		if name == 'ReadVersion':
+			return 2, len(result[1]) + 3
+		sent = self._writeBytes.get(name)
+		if sent is None:
+			port = _MeasuringPort()
+			rc = Roboclaw("model", self.baudrate)
+			rc._port = port
+			getattr(rc, name)(*args)
+			sent = self._writeBytes[name] = port.sent
+		return sent, 1
+
+	# Seconds a command takes.
+	def cost(self, name, args, result):
+		sent, received = self.packetBytes(name, args, result)
+		return self._seconds(name, sent + received)
+
+	def _seconds(self, name, count):
+		seconds = count * 10.0 / self.baudrate + self.turnaround + self.extra.get(name, 0.0)
+		if self.jitter:
+			seconds += self._random.uniform(0, self.jitter)
+		return seconds
+
+	def charge(self, name, args, result):
+		sent, received = self.packetBytes(name, args, result)
+		seconds = self._seconds(name, sent + received)
+		self.transactions += 1
+		self.bytesOut += sent
+		self.bytesIn += received
+		self.busy += seconds
+		if self.clock is not None:
+			self.clock.sleep(seconds)
+		else:
+			time.sleep(seconds)
+
+	# Method that calls the given one and then takes the command's time.
+	def wrap(self, name, method):
+		def charged(*args):
+			result = method(*args)
+			self.charge(name, args, result)
+			return result
+		return charged
 
 class Roboclaw_stub:
 	'Stub of Roboclaw Interface Class'
 
-	def __init__(self):
+	# latency: LatencyModel charging each command its time on the wire.
+	# clock: SimulatedClock for the simulated motion, by default the one
+	#   of the latency model if it has one.
+	def __init__(self, latency=None, clock=None):
+		if clock is None and latency is not None:
+			clock = latency.clock
+		self._time = time.time if clock is None else clock.time
+		if latency is not None:
+			for name in dir(self):
+				if name[0].isupper() and name != 'Open':
+					self.__dict__[name] = latency.wrap(name, getattr(self, name))
+		self.latency = latency
+
 		# Values that would otherwise be stored in RoboClaw
 		self.config = 0
 		self.encoderM1 = 0
@@ -22,6 +143,9 @@ class Roboclaw_stub:
 		self.encoderModeM2 = 0	
 		self.minVoltage = 115
 		self.maxVoltage = 360
+		self.minLogicVoltage = 60
+		self.maxLogicVoltage = 340
+		self.deadBandMin = self.deadBandMax = 25
 		self.maxCurrentM1 = 500
 		self.maxCurrentM2 = 500
 		self.pwmMode = 0
@@ -35,21 +159,63 @@ class Roboclaw_stub:
 		# motor commands.
 		self.m1move = None # None, "vel"ocity, "pos"ition
 		self.m1target = None # When "vel" = encoder counts per second. When "pos" = destination encoder.
-		self.m1timeStart = None # Value of time.time() when movement started.
+		self.m1timeStart = None # Value of the clock when movement started.
 		self.m1encStart = None # Value of encoder when movement started.
 
 		self.m2move = None # None, "vel"ocity, "pos"ition
 		self.m2target = None # When "vel" = encoder counts per second. When "pos" = destination encoder.
-		self.m2timeStart = None # Value of time.time() when movement started.
+		self.m2timeStart = None # Value of the clock when movement started.
 		self.m2encStart = None # Value of encoder when movement started.
 
+		# Simulated command buffer for buffered distance and position moves.
+		# Each entry is [duration, m1delta, m2delta], the first entry is
+		# executing and started at motionStart. Encoders jump by the deltas
+		# when each entry finishes.
+		self.motionQueue = []
+		self.motionStart = None
+
+	# Rough time for a move: travel at speed plus time spent ramping.
+	@staticmethod
+	def _moveTime(accel, speed, distance):
+		speed = abs(speed)
+		if speed == 0:
+			return 0.0
+		ramp = float(speed) / accel if accel > 0 else 0.0
+		return abs(distance) / float(speed) + ramp
+
+	# Retire buffered moves that would have finished by now.
+	def _advanceMotion(self):
+		now = self._time()
+		while self.motionQueue and now - self.motionStart >= self.motionQueue[0][0]:
+			duration, m1delta, m2delta = self.motionQueue.pop(0)
+			self.motionStart += duration
+			self.encoderM1 += m1delta
+			self.encoderM2 += m2delta
+
+	# buffer=1 discards queued moves and executes immediately, buffer=0
+	# queues behind moves already buffered.
+	def _queueMotion(self, buffer, duration, m1delta, m2delta):
+		self._advanceMotion()
+		if buffer:
+			self.motionQueue = []
+		if not self.motionQueue:
+			self.motionStart = self._time()
+		self.motionQueue.append([duration, m1delta, m2delta])
+		return True
+
+	# Encoder values once every queued move has finished.
+	def _queuedEncoders(self):
+		m1 = self.encoderM1 + sum(entry[1] for entry in self.motionQueue)
+		m2 = self.encoderM2 + sum(entry[2] for entry in self.motionQueue)
+		return m1, m2
+
 	def ForwardM1(self,address,val):
 		if val == 0:
 			self.m1move = None
 		else:
 			self.m1move = "vel"
 			self.m1target = val
-			self.m1start = time.time()
+			self.m1start = self._time()
 			self.m1encStart = self.encoderM1
 		return True
 
@@ -59,7 +225,7 @@ class Roboclaw_stub:
 		else:
 			self.m1move = "vel"
 			self.m1target = -val
-			self.m1start = time.time()
+			self.m1start = self._time()
 			self.m1encStart = self.encoderM1
 		return True
 
@@ -69,7 +235,7 @@ class Roboclaw_stub:
 		else:
 			self.m2move = "vel"
 			self.m2target = val
-			self.m2start = time.time()
+			self.m2start = self._time()
 			self.m2encStart = self.encoderM2
 		return True
 
@@ -79,30 +245,47 @@ class Roboclaw_stub:
 		else:
 			self.m2move = "vel"
 			self.m2target = -val
-			self.m2start = time.time()
+			self.m2start = self._time()
 			self.m2encStart = self.encoderM2
 		return True
 
 	def ReadEncM1(self,address):
 		if self.m1move == "vel":
-			self.encoderM1 = int(self.m1encStart + (time.time() - self.m1start)*self.m1target)
+			self.encoderM1 = int(self.m1encStart + (self._time() - self.m1start)*self.m1target)
 		elif self.m1move == "pos":
 			# Placeholder - instantly move to target.
 			self.encoderM1 = self.m1target
 			self.m1move = None
-		return (1, self.encoderM1, 0)
+		return EncoderResult(1, self.encoderM1, 0)
 
 	def ReadEncM2(self,address):
 		if self.m2move == "vel":
-			self.encoderM2 = int(self.m2encStart + (time.time() - self.m2start)*self.m2target)
+			self.encoderM2 = int(self.m2encStart + (self._time() - self.m2start)*self.m2target)
 		elif self.m2move == "pos":
 			# Placeholder - instantly move to target.
 			self.encoderM2 = self.m2target
 			self.m2move = None
-		return (1, self.encoderM2, 0)
+		return EncoderResult(1, self.encoderM2, 0)
+
+	def ReadSpeedM1(self,address):
+		speed = self.m1target if self.m1move == "vel" else 0
+		return SpeedResult(1, abs(speed), 1 if speed < 0 else 0)
+
+	def ReadSpeedM2(self,address):
+		speed = self.m2target if self.m2move == "vel" else 0
+		return SpeedResult(1, abs(speed), 1 if speed < 0 else 0)
+
+	def ReadCurrents(self,address):
+		return CurrentsResult(1, 0, 0)
+
+	def ReadMainBatteryVoltage(self,address):
+		return ValueResult(1, 120)
+
+	def ReadLogicBatteryVoltage(self,address):
+		return ValueResult(1, 50)
 
 	def ReadVersion(self,address):
-		return (1, "TEST STUB API")
+		return VersionResult(1, "TEST STUB API")
 
 	def SetEncM1(self,address,cnt):
 		self.m1move = None
@@ -134,22 +317,26 @@ class Roboclaw_stub:
 		else:
 			self.m1move = "vel"
 			self.m1target = m1
-			self.m1start = time.time()
+			self.m1start = self._time()
 			self.m1encStart = self.encoderM1
 		if m2 == 0:
 			self.m2move = None
 		else:
 			self.m2move = "vel"
 			self.m2target = m2
-			self.m2start = time.time()
+			self.m2start = self._time()
 			self.m2encStart = self.encoderM2
 		return True
 
+	# Placeholder - the new speeds are reached instantly, ignoring accel.
+	def SpeedAccelM1M2(self,address,accel,m1,m2):
+		return Roboclaw_stub.SpeedM1M2(self,address,m1,m2)
+
 	def ReadM1VelocityPID(self,address):
-		return (1, self.vpm1, self.vim1, self.vdm1, self.vqppsm1)
+		return VelocityPIDResult(1, self.vpm1, self.vim1, self.vdm1, self.vqppsm1)
 
 	def ReadM2VelocityPID(self,address):
-		return (1, self.vpm2, self.vim2, self.vdm2, self.vqppsm2)
+		return VelocityPIDResult(1, self.vpm2, self.vim2, self.vdm2, self.vqppsm2)
 
 	def SetMainVoltages(self,address,min, max):
 		self.minVoltage = min
@@ -157,7 +344,15 @@ class Roboclaw_stub:
 		return True
 		
 	def ReadMinMaxMainVoltages(self,address):
-		return (1, self.minVoltage, self.maxVoltage)
+		return VoltagesResult(1, self.minVoltage, self.maxVoltage)
+
+	def SetLogicVoltages(self,address,min, max):
+		self.minLogicVoltage = min
+		self.maxLogicVoltage = max
+		return True
+
+	def ReadMinMaxLogicVoltages(self,address):
+		return VoltagesResult(1, self.minLogicVoltage, self.maxLogicVoltage)
 
 	def SetM1PositionPID(self,address,kp,ki,kd,kimax,deadzone,min,max):
 		self.ppm1, self.pim1, self.pdm1, self.pimaxm1, self.pdeadm1, self.pminm1, self.pmaxm1 = kp,ki,kd,kimax,deadzone,min,max
@@ -168,26 +363,53 @@ class Roboclaw_stub:
 		return True
 
 	def ReadM1PositionPID(self,address):
-		return (1, self.ppm1, self.pim1, self.pdm1, self.pimaxm1, self.pdeadm1, self.pminm1, self.pmaxm1)
+		return PositionPIDResult(1, self.ppm1, self.pim1, self.pdm1, self.pimaxm1, self.pdeadm1, self.pminm1, self.pmaxm1)
 
 	def ReadM2PositionPID(self,address):
-		return (1, self.ppm2, self.pim2, self.pdm2, self.pimaxm2, self.pdeadm2, self.pminm2, self.pmaxm2)
+		return PositionPIDResult(1, self.ppm2, self.pim2, self.pdm2, self.pimaxm2, self.pdeadm2, self.pminm2, self.pmaxm2)
+
+	def SpeedAccelDistanceM1M2(self,address,accel,speed1,distance1,speed2,distance2,buffer):
+		return self.SpeedAccelDistanceM1M2_2(address,accel,speed1,distance1,accel,speed2,distance2,buffer)
+
+	def SpeedAccelDistanceM1M2_2(self,address,accel1,speed1,distance1,accel2,speed2,distance2,buffer):
+		duration = max(self._moveTime(accel1, speed1, distance1), self._moveTime(accel2, speed2, distance2))
+		m1delta = distance1 if speed1 >= 0 else -distance1
+		m2delta = distance2 if speed2 >= 0 else -distance2
+		return self._queueMotion(buffer, duration, m1delta, m2delta)
 
 	def SpeedAccelDeccelPositionM1M2(self,address,accel1,speed1,deccel1,position1,accel2,speed2,deccel2,position2,buffer):
-		return True
+		if buffer:
+			self.motionQueue = []
+		m1, m2 = self._queuedEncoders()
+		duration = max(self._moveTime(accel1, speed1, position1 - m1), self._moveTime(accel2, speed2, position2 - m2))
+		return self._queueMotion(buffer, duration, position1 - m1, position2 - m2)
+
+	def ReadBuffers(self,address):
+		self._advanceMotion()
+		if not self.motionQueue:
+			return BuffersResult(1, 0x80, 0x80)
+		queued = len(self.motionQueue) - 1
+		return BuffersResult(1, queued, queued)
 
 	def SetPinFunctions(self,address,S3mode,S4mode,S5mode):
 		self.pinS3, self.pinS4, self.pinS5 = S3mode, S4mode, S5mode
 		return True
 
 	def ReadPinFunctions(self,address):
-		return (1,self.pinS3, self.pinS4, self.pinS5)
+		return PinFunctionsResult(1,self.pinS3, self.pinS4, self.pinS5)
+
+	def SetDeadBand(self,address,min,max):
+		self.deadBandMin, self.deadBandMax = min, max
+		return True
+
+	def GetDeadBand(self,address):
+		return DeadBandResult(1, self.deadBandMin, self.deadBandMax)
 
 	def ReadError(self,address):
-		return (1, 0)
+		return ValueResult(1, 0)
 
 	def ReadEncoderModes(self,address):
-		return (1, self.encoderModeM1, self.encoderModeM2)
+		return EncoderModesResult(1, self.encoderModeM1, self.encoderModeM2)
 		
 	def SetM1EncoderMode(self,address,mode):
 		self.encoderModeM1 = mode
@@ -205,7 +427,7 @@ class Roboclaw_stub:
 		return True
 
 	def GetConfig(self,address):
-		return (1, self.config)
+		return ValueResult(1, self.config)
 
 	def SetM1MaxCurrent(self,address,max):
 		self.maxCurrentM1 = max
@@ -216,17 +438,17 @@ class Roboclaw_stub:
 		return True;
 
 	def ReadM1MaxCurrent(self,address):
-		return (1,self.maxCurrentM1)
+		return ValueResult(1,self.maxCurrentM1)
 
 	def ReadM2MaxCurrent(self,address):
-		return (1,self.maxCurrentM2)
+		return ValueResult(1,self.maxCurrentM2)
 
 	def SetPWMMode(self,address,mode):
 		self.pwmMode = mode
 		return True;
 
 	def ReadPWMMode(self,address):
-		return (1,self.pwmMode)
+		return ValueResult(1,self.pwmMode)
 
 	def Open(self):
 		return 1
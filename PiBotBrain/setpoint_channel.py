@@ -0,0 +1,105 @@
+# Latest-value channel for setpoint style Roboclaw commands.
+
+# Commands like SpeedM1M2 or DutyM1 describe where a motor should be now, so
+# once a newer value exists an older unsent one is worthless. When a caller
+# (teleop client, control loop) produces setpoints faster than the serial
+# link can carry them, queueing every one would make the motors lag further
+# and further behind. SetpointChannel instead keeps only the newest pending
+# value per address and motor, sends from a background thread, and counts
+# the values it dropped. Control latency stays at about one packet time no
+# matter how fast setpoints arrive.
+
+from collections import OrderedDict
+import threading
+import time
+
+# Which motors each supported command sets. A command for both motors
+# supersedes pending commands for either one.
+M1 = ("M1",)
+M2 = ("M2",)
+M1M2 = ("M1", "M2")
+
+motorsByCommand = {
+	"ForwardM1": M1, "BackwardM1": M1, "ForwardBackwardM1": M1,
+	"ForwardM2": M2, "BackwardM2": M2, "ForwardBackwardM2": M2,
+	"DutyM1": M1, "DutyM2": M2, "DutyM1M2": M1M2,
+	"DutyAccelM1": M1, "DutyAccelM2": M2, "DutyAccelM1M2": M1M2,
+	"SpeedM1": M1, "SpeedM2": M2, "SpeedM1M2": M1M2,
+	"SpeedAccelM1": M1, "SpeedAccelM2": M2,
+	"SpeedAccelM1M2": M1M2, "SpeedAccelM1M2_2": M1M2,
+}
+
+class SetpointChannel:
+	'Coalesces setpoint commands so only the newest value is sent'
+
+	# rc: Roboclaw API object.
+	# minInterval: minimum seconds between two commands sent on the link.
+	def __init__(self, rc, minInterval=0.0):
+		self.rc = rc
+		self.minInterval = minInterval
+
+		self.submitted = 0
+		self.sent = 0
+		self.dropped = 0
+		self.failed = 0
+
+		self._pending = OrderedDict()
+		self._condition = threading.Condition()
+		self._lastSend = 0.0
+		self._closed = False
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+
+	# Queue a setpoint command, e.g. submit("SpeedM1M2", 0x80, 1000, -1000).
+	# Any unsent setpoint for the same address and motor(s) is dropped.
+	def submit(self, command, address, *args):
+		motors = motorsByCommand.get(command)
+		if motors is None:
+			raise ValueError("{0} is not a setpoint command".format(command))
+		with self._condition:
+			self.submitted += 1
+			for key in list(self._pending):
+				pendingAddress, pendingMotors = key
+				if pendingAddress == address and set(pendingMotors) <= set(motors):
+					del self._pending[key]
+					self.dropped += 1
+			self._pending[(address, motors)] = (command, address, args)
+			self._condition.notify()
+
+	def stats(self):
+		with self._condition:
+			return dict(submitted=self.submitted, sent=self.sent, dropped=self.dropped,
+				failed=self.failed, pending=len(self._pending))
+
+	# Stop the sending thread. Setpoints not yet sent are dropped.
+	def close(self):
+		with self._condition:
+			self._closed = True
+			self.dropped += len(self._pending)
+			self._pending.clear()
+			self._condition.notify()
+		self._thread.join()
+
+	def _run(self):
+		while True:
+			with self._condition:
+				while not self._pending and not self._closed:
+					self._condition.wait()
+				if self._closed:
+					return
+				wait = self._lastSend + self.minInterval - time.time()
+				if wait > 0:
+					# Let newer values replace pending ones while we wait.
+					self._condition.wait(wait)
+					continue
+				key, (command, address, args) = self._pending.popitem(last=False)
+
+			result = getattr(self.rc, command)(address, *args)
+
+			with self._condition:
+				self._lastSend = time.time()
+				if result:
+					self.sent += 1
+				else:
+					self.failed += 1
@@ -0,0 +1,106 @@
+# Table of the Roboclaw settings the app knows how to read and write.
+
+# Each Setting names its values ("fields"), the command that reads them and
+# the command that writes them. Settings that share a read command (the
+# two encoder modes come from one ReadEncoderModes) pick their values out
+# of its result, and readSettings() sends each read command only once.
+
+from collections import OrderedDict
+
+class SettingError(ValueError):
+	'Raised when a setting cannot be read or written'
+
+class Setting:
+	# name: key used by the API and profiles.
+	# fields: names of the values, in the order the write command takes them.
+	# read: Roboclaw command returning the values after the ok flag.
+	# write: Roboclaw command taking the address followed by the values.
+	# index: position of this setting's values in the read result, when
+	#   the read command returns more than this setting.
+	# integers: number of leading values to round to integers. The PID
+	#   reads return scaled floats although the app only writes integers.
+	# scale: fixed point scale the controller keeps those values at, as
+	#   the integer value * scale. Exact values are these integers, which
+	#   keep the fractions of a gain that rounding would lose.
+	def __init__(self, name, fields, read, write, index=0, integers=0, scale=1):
+		self.name = name
+		self.fields = tuple(fields)
+		self.read = read
+		self.write = write
+		self.index = index
+		self.integers = integers
+		self.scale = scale
+
+	# This setting's values out of a successful read result.
+	def values(self, result, exact=False):
+		values = tuple(result[1 + self.index:1 + self.index + len(self.fields)])
+		if self.integers:
+			scale = self.scale if exact else 1
+			values = tuple(int(round(v * scale)) for v in values[:self.integers]) + values[self.integers:]
+		return values
+
+	# Values as the write command takes them.
+	def writeValues(self, values, exact=False):
+		values = tuple(values)
+		if exact and self.integers:
+			values = tuple(v / float(self.scale) for v in values[:self.integers]) + values[self.integers:]
+		return values
+
+allSettings = OrderedDict((setting.name, setting) for setting in [
+	Setting("config", ["rcConfig"], "GetConfig", "SetConfig"),
+	Setting("mainVoltages", ["VmainMin", "VmainMax"], "ReadMinMaxMainVoltages", "SetMainVoltages"),
+	Setting("logicVoltages", ["VlogicMin", "VlogicMax"], "ReadMinMaxLogicVoltages", "SetLogicVoltages"),
+	Setting("deadBand", ["deadBandMin", "deadBandMax"], "GetDeadBand", "SetDeadBand"),
+	Setting("pwmMode", ["pwmMode"], "ReadPWMMode", "SetPWMMode"),
+	Setting("pinFunctions", ["s3", "s4", "s5"], "ReadPinFunctions", "SetPinFunctions"),
+	Setting("m1MaxCurrent", ["AmaxM1"], "ReadM1MaxCurrent", "SetM1MaxCurrent"),
+	Setting("m2MaxCurrent", ["AmaxM2"], "ReadM2MaxCurrent", "SetM2MaxCurrent"),
+	Setting("m1EncoderMode", ["encModeM1"], "ReadEncoderModes", "SetM1EncoderMode", index=0),
+	Setting("m2EncoderMode", ["encModeM2"], "ReadEncoderModes", "SetM2EncoderMode", index=1),
+	Setting("m1VelocityPID", ["m1P", "m1I", "m1D", "m1qpps"],
+		"ReadM1VelocityPID", "SetM1VelocityPID", integers=3, scale=65536),
+	Setting("m2VelocityPID", ["m2P", "m2I", "m2D", "m2qpps"],
+		"ReadM2VelocityPID", "SetM2VelocityPID", integers=3, scale=65536),
+	Setting("m1PositionPID", ["m1P", "m1I", "m1D", "m1maxI", "m1deadZone", "m1minPos", "m1maxPos"],
+		"ReadM1PositionPID", "SetM1PositionPID", integers=3, scale=1024),
+	Setting("m2PositionPID", ["m2P", "m2I", "m2D", "m2maxI", "m2deadZone", "m2minPos", "m2maxPos"],
+		"ReadM2PositionPID", "SetM2PositionPID", integers=3, scale=1024),
+])
+
+# Settings shown on each menu page.
+menuSettings = {
+	"config": ["config", "mainVoltages", "pwmMode", "pinFunctions",
+		"m1MaxCurrent", "m2MaxCurrent", "m1EncoderMode", "m2EncoderMode"],
+	"velocity": ["m1VelocityPID", "m2VelocityPID"],
+	"position": ["m1PositionPID", "m2PositionPID"],
+}
+
+# Read the named settings, returns an OrderedDict of name to values tuple.
+# Objects with ReadPipelined (Roboclaw) get all read commands in one batch.
+# exact: return PID gains as the controller's fixed point integers (see
+# Setting) instead of rounded.
+def readSettings(rc, address, names, exact=False):
+	reads = []
+	for name in names:
+		if allSettings[name].read not in reads:
+			reads.append(allSettings[name].read)
+	pipelined = getattr(rc, "ReadPipelined", None)
+	if pipelined is not None:
+		results = dict(zip(reads, pipelined(address, reads)))
+	else:
+		results = dict((read, getattr(rc, read)(address)) for read in reads)
+	values = OrderedDict()
+	for name in names:
+		setting = allSettings[name]
+		if not results[setting.read][0]:
+			raise SettingError("{0} failed".format(setting.read))
+		values[name] = setting.values(results[setting.read], exact)
+	return values
+
+# exact: values are as readSettings returns them with exact=True.
+def writeSetting(rc, address, name, values, exact=False):
+	setting = allSettings[name]
+	if len(values) != len(setting.fields):
+		raise SettingError("{0} takes {1} values".format(name, len(setting.fields)))
+	if not getattr(rc, setting.write)(address, *setting.writeValues(values, exact)):
+		raise SettingError("{0} failed".format(setting.write))
@@ -0,0 +1,122 @@
+# Write-through cache of Roboclaw settings.
+
+# Settings (PIDs, current limits, encoder modes, PWM mode, pin functions,
+# voltage limits, deadband) only change when they are written, yet the
+# menu pages read them all on every request. SettingsCache wraps a Roboclaw
+# API object and answers the read commands of settings.py from memory once
+# they have been read. A successful Set* call updates the cached values;
+# a failed one drops them, since the controller may or may not have taken
+# the new values. RestoreDefaults and ReadNVM drop everything cached for
+# the address, and refresh() drops it on request. Live values (encoders,
+# speeds, currents, status) are always read from the controller.
+
+# The config word is never cached: the link health monitor changes its
+# baud bits directly on the Roboclaw.
+
+# The cache only knows about writes made through it. If another program
+# can change settings (through roboclaw_daemon, or Motion Studio on the
+# same controller), do not use it, or call refresh() afterwards.
+
+from settings import allSettings
+
+_cached = [setting for setting in allSettings.values() if setting.name != "config"]
+
+# Read commands answered from the cache.
+_cachedReads = set(setting.read for setting in _cached)
+
+# Write command to the Setting it writes.
+_writes = dict((setting.write, setting) for setting in _cached)
+
+# Other commands that change settings, to the read command whose results
+# they spoil, or None for all of them.
+_invalidating = {
+	'RestoreDefaults': None,
+	'ReadNVM': None,
+	'SetMinVoltageMainBattery': 'ReadMinMaxMainVoltages',
+	'SetMaxVoltageMainBattery': 'ReadMinMaxMainVoltages',
+	'SetMinVoltageLogicBattery': 'ReadMinMaxLogicVoltages',
+	'SetMaxVoltageLogicBattery': 'ReadMinMaxLogicVoltages',
+}
+
+class SettingsCache:
+	def __init__(self, rc):
+		self._rc = rc
+		# (address, read command) to its last successful result.
+		self._results = {}
+
+	# Forget cached settings of the given address, or of every address, so
+	# they are read from the controller next time.
+	def refresh(self, address=None):
+		for key in list(self._results):
+			if address is None or key[0] == address:
+				del self._results[key]
+
+	def __getattr__(self, name):
+		attr = getattr(self._rc, name)
+		if not callable(attr):
+			return attr
+		if name in _cachedReads:
+			method = self._read(name, attr)
+		elif name in _writes:
+			method = self._write(_writes[name], attr)
+		elif name in _invalidating:
+			method = self._invalidate(_invalidating[name], attr)
+		elif name == 'ReadPipelined':
+			method = self._readPipelined(attr)
+		else:
+			method = attr
+		# Cache so later lookups do not come through __getattr__ again.
+		self.__dict__[name] = method
+		return method
+
+	def _read(self, name, read):
+		results = self._results
+		def cachedRead(address):
+			result = results.get((address, name))
+			if result is None:
+				result = read(address)
+				if result[0]:
+					results[(address, name)] = result
+			return result
+		return cachedRead
+
+	def _write(self, setting, write):
+		results = self._results
+		def writeThrough(address, *values):
+			ok = write(address, *values)
+			key = (address, setting.read)
+			cached = results.get(key)
+			if cached is None:
+				return ok
+			if ok and len(values) == len(setting.fields):
+				result = list(cached)
+				result[1 + setting.index:1 + setting.index + len(values)] = values
+				results[key] = getattr(cached, '_make', tuple)(result)
+			else:
+				del results[key]
+			return ok
+		return writeThrough
+
+	def _invalidate(self, read, method):
+		def invalidating(address, *args):
+			try:
+				return method(address, *args)
+			finally:
+				if read is None:
+					self.refresh(address)
+				else:
+					self._results.pop((address, read), None)
+		return invalidating
+
+	# Batched reads: the cached ones are answered from memory, the rest
+	# still go out in one batch.
+	def _readPipelined(self, pipelined):
+		results = self._results
+		def cachedPipelined(address, names):
+			missing = [name for name in names if (address, name) not in results]
+			fresh = dict(zip(missing, pipelined(address, missing))) if missing else {}
+			for name, result in fresh.items():
+				if name in _cachedReads and result[0]:
+					results[(address, name)] = result
+			return [fresh[name] if name in fresh else results[(address, name)] for name in names]
+		return cachedPipelined
@@ -0,0 +1,171 @@
+# Backup and restore of all Roboclaw settings the app knows about, for
+# swapping a failed controller or cloning a working one.
+
+# Export reads every setting in one pipelined sweep (see
+# Roboclaw.ReadPipelined). Import turns the snapshot into a provisioning
+# profile, so only the settings that differ are written, verified and
+# saved to NVM.
+
+# Snapshot format, version 2: the bytes "RCS\x02", then a varint bit mask
+# of the settings present (bit n is snapshotSettings[n]), then the values
+# of each present setting in order, as zigzag varints. PID gains are the
+# controller's fixed point words (gain * 65536 for velocity, * 1024 for
+# position), so fractional gains survive a restore. A full snapshot is
+# well under 100 bytes. toText() gives a base64 form that fits in a note or a
+# chat message. Version 1 snapshots, with gains rounded to integers, can
+# still be restored.
+
+# Default accelerations (SetM1DefaultAccel, SetM2DefaultAccel) are not
+# included: the Roboclaw API has no command to read them back.
+
+# Usage:
+#   python snapshot.py export /dev/ttyACM0 backup.rcss [--address 0x80]
+#   python snapshot.py import /dev/ttyACM0 backup.rcss [--address 0x80] [--dry-run]
+# Use - as the file name for the text form on stdin/stdout.
+
+import argparse
+import base64
+from collections import OrderedDict
+import sys
+
+from provision import Profile, openRoboclaw, provision
+from settings import allSettings, readSettings
+
+_MAGIC = b"RCS\x02"
+_MAGIC_V1 = b"RCS\x01"
+
+# Order of settings in the format. Append only, never reorder.
+snapshotSettings = ["config", "mainVoltages", "logicVoltages", "deadBand",
+	"pwmMode", "pinFunctions", "m1MaxCurrent", "m2MaxCurrent",
+	"m1EncoderMode", "m2EncoderMode", "m1VelocityPID", "m2VelocityPID",
+	"m1PositionPID", "m2PositionPID"]
+
+class SnapshotError(ValueError):
+	'Raised when snapshot data cannot be decoded'
+
+def _writeVarint(value, out):
+	while True:
+		byte = value & 0x7F
+		value >>= 7
+		if value:
+			out.append(byte | 0x80)
+		else:
+			out.append(byte)
+			return
+
+def _readVarint(data, offset):
+	value = shift = 0
+	while True:
+		if offset >= len(data):
+			raise SnapshotError("Snapshot is truncated")
+		byte = data[offset]
+		offset += 1
+		value |= (byte & 0x7F) << shift
+		shift += 7
+		if not byte & 0x80:
+			return value, offset
+
+class Snapshot:
+	# settings: OrderedDict of setting name to values tuple, PID gains as
+	# fixed point words (readSettings with exact=True).
+	def __init__(self, settings):
+		self.settings = settings
+
+	@classmethod
+	def read(cls, rc, address):
+		return cls(readSettings(rc, address, snapshotSettings, exact=True))
+
+	def encode(self):
+		out = bytearray(_MAGIC)
+		mask = 0
+		for index, name in enumerate(snapshotSettings):
+			if name in self.settings:
+				mask |= 1 << index
+		_writeVarint(mask, out)
+		for name in snapshotSettings:
+			for value in self.settings.get(name, ()):
+				value = int(value)
+				_writeVarint((value << 1) ^ (value >> 63), out)
+		return bytes(out)
+
+	@classmethod
+	def decode(cls, data):
+		data = bytearray(data)
+		version1 = data[:len(_MAGIC_V1)] == bytearray(_MAGIC_V1)
+		if data[:len(_MAGIC)] != bytearray(_MAGIC) and not version1:
+			raise SnapshotError("Not a settings snapshot")
+		mask, offset = _readVarint(data, len(_MAGIC))
+		settings = OrderedDict()
+		for index, name in enumerate(snapshotSettings):
+			if not mask & (1 << index):
+				continue
+			values = []
+			for field in allSettings[name].fields:
+				value, offset = _readVarint(data, offset)
+				values.append((value >> 1) ^ -(value & 1))
+			setting = allSettings[name]
+			if version1:
+				values[:setting.integers] = [value * setting.scale for value in values[:setting.integers]]
+			settings[name] = tuple(values)
+		if mask >> len(snapshotSettings):
+			raise SnapshotError("Snapshot has settings this version does not know")
+		if offset != len(data):
+			raise SnapshotError("Snapshot has trailing data")
+		return cls(settings)
+
+	def toText(self):
+		return base64.urlsafe_b64encode(self.encode()).decode("ascii").rstrip("=")
+
+	@classmethod
+	def fromText(cls, text):
+		text = text.strip()
+		try:
+			return cls.decode(base64.urlsafe_b64decode(str(text + "=" * (-len(text) % 4))))
+		except (TypeError, ValueError) as e:
+			if isinstance(e, SnapshotError):
+				raise
+			raise SnapshotError("Not a settings snapshot")
+
+	# Profile that restores this snapshot at the given address.
+	def profile(self, address):
+		settings = OrderedDict((name, self.settings[name]) for name in allSettings if name in self.settings)
+		return Profile(settings, address, exact=True)
+
+# Restore a snapshot with the minimum number of writes. Returns the
+# provision.ProvisionResult.
+def restore(rc, address, snapshot, dryRun=False):
+	return provision(rc, snapshot.profile(address), address, dryRun)
+
+def main():
+	parser = argparse.ArgumentParser(description="Back up or restore Roboclaw settings")
+	parser.add_argument("action", choices=["export", "import"])
+	parser.add_argument("port", help="serial port, Test_Stub or roboclaw_daemon socket")
+	parser.add_argument("file", help="snapshot file, - for base64 text on stdout/stdin")
+	parser.add_argument("--address", type=lambda text: int(text, 0), default=0x80)
+	parser.add_argument("--baudrate", type=int, default=115200)
+	parser.add_argument("--dry-run", action="store_true", help="import: only report what would change")
+	args = parser.parse_args()
+
+	try:
+		rc = openRoboclaw(args.port, args.baudrate)
+		if args.action == "export":
+			snapshot = Snapshot.read(rc, args.address)
+			if args.file == "-":
+				print(snapshot.toText())
+			else:
+				with open(args.file, "wb") as f:
+					f.write(snapshot.encode())
+		else:
+			if args.file == "-":
+				snapshot = Snapshot.fromText(sys.stdin.read())
+			else:
+				with open(args.file, "rb") as f:
+					snapshot = Snapshot.decode(f.read())
+			print(restore(rc, args.address, snapshot, args.dry_run))
+	except (IOError, ValueError) as e:
+		print("Snapshot {0} failed: {1}".format(args.action, e))
+		return 1
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
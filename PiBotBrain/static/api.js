@@ -0,0 +1,386 @@
+// In-place updates for the menu pages through the JSON API in testconfig.py.
+// Forms keep working without JavaScript; with it they are sent with fetch
+// and only the affected parts of the page change.
+//
+// <form data-settings="/api/velocity/settings?address=128" data-groups='{...}'>
+//   Settings form. data-groups maps each setting to its field names. Only
+//   settings with a changed field are sent, so an unchanged form costs no
+//   serial traffic at all.
+// <form data-action="/api/run_velocity?address=128" data-refresh="...">
+//   Action form, every field is sent. Afterwards the encoder readouts are
+//   refreshed from the data-refresh URL, if given. With data-motion the
+//   page also waits for the move to finish, asking that URL (/api/motion),
+//   and says so. For a path it shows the segments done as they finish.
+// <canvas data-history="/api/history?address=128&series=m1speed,m2speed">
+//   Live chart of recent history, redrawn every second. The server
+//   downsamples each series to the canvas width.
+// <div data-teleop="/teleop?address=128">
+//   Joystick pad driving over a WebSocket. While connected the pad position
+//   is sent 25 times a second, zero when nothing touches it; the server
+//   stops the motors if setpoints stop arriving.
+
+(function() {
+	function showMessages(messages) {
+		var page = document.querySelector(".page");
+		var old = page.querySelectorAll(".flash");
+		for (var i = 0; i < old.length; i++) {
+			old[i].parentNode.removeChild(old[i]);
+		}
+		messages.forEach(function(message) {
+			var div = document.createElement("div");
+			div.className = "flash " + message[0];
+			div.textContent = message[1];
+			page.insertBefore(div, page.firstChild);
+		});
+	}
+
+	function send(url, body) {
+		return fetch(url, {
+			method: body === undefined ? "GET" : "POST",
+			credentials: "same-origin",
+			headers: {"Content-Type": "application/json"},
+			body: body === undefined ? undefined : JSON.stringify(body)
+		}).then(function(response) {
+			return response.json();
+		}).then(function(reply) {
+			var messages = reply.messages || [];
+			if (reply.result != "success" && messages.length == 0) {
+				messages = [["error", reply.result]];
+			}
+			showMessages(messages);
+			return reply;
+		}).catch(function(error) {
+			showMessages([["error", "Request failed: " + error]]);
+			throw error;
+		});
+	}
+
+	// Value of an input as the API expects it. Inputs marked data-hex hold
+	// hexadecimal text like 0x8003.
+	function fieldValue(input) {
+		if (input.hasAttribute("data-hex")) {
+			return parseInt(input.value, 16);
+		}
+		if (input.type == "number") {
+			return parseInt(input.value, 10);
+		}
+		return input.value;
+	}
+
+	function formValues(form) {
+		var values = {};
+		for (var i = 0; i < form.elements.length; i++) {
+			var input = form.elements[i];
+			if (!input.name || input.type == "submit" || ((input.type == "radio" || input.type == "checkbox") && !input.checked)) {
+				continue;
+			}
+			values[input.name] = fieldValue(input);
+		}
+		return values;
+	}
+
+	// The velocity and position forms can copy motor 1 values to motor 2.
+	function copyM1(form) {
+		var choice = form.querySelector("input[name=m2values]:checked");
+		if (!choice || choice.value != "copym1") {
+			return;
+		}
+		for (var i = 0; i < form.elements.length; i++) {
+			var input = form.elements[i];
+			if (input.name && input.name.indexOf("m2") == 0 && input.name != "m2values") {
+				var source = form.elements["m1" + input.name.substring(2)];
+				if (source) {
+					input.value = source.value;
+				}
+			}
+		}
+	}
+
+	function bindSettings(form) {
+		var url = form.getAttribute("data-settings");
+		var groups = JSON.parse(form.getAttribute("data-groups"));
+		var original = formValues(form);
+		form.addEventListener("submit", function(event) {
+			event.preventDefault();
+			copyM1(form);
+			var values = formValues(form);
+			var changed = {};
+			var count = 0;
+			Object.keys(groups).forEach(function(name) {
+				var fields = groups[name];
+				if (fields.some(function(field) { return values[field] !== original[field]; })) {
+					fields.forEach(function(field) { changed[field] = values[field]; });
+					count++;
+				}
+			});
+			if (count == 0) {
+				showMessages([["success", "Nothing changed"]]);
+				return;
+			}
+			send(url, changed).then(function(reply) {
+				if (reply.result == "success") {
+					Object.keys(changed).forEach(function(field) { original[field] = changed[field]; });
+				}
+			});
+		});
+	}
+
+	function refreshEncoders(url) {
+		return send(url).then(function(reply) {
+			if (reply.result != "success") {
+				return;
+			}
+			Object.keys(reply.values).forEach(function(name) {
+				var element = document.getElementById(name + "Value");
+				if (element) {
+					var value = reply.values[name];
+					element.textContent = name.indexOf("Status") > 0 ? "0x" + value.toString(16) : value;
+				}
+			});
+		});
+	}
+
+	function pathStatus(path) {
+		var done = path.completed + " of " + path.total + " segments";
+		if (path.state == "running") {
+			return ["success", "Path: " + done + " done, " + path.sent + " sent"];
+		} else if (path.state == "finished") {
+			return ["success", "Path finished, " + path.total + " segments"];
+		} else if (path.state == "cancelled") {
+			return ["success", "Path stopped after " + done];
+		}
+		return ["error", "Path failed after " + done + ": " + path.error];
+	}
+
+	// Ask the server to hold the reply until the move finishes, again and
+	// again for long moves.
+	function waitForMotion(url, refresh) {
+		return fetch(url + "&wait=10", {credentials: "same-origin"}).then(function(response) {
+			return response.json();
+		}).then(function(reply) {
+			if (reply.result != "success") {
+				showMessages([["error", reply.result]]);
+			} else if (!reply.done) {
+				if (reply.path) {
+					showMessages([pathStatus(reply.path)]);
+				}
+				return waitForMotion(url, refresh);
+			} else {
+				showMessages([reply.path ? pathStatus(reply.path) : ["success", "Move finished" +
+					(reply.seconds === undefined ? "" : " after " + reply.seconds.toFixed(1) + " s")]]);
+				if (refresh) {
+					refreshEncoders(refresh);
+				}
+			}
+		});
+	}
+
+	function bindAction(form) {
+		var url = form.getAttribute("data-action");
+		var refresh = form.getAttribute("data-refresh");
+		var motion = form.getAttribute("data-motion");
+		form.addEventListener("submit", function(event) {
+			event.preventDefault();
+			send(url, formValues(form)).then(function(reply) {
+				if (reply.result != "success") {
+					return;
+				}
+				if (refresh) {
+					refreshEncoders(refresh);
+				}
+				if (motion) {
+					waitForMotion(motion, refresh);
+				}
+			});
+		});
+	}
+
+	var chartColors = ["#1f77b4", "#d62728", "#2ca02c", "#ff7f0e"];
+
+	function drawChart(canvas, series) {
+		var context = canvas.getContext("2d");
+		var width = canvas.width;
+		var height = canvas.height;
+		var names = Object.keys(series);
+		var seconds = parseFloat(canvas.getAttribute("data-seconds") || "60");
+		var low = Infinity;
+		var high = -Infinity;
+		names.forEach(function(name) {
+			series[name][1].forEach(function(value) {
+				low = Math.min(low, value);
+				high = Math.max(high, value);
+			});
+		});
+		if (low == high) {
+			low -= 1;
+			high += 1;
+		}
+		context.clearRect(0, 0, width, height);
+		context.fillStyle = "black";
+		context.fillText(high, 2, 10);
+		context.fillText(low, 2, height - 2);
+		names.forEach(function(name, index) {
+			var times = series[name][0];
+			var values = series[name][1];
+			context.strokeStyle = chartColors[index % chartColors.length];
+			context.fillStyle = context.strokeStyle;
+			context.fillText(name, width - 60, 12 * (index + 1));
+			context.beginPath();
+			for (var i = 0; i < times.length; i++) {
+				var x = width * (1 + times[i] / seconds);
+				var y = height - 1 - (height - 2) * (values[i] - low) / (high - low);
+				if (i == 0) {
+					context.moveTo(x, y);
+				} else {
+					context.lineTo(x, y);
+				}
+			}
+			context.stroke();
+		});
+	}
+
+	// Charts poll quietly: failures do not replace the page messages.
+	function bindChart(canvas) {
+		var url = canvas.getAttribute("data-history") + "&width=" + canvas.width +
+			"&seconds=" + (canvas.getAttribute("data-seconds") || "60");
+		function update() {
+			fetch(url, {credentials: "same-origin"}).then(function(response) {
+				return response.json();
+			}).then(function(reply) {
+				if (reply.result == "success") {
+					drawChart(canvas, reply.series);
+				} else {
+					canvas.title = reply.result;
+				}
+			}).catch(function() {}).then(function() {
+				setTimeout(update, 1000);
+			});
+		}
+		update();
+	}
+
+	function drawPad(canvas, linear, angular) {
+		var context = canvas.getContext("2d");
+		var half = canvas.width / 2;
+		context.clearRect(0, 0, canvas.width, canvas.height);
+		context.strokeStyle = "#999";
+		context.beginPath();
+		context.moveTo(half, 0);
+		context.lineTo(half, canvas.height);
+		context.moveTo(0, half);
+		context.lineTo(canvas.width, half);
+		context.stroke();
+		context.fillStyle = "red";
+		context.beginPath();
+		context.arc(half + angular * half, half - linear * half, 10, 0, 2 * Math.PI);
+		context.fill();
+	}
+
+	function bindTeleop(element) {
+		var pad = element.querySelector(".teleop-pad");
+		var speed = element.querySelector(".teleop-speed");
+		var button = element.querySelector(".teleop-connect");
+		var feedback = element.querySelector(".teleop-feedback");
+		var socket = null;
+		var timer = null;
+		var linear = 0;
+		var angular = 0;
+		var pressed = false;
+
+		function disconnect(text) {
+			clearInterval(timer);
+			if (socket) {
+				socket.close();
+			}
+			socket = null;
+			button.value = "Connect";
+			feedback.textContent = text;
+		}
+
+		function send() {
+			if (socket && socket.readyState == WebSocket.OPEN) {
+				socket.send(JSON.stringify({linear: linear, angular: angular}));
+			}
+		}
+
+		button.addEventListener("click", function() {
+			if (socket) {
+				disconnect("Not connected");
+				return;
+			}
+			var url = new URL(element.getAttribute("data-teleop"), location.href);
+			url.protocol = location.protocol == "https:" ? "wss:" : "ws:";
+			url.searchParams.set("speed", speed.value);
+			url.searchParams.set("format", "binary");
+			socket = new WebSocket(url.href);
+			socket.binaryType = "arraybuffer";
+			socket.onopen = function() {
+				button.value = "Disconnect";
+				feedback.textContent = "Connected";
+				timer = setInterval(send, 40);
+			};
+			// Feedback comes as telemetry frames, errors as JSON text.
+			socket.onmessage = function(event) {
+				if (typeof event.data == "string") {
+					feedback.textContent = JSON.parse(event.data).result;
+					return;
+				}
+				var reply = telemetry.decode(event.data)[0];
+				feedback.textContent = "M1 " + reply.m1speed + "/" + reply.m1target + " qpps, encoder " + reply.m1enc +
+					"; M2 " + reply.m2speed + "/" + reply.m2target + " qpps, encoder " + reply.m2enc;
+			};
+			socket.onclose = function() {
+				if (socket) {
+					disconnect("Connection closed");
+				}
+			};
+		});
+
+		function move(event) {
+			if (!pressed) {
+				return;
+			}
+			var box = pad.getBoundingClientRect();
+			var half = box.width / 2;
+			angular = Math.max(-1, Math.min(1, (event.clientX - box.left - half) / half));
+			linear = Math.max(-1, Math.min(1, (half - (event.clientY - box.top)) / half));
+			drawPad(pad, linear, angular);
+		}
+
+		function release() {
+			pressed = false;
+			linear = angular = 0;
+			drawPad(pad, 0, 0);
+			send();
+		}
+
+		pad.addEventListener("pointerdown", function(event) {
+			pressed = true;
+			pad.setPointerCapture(event.pointerId);
+			move(event);
+		});
+		pad.addEventListener("pointermove", move);
+		pad.addEventListener("pointerup", release);
+		pad.addEventListener("pointercancel", release);
+		drawPad(pad, 0, 0);
+	}
+
+	document.addEventListener("DOMContentLoaded", function() {
+		var forms = document.querySelectorAll("form[data-settings]");
+		for (var i = 0; i < forms.length; i++) {
+			bindSettings(forms[i]);
+		}
+		forms = document.querySelectorAll("form[data-action]");
+		for (i = 0; i < forms.length; i++) {
+			bindAction(forms[i]);
+		}
+		var charts = document.querySelectorAll("canvas[data-history]");
+		for (i = 0; i < charts.length; i++) {
+			bindChart(charts[i]);
+		}
+		var teleops = document.querySelectorAll("[data-teleop]");
+		for (i = 0; i < teleops.length; i++) {
+			bindTeleop(teleops[i]);
+		}
+	});
+})();
@@ -0,0 +1,73 @@
+// Service worker for the PiBot Brain kiosk.
+// Fingerprinted assets (/assets/<hash>/...) never change, so they are served
+// from cache without touching the network. Pages always come from the app,
+// since they show live controller values, but the last copy of each page is
+// kept so it can still be shown if the app is unreachable.
+// ASSETS, the URLs of the current assets, is put in front of this script by
+// the app. When an asset changes so does this script, the browser installs
+// it again, and activate drops the cached copies of outdated URLs.
+
+var CACHE = "pibot-v1";
+
+self.addEventListener("install", function(event) {
+	self.skipWaiting();
+});
+
+self.addEventListener("activate", function(event) {
+	event.waitUntil(caches.keys().then(function(keys) {
+		return Promise.all(keys.filter(function(key) {
+			return key != CACHE;
+		}).map(function(key) {
+			return caches.delete(key);
+		}));
+	}).then(function() {
+		return caches.open(CACHE);
+	}).then(function(cache) {
+		return cache.keys().then(function(requests) {
+			return Promise.all(requests.filter(function(request) {
+				var path = new URL(request.url).pathname;
+				return path.indexOf("/assets/") == 0 && ASSETS.indexOf(path) < 0;
+			}).map(function(request) {
+				return cache.delete(request);
+			}));
+		});
+	}).then(function() {
+		return self.clients.claim();
+	}));
+});
+
+self.addEventListener("fetch", function(event) {
+	var request = event.request;
+	if (request.method != "GET") {
+		return;
+	}
+	var url = new URL(request.url);
+	if (url.origin != location.origin) {
+		return;
+	}
+
+	if (url.pathname.indexOf("/assets/") == 0) {
+		event.respondWith(caches.open(CACHE).then(function(cache) {
+			return cache.match(request).then(function(cached) {
+				return cached || fetch(request).then(function(response) {
+					if (response.ok) {
+						cache.put(request, response.clone());
+					}
+					return response;
+				});
+			});
+		}));
+	} else if (request.mode == "navigate") {
+		event.respondWith(fetch(request).then(function(response) {
+			if (response.ok) {
+				var copy = response.clone();
+				caches.open(CACHE).then(function(cache) {
+					cache.put(request, copy);
+				});
+			}
+			return response;
+		}).catch(function() {
+			return caches.match(request);
+		}));
+	}
+});
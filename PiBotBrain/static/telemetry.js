@@ -0,0 +1,47 @@
+// Decoder for the binary telemetry frames of telemetry.py. Layouts must
+// match messageTypes there: each frame is a type byte, a byte of valid
+// field bits, then the fields little endian. Fields sent without a value
+// decode as null.
+//
+// telemetry.decode(arrayBuffer) returns a list of messages, each an object
+// of field values plus "type", the message type name.
+
+var telemetry = (function() {
+	var mimetype = "application/x-pibot-telemetry";
+
+	// Type id to [name, [field, DataView getter, size]...]
+	var messageTypes = {
+		1: ["encoders", [["m1enc", "getInt32", 4], ["m2enc", "getInt32", 4],
+			["m1encStatus", "getUint8", 1], ["m2encStatus", "getUint8", 1]]],
+		2: ["motion", [["m1enc", "getInt32", 4], ["m2enc", "getInt32", 4],
+			["m1speed", "getInt32", 4], ["m2speed", "getInt32", 4],
+			["m1target", "getInt32", 4], ["m2target", "getInt32", 4]]]
+	};
+
+	function decode(buffer) {
+		var view = new DataView(buffer);
+		var messages = [];
+		var offset = 0;
+		while (offset < view.byteLength) {
+			var type = messageTypes[view.getUint8(offset)];
+			if (!type) {
+				throw new Error("Unknown telemetry message type " + view.getUint8(offset));
+			}
+			var valid = view.getUint8(offset + 1);
+			offset += 2;
+			var message = {type: type[0]};
+			type[1].forEach(function(field, bit) {
+				var value = view[field[1]](offset, true);
+				message[field[0]] = valid & (1 << bit) ? value : null;
+				offset += field[2];
+			});
+			messages.push(message);
+		}
+		return messages;
+	}
+
+	// Accept header asking for telemetry, with JSON as the fallback.
+	var accept = mimetype + ", application/json;q=0.5";
+
+	return {mimetype: mimetype, accept: accept, decode: decode};
+})();
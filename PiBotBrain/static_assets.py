@@ -0,0 +1,138 @@
+# Serves files under static/ with fingerprinted URLs, long lived cache
+# headers and gzip precompression, so the kiosk browser loads pages without
+# waiting on the network.
+
+# assetUrl('style.css') returns /assets/<hash>/style.css where the hash is
+# taken from the file contents. Since the URL changes whenever the file
+# does, browsers may cache it forever. If a gzipped copy (style.css.gz) is
+# present, no older than the file, and the browser accepts gzip, that copy
+# is sent as-is. The copies are written by fetch_assets.py at setup, not
+# when the app starts, so static/ may be read-only.
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import abort, make_response, request, send_from_directory
+
+# One year, the longest cache lifetime browsers honor.
+cacheSeconds = 365 * 24 * 60 * 60
+
+# Files worth compressing. Fonts and images are already compressed.
+compressibleExtensions = (".css", ".js", ".svg", ".html", ".json")
+
+class StaticAssets:
+	def __init__(self, app=None):
+		self._fingerprints = {}
+		# File name to whether an up to date .gz copy exists.
+		self._compressed = {}
+		self._serviceWorker = None
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		self.folder = app.static_folder
+		app.add_url_rule('/assets/<fingerprint>/<path:filename>', 'asset', self.serve)
+		app.add_url_rule('/sw.js', 'service_worker', self.serviceWorker)
+		app.jinja_env.globals['assetUrl'] = self.url
+
+	# Content hash of a file under static/, or None if there is no such file.
+	def fingerprint(self, filename):
+		fingerprint = self._fingerprints.get(filename)
+		if fingerprint is None:
+			path = os.path.join(self.folder, filename)
+			if not os.path.isfile(path):
+				return None
+			with open(path, 'rb') as f:
+				fingerprint = hashlib.md5(f.read()).hexdigest()[:12]
+			self._fingerprints[filename] = fingerprint
+		return fingerprint
+
+	# URL for a file under static/, or None if the file does not exist.
+	def url(self, filename):
+		fingerprint = self.fingerprint(filename)
+		if fingerprint is None:
+			return None
+		return "/assets/{0}/{1}".format(fingerprint, filename)
+
+	def serve(self, fingerprint, filename):
+		if self.fingerprint(filename) is None:
+			abort(404)
+		compressed = filename + ".gz"
+		if 'gzip' in request.headers.get('Accept-Encoding', '') and self._hasCompressed(filename):
+			mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+			response = send_from_directory(self.folder, compressed, mimetype=mimetype)
+			response.headers['Content-Encoding'] = 'gzip'
+		else:
+			response = send_from_directory(self.folder, filename)
+		response.headers['Vary'] = 'Accept-Encoding'
+		response.cache_control.max_age = cacheSeconds
+		response.cache_control.public = True
+		response.cache_control.immutable = True
+		# A stale fingerprint still gets the current file, but must not be
+		# cached forever under the old URL.
+		if fingerprint != self.fingerprint(filename):
+			response.cache_control.max_age = 0
+			response.cache_control.immutable = False
+		return response
+
+	# Whether the file has a .gz copy at least as new as itself. A stale
+	# copy (the file was edited since fetch_assets.py ran) is not used.
+	def _hasCompressed(self, filename):
+		compressed = self._compressed.get(filename)
+		if compressed is None:
+			path = os.path.join(self.folder, filename)
+			compressed = (os.path.isfile(path + ".gz") and
+				os.path.getmtime(path + ".gz") >= os.path.getmtime(path))
+			self._compressed[filename] = compressed
+		return compressed
+
+	# URLs of every file under static/ (but the .gz copies and the service
+	# worker itself).
+	def urls(self):
+		urls = []
+		for root, dirs, files in os.walk(self.folder):
+			for name in files:
+				if name.endswith(".gz") or name == 'sw.js':
+					continue
+				filename = os.path.relpath(os.path.join(root, name), self.folder).replace(os.sep, '/')
+				urls.append(self.url(filename))
+		return sorted(urls)
+
+	# The service worker has to be served from the root to control every
+	# page, and must never be cached so updates are picked up. It is sent
+	# with the current asset URLs in front (var ASSETS = [...]), so it
+	# changes whenever an asset does and the browser installs it again,
+	# dropping the outdated copies from its cache.
+	def serviceWorker(self):
+		if self._serviceWorker is None:
+			with open(os.path.join(self.folder, 'sw.js'), 'rb') as f:
+				script = f.read().decode('utf-8')
+			self._serviceWorker = "var ASSETS = {0};\n{1}".format(json.dumps(self.urls()), script)
+		response = make_response(self._serviceWorker)
+		response.mimetype = 'application/javascript'
+		response.cache_control.max_age = 0
+		response.cache_control.no_cache = True
+		return response
+
+# Write a .gz copy next to every compressible file under folder whose copy
+# is missing or older than the file. Returns the number of files written.
+# Run by fetch_assets.py; the app only serves the copies.
+def compressAssets(folder):
+	written = 0
+	for root, dirs, files in os.walk(folder):
+		for name in files:
+			if not name.endswith(compressibleExtensions):
+				continue
+			path = os.path.join(root, name)
+			compressed = path + ".gz"
+			if os.path.isfile(compressed) and os.path.getmtime(compressed) >= os.path.getmtime(path):
+				continue
+			with open(path, 'rb') as source:
+				with gzip.open(compressed, 'wb', 9) as target:
+					shutil.copyfileobj(source, target)
+			written += 1
+	return written
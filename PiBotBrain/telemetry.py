@@ -0,0 +1,76 @@
+# Packed binary encoding of telemetry messages, the compact alternative to
+# JSON for clients polling or streaming controller values.
+
+# Every message type has a fixed layout, so a frame is a struct.pack of
+# ints: no key names, no number formatting, and always the same size. A
+# frame is
+#   type    1 byte, messageTypes id
+#   valid   1 byte, bit n set if field n holds a value (failed reads are
+#           sent as 0 with their bit clear, where JSON would have null)
+#   fields  little endian, layout of the type
+# Frames can be sent back to back in one payload; the decoder knows each
+# frame's size from its type. static/telemetry.js decodes them in the
+# browser and must be kept in step with messageTypes.
+
+# Clients ask for it with "Accept: application/x-pibot-telemetry" (HTTP) or
+# format=binary (WebSocket). JSON stays the default, and errors are always
+# reported as JSON.
+
+from collections import namedtuple
+import struct
+
+mimetype = "application/x-pibot-telemetry"
+
+MessageType = namedtuple("MessageType", "id name layout fields")
+
+_HEADER = struct.Struct("<BB")
+
+messageTypes = [
+	MessageType(1, "encoders", struct.Struct("<iiBB"), ("m1enc", "m2enc", "m1encStatus", "m2encStatus")),
+	MessageType(2, "motion", struct.Struct("<iiiiii"),
+		("m1enc", "m2enc", "m1speed", "m2speed", "m1target", "m2target")),
+]
+
+_byName = dict((message.name, message) for message in messageTypes)
+_byId = dict((message.id, message) for message in messageTypes)
+
+class TelemetryError(ValueError):
+	pass
+
+# Frame of the named message type. values maps field names to ints or
+# None; fields missing from it count as None.
+def encode(name, values):
+	message = _byName[name]
+	valid = 0
+	packed = []
+	for bit, field in enumerate(message.fields):
+		value = values.get(field)
+		if value is None:
+			packed.append(0)
+		else:
+			valid |= 1 << bit
+			packed.append(value)
+	return _HEADER.pack(message.id, valid) + message.layout.pack(*packed)
+
+# Messages in a payload of one or more frames, as a list of (name, values)
+# with None for fields sent without a value.
+def decode(data):
+	data = bytes(data)
+	messages = []
+	offset = 0
+	while offset < len(data):
+		if offset + _HEADER.size > len(data):
+			raise TelemetryError("Telemetry frame cut short at byte {0}".format(offset))
+		typeId, valid = _HEADER.unpack_from(data, offset)
+		message = _byId.get(typeId)
+		if message is None:
+			raise TelemetryError("Unknown telemetry message type {0}".format(typeId))
+		offset += _HEADER.size
+		if offset + message.layout.size > len(data):
+			raise TelemetryError("Telemetry frame cut short at byte {0}".format(offset))
+		fields = message.layout.unpack_from(data, offset)
+		offset += message.layout.size
+		values = dict((field, value if valid & (1 << bit) else None)
+			for bit, (field, value) in enumerate(zip(message.fields, fields)))
+		messages.append((message.name, values))
+	return messages
@@ -0,0 +1,75 @@
+# Joystick style driving of a Roboclaw over a persistent connection.
+
+# The drive page sends (linear, angular) setpoints 20 to 50 times a second,
+# each between -1 and 1: linear is forward/backward, angular is turning,
+# positive clockwise like the rotation of the drive form. Teleop mixes them
+# into wheel speeds for a differential drive, scaled so neither wheel goes
+# past maxSpeed (quadrature pulses per second), and sends them as one
+# SpeedAccelM1M2 command, which has the controller ramp to the new speeds
+# at the given acceleration. Commands go through a SetpointChannel, so a
+# setpoint arriving while the previous one is still on the wire replaces
+# any unsent one instead of queueing behind it.
+
+# A client that stops sending (tab closed, WiFi gone) must not leave the
+# robot driving: if no setpoint arrives for timeout seconds, expire()
+# stops the motors at the same acceleration.
+
+import time
+
+from history import readMotion, signedSpeed
+
+class Teleop:
+	'Turns joystick setpoints into acceleration limited speed commands'
+
+	# rc: Roboclaw API object, channel: SetpointChannel on the same rc.
+	def __init__(self, rc, channel, address, maxSpeed, accel, timeout=0.5):
+		self.rc = rc
+		self.channel = channel
+		self.address = address
+		self.maxSpeed = maxSpeed
+		self.accel = accel
+		self.timeout = timeout
+		# Wheel speeds last commanded.
+		self.m1speed = 0
+		self.m2speed = 0
+		self.lastSetpoint = time.time()
+
+	# Command wheel speeds for the given joystick position.
+	def setpoint(self, linear, angular):
+		linear = max(-1.0, min(1.0, float(linear)))
+		angular = max(-1.0, min(1.0, float(angular)))
+		m1 = linear + angular
+		m2 = linear - angular
+		# Scale both down together so the turn radius is kept.
+		scale = max(1.0, abs(m1), abs(m2))
+		self.lastSetpoint = time.time()
+		self._drive(int(self.maxSpeed * m1 / scale), int(self.maxSpeed * m2 / scale))
+
+	# Stop the motors if the client has gone quiet. Returns True if it did.
+	def expire(self):
+		if time.time() - self.lastSetpoint < self.timeout:
+			return False
+		if self.m1speed or self.m2speed:
+			self._drive(0, 0)
+		return True
+
+	# Stop the motors and the channel, when the client is gone. The stop
+	# is sent directly, since closing the channel drops unsent setpoints.
+	def close(self):
+		self.channel.close()
+		self.m1speed = self.m2speed = 0
+		self.rc.SpeedAccelM1M2(self.address, self.accel, 0, 0)
+
+	def _drive(self, m1speed, m2speed):
+		self.m1speed = m1speed
+		self.m2speed = m2speed
+		self.channel.submit("SpeedAccelM1M2", self.address, self.accel, m1speed, m2speed)
+
+	# Encoder counts and measured speeds, plus the speeds commanded, for the
+	# client to show. Values whose read failed are None.
+	def feedback(self):
+		enc1, enc2, speed1, speed2 = readMotion(self.rc, self.address)
+		return dict(m1enc=enc1[1] if enc1[0] else None, m2enc=enc2[1] if enc2[0] else None,
+			m1speed=signedSpeed(speed1) if speed1[0] else None,
+			m2speed=signedSpeed(speed2) if speed2[0] else None,
+			m1target=self.m1speed, m2target=self.m2speed)
@@ -1,26 +1,187 @@
 # App to configure Roboclaw and test PID values
 
-from flask import Flask, flash, g, jsonify, redirect, render_template, request, session, url_for
+# Startup is kept short so the kiosk browser gets its first page right
+# away: create_app() only sets up Flask and starts looking for a Roboclaw
+# on a background thread. Modules only needed for real hardware (pyserial,
+# loaded by Roboclaw.Open, and the daemon client) are imported when first
+# used.
+# Until discovery finishes the root page shows a "connecting" state.
+
+from flask import Blueprint, Flask, Response, current_app, flash, g, get_flashed_messages, jsonify, redirect, render_template, request, session, url_for
+import json
 import os
 from subprocess import call
+import threading
+import time
 from roboclaw import Roboclaw
 from roboclaw_stub import Roboclaw_stub
+from discovery import potentialDevices
+from flight_recorder import FlightRecorder
+from history import SampleHistory
+from link_health import LinkHealth
+from motion_wait import MotionWatcher, MotorMove, resultWithin
+from path_planner import DriveGeometry, PathError, parsePath, planPath
+from request_timing import RequestTimings, TimingRoboclaw
+from roboclaw_lock import LockedRoboclaw
+from setpoint_channel import SetpointChannel
+from settings import SettingError, allSettings, menuSettings, readSettings, writeSetting
+from settings_cache import SettingsCache
+from snapshot import Snapshot, restore
+from static_assets import StaticAssets
+import telemetry
+from teleop import Teleop
+from trajectory import TrajectoryError, TrajectoryStreamer
+
+# WebSocket support for the teleop channel is optional.
+try:
+	from flask_sock import Sock
+except ImportError:
+	Sock = None
 
 defaultAccelDecel = 2400
 defaultSpeed = 240
+pulsesPerRotation = 7200
+# Teleop stops the motors when no setpoint came for this many seconds, and
+# sends encoder feedback at most this often.
+teleopTimeout = 0.5
+teleopFeedbackInterval = 0.1
 errorCategory = "error"
 successCategory = "success"
 
-app = Flask(__name__)
+pibot = Blueprint('pibot', __name__)
 
-# Randomly generated key means session cookies will not be usable across 
-# instances. This flaw is acceptable for the test config app.
-app.secret_key = os.urandom(24)
+# Field names of each setting on a menu page, for the in-place updates.
+@pibot.app_template_global()
+def settingGroups(menu):
+	return dict((name, allSettings[name].fields) for name in menuSettings[menu])
 
 # Global Roboclaw - this is a terrible idea for web apps in general, but since
 # we are catering to a single user instance it is an ugly but sufficient hack.
 rc = None
 
+# Always-on record of recent serial transactions for diagnosing link
+# problems after the fact. Dump with GET /flight_recorder or SIGUSR1.
+flightRecorder = FlightRecorder()
+
+# Serial I/O, template and application time of each request, per route.
+# GET /request_timing shows the summary.
+requestTimings = RequestTimings()
+
+# Bounds for adapting the serial link of a Roboclaw on a UART.
+minLinkBaud = 38400
+maxLinkBaud = 460800
+
+# Health of the serial link of the current Roboclaw, None when it has none
+# (test stub, roboclaw_daemon). Checked every second in the background.
+linkHealth = None
+
+# Encoder and speed history of the current Roboclaw for the charts. Only
+# addresses with a chart open are sampled.
+history = None
+
+# Finds out when moves of the current Roboclaw finish, and the future of
+# the last move started through the app on each address.
+motionWatcher = None
+moves = {}
+# Longest /api/motion will hold a request waiting for a move.
+maxMotionWait = 30.0
+
+# Buffered path currently being streamed to a Roboclaw, if any.
+trajectory = None
+# Progress of the last path on each address, for /api/motion: a dict of
+# the segments completed, sent and total, and the state (running,
+# finished, cancelled or failed, with error). pathChanged is notified on
+# every change.
+pathProgress = {}
+pathChanged = threading.Condition()
+
+# Background search for a Roboclaw, running or finished. None until started.
+discoveryThread = None
+rcLock = threading.Lock()
+
+# Make the given (already opened) Roboclaw API object the global one.
+# Background work like trajectory streaming shares it with page requests,
+# so calls are serialized with a lock. With replace=False an existing
+# Roboclaw is kept (discovery must not undo a manual connect).
+# Settings are read from the controller once and then served from memory,
+# unless cached=False (for a Roboclaw other programs share).
+def setRoboclaw(newrc, replace=True, cached=True):
+	global rc, linkHealth, history, motionWatcher
+	with rcLock:
+		if rc is not None and not replace:
+			return False
+		if linkHealth is not None:
+			linkHealth.stop()
+			linkHealth = None
+		if history is not None:
+			history.stop()
+		timed = TimingRoboclaw(newrc)
+		rc = LockedRoboclaw(SettingsCache(timed) if cached else timed)
+		history = SampleHistory(rc)
+		history.start()
+		if motionWatcher is not None:
+			motionWatcher.close()
+		moves.clear()
+		motionWatcher = MotionWatcher(rc)
+		if flightRecorder.attach(newrc):
+			linkHealth = LinkHealth(newrc, flightRecorder, rc.lock, minLinkBaud, maxLinkBaud)
+			linkHealth.start()
+		return True
+
+# Use the first serial port with a Roboclaw, or the test stub if none.
+def discoverRoboclaw():
+	for device in potentialDevices():
+		newrc = Roboclaw("/dev/"+device, 115200, 0.01, 3)
+		if newrc.Open():
+			setRoboclaw(newrc, replace=False)
+			return
+	# Failed to connect to USB, fall back to test stub.
+	setRoboclaw(Roboclaw_stub(), replace=False)
+
+def startDiscovery():
+	global discoveryThread
+	with rcLock:
+		if discoveryThread is not None and discoveryThread.is_alive():
+			return
+		discoveryThread = threading.Thread(target=discoverRoboclaw)
+		discoveryThread.daemon = True
+		discoveryThread.start()
+
+# Stream the given segments to a Roboclaw on a background thread, replacing
+# any path already running.
+def setPathProgress(rcAddr, **values):
+	with pathChanged:
+		progress = dict(pathProgress.get(rcAddr, {}))
+		progress.update(values)
+		pathProgress[rcAddr] = progress
+		pathChanged.notify_all()
+
+def startTrajectory(rc, rcAddr, segments):
+	global trajectory
+	stopTrajectory()
+	with pathChanged:
+		pathProgress.pop(rcAddr, None)
+	setPathProgress(rcAddr, completed=0, sent=0, total=len(segments), state="running")
+	def progress(completed, sent, total):
+		setPathProgress(rcAddr, completed=completed, sent=sent, total=total)
+	trajectory = streamer = TrajectoryStreamer(rc, rcAddr, segments, progress=progress)
+	logger = current_app.logger
+	def run():
+		try:
+			finished = streamer.run()
+			setPathProgress(rcAddr, state="finished" if finished else "cancelled")
+		except TrajectoryError as te:
+			streamer.cancel()
+			logger.error(str(te))
+			setPathProgress(rcAddr, state="failed", error=str(te))
+	thread = threading.Thread(target=run)
+	thread.daemon = True
+	thread.start()
+
+def stopTrajectory():
+	if trajectory is not None:
+		trajectory.cancel()
+
 # Parse the given address parameter which may be normal integer or hexadecimal.
 # Returns only if value falls in the range of valid Roboclaw addresses.
 def tryParseAddress(addressString, default):
@@ -71,23 +232,36 @@ def checkRoboclawAddress():
 		flash(msg, errorCategory)
 		raise ValueError(msg)
 
+	# Kept for the pages showing it, so they need not ask again.
+	g.rcVersion = versionQuery[1]
+
 	return (rc, rcAddr)
 
-# Every read operation from the Roboclaw API returns a tuple: index zero
-# is 1 for success and 0 for failure. This helper looks for that zero and
-# raises an exception if one is seen. If an optional error message was 
-# provided, it is put into the flash before exception is raised.
-# In the normal case of success, if there was only one other element in
-# the resultTuple, that element is returned by itself (not a single
-# element tuple) If there are more tha one, the result is a tuple.
-def readResult(resultTuple, flashMessage=None):
+# Every read operation from the Roboclaw API returns a result tuple: index zero
+# (field "ok") is 1 for success and 0 for failure. This helper looks for that
+# zero and raises an exception if one is seen. If an optional error message
+# was provided, it is put into the flash before exception is raised.
+# In the normal case of success the result is returned as-is, so callers
+# can use its field names without slicing.
+def checkResult(resultTuple, flashMessage=None):
 	if resultTuple[0] == 0:
 		msg = str(resultTuple)
 		if flashMessage is not None:
 			msg = "{} {}".format(flashMessage, str(resultTuple))
+			lastTransaction = flightRecorder.last()
+			if lastTransaction is not None:
+				msg = "{} {}".format(msg, lastTransaction)
 			flash(msg, errorCategory)
 		raise ValueError(msg)
 
+	return resultTuple
+
+# Same check as checkResult. In the normal case of success, if there was only
+# one other element in the resultTuple, that element is returned by itself
+# (not a single element tuple) If there are more tha one, the result is a tuple.
+def readResult(resultTuple, flashMessage=None):
+	checkResult(resultTuple, flashMessage)
+
 	if len(resultTuple) == 2:
 		return resultTuple[1]
 	else:
@@ -104,29 +278,18 @@ def writeResult(result, flashMessage=None):
 	elif flashMessage is not None:
 		flash(flashMessage, successCategory)
 
-# Roboclaw directly connected on USB usually show up as /dev/ttyACM0
-# and sometimes /dev/ttyACM1 on Raspberry Pi & PC. On MacOS it has
-# shown up as /dev/ttyusbmodem. In both cases USB serial bridges
-# announce themselves as ttyUSB. Put all the possibilities in a list
-def potentialDevices():
-	return [dev for dev in os.listdir("/dev") if dev.startswith(("ttyACM", "ttyUSB", "tty.usbmodem"))]
-
 # Root menu
-@app.route('/')
+@pibot.route('/')
 def root_menu():
 	global rc
-	if rc is None:
-		for device in potentialDevices():
-			newrc = Roboclaw("/dev/"+device, 115200, 0.01, 3)
-			if newrc.Open():
-				rc = newrc
-				break
-		# Failed to connect to USB, fall back to test stub.
-		if rc is None:
-			rc = Roboclaw_stub()
-
 	rcAddr = tryParseAddress(request.args.get('address'), default=128)
 
+	if rc is None:
+		# Discovery normally started with the app, this covers an app
+		# created with discover=False.
+		startDiscovery()
+		return render_template("root_menu.html", connecting=True, display=False, address=rcAddr)
+
 	displayMenu = False
 	if rcAddr is not None:
 		try:
@@ -143,11 +306,13 @@ def root_menu():
 
 # Connect menu lets the user specify serial port parameters for creating
 # a Roboclaw object
-@app.route('/connect', methods=['GET', 'POST'])
+@pibot.route('/connect', methods=['GET', 'POST'])
 def connect_menu():
 	global rc
+	from roboclaw_daemon import daemonSockets
 	if request.method == 'GET':
-		return render_template("connect_menu.html", potentialDevices=potentialDevices())
+		return render_template("connect_menu.html", potentialDevices=potentialDevices(),
+			daemonSockets=daemonSockets())
 	elif request.method == 'POST':
 		# TODO sanity validation of these values from the HTML form
 		portName = request.form['port']
@@ -158,29 +323,34 @@ def connect_menu():
 		if portName == 'Test_Stub':
 			# No RoboClaw - use the test stub.
 			newrc = Roboclaw_stub()
+		elif portName.endswith('.sock'):
+			# Serial port owned by roboclaw_daemon
+			from roboclaw_daemon import RoboclawClient
+			newrc = RoboclawClient(portName)
 		else:	
 			# Create the Roboclaw object against the specified serial port
 			newrc = Roboclaw(portName,baudrate,interCharTimeout,retries)
 
 		if newrc.Open():
-			rc = newrc
+			# Other programs may change settings through the daemon.
+			setRoboclaw(newrc, cached=not portName.endswith('.sock'))
 			flash("Roboclaw API connected to " + portName, successCategory)
-			return redirect(url_for('root_menu', address="0x80"))
+			return redirect(url_for('.root_menu', address="0x80"))
 		else:
 			flash("Roboclaw API could not open " + portName, errorCategory)
-			return redirect(url_for('connect_menu'))
+			return redirect(url_for('.connect_menu'))
 	else:
 		flash("Unexpected request method on connect", errorCategory)
-		return redirect(url_for('connect_menu'))
+		return redirect(url_for('.connect_menu'))
 
 # Config menu pulls down the current values of the general settings we care 
 # about and lets the user put in new ones.
-@app.route('/config', methods=['GET', 'POST'])
+@pibot.route('/config', methods=['GET', 'POST'])
 def config_menu():
 	try:
 		rc, rcAddr = checkRoboclawAddress()
 
-		rcVersion = readResult(rc.ReadVersion(rcAddr), "Read version string")
+		rcVersion = g.rcVersion
 		VmainMin,VmainMax = readResult(rc.ReadMinMaxMainVoltages(rcAddr), "Read main voltage limits")
 		AmaxM1 = readResult(rc.ReadM1MaxCurrent(rcAddr), "Read motor 1 max current")
 		AmaxM2 = readResult(rc.ReadM2MaxCurrent(rcAddr), "Read motor 2 max current")
@@ -234,46 +404,87 @@ def config_menu():
 			if frcConfig != int(rcConfig,16):
 				writeResult(rc.SetConfig(rcAddr, frcConfig), "Update config flags")
 
-			return redirect(url_for('config_menu',address=rcAddr))
+			return redirect(url_for('.config_menu',address=rcAddr))
 		else:
 			flash("Unexpected request.method on config", errorCategory)
-			return redirect(url_for('config_menu',address=rcAddr))
+			return redirect(url_for('.config_menu',address=rcAddr))
 	except ValueError as ve:
-		return redirect(url_for('root_menu'))
+		return redirect(url_for('.root_menu'))
+
+# GET downloads a snapshot of all settings, POST restores an uploaded one.
+# Restoring writes only the settings that differ.
+
+@pibot.route('/snapshot', methods=['GET', 'POST'])
+def settings_snapshot():
+	try:
+		rc, rcAddr = checkRoboclawAddress()
+
+		try:
+			if request.method == 'GET':
+				return Response(Snapshot.read(rc, rcAddr).encode(), mimetype='application/octet-stream',
+					headers={'Content-Disposition': 'attachment; filename=roboclaw-{0:#x}.rcss'.format(rcAddr)})
+
+			upload = request.files.get('snapshot')
+			if upload is None:
+				raise SettingError("No snapshot file uploaded")
+			result = restore(rc, rcAddr, Snapshot.decode(upload.read()))
+			if result.changed:
+				flash("Restored {0} from snapshot".format(", ".join(result.changed)), successCategory)
+			else:
+				flash("Settings already match the snapshot", successCategory)
+		except ValueError as ve:
+			flash("Snapshot failed: {0}".format(ve), errorCategory)
+
+		return redirect(url_for('.config_menu', address=rcAddr))
+	except ValueError as ve:
+		return redirect(url_for('.root_menu'))
 
 # Write the current settings to non-volatile memory
 
-@app.route('/writenvm')
+@pibot.route('/writenvm')
 def writenvm():
 	try:
 		rc, rcAddr = checkRoboclawAddress()
 
 		writeResult(rc.WriteNVM(rcAddr), "Write to non-volatile memory")
 
-		return redirect(url_for('root_menu', address=rcAddr))
+		return redirect(url_for('.root_menu', address=rcAddr))
 	except ValueError as ve:
-		return redirect(url_for('root_menu'))
+		return redirect(url_for('.root_menu'))
 
 # Software option to stop both motors connected to a Roboclaw at the
 # specified address. This is not a substitute for a hardware E-stop, which
 # would be faster and more reliable.
 
-@app.route('/stop')
+@pibot.route('/stop')
 def stop():
 	try:
 		rc,rcAddr = checkRoboclawAddress()
 
-		writeResult(rc.ForwardM1(rcAddr, 0), "Stop motor 1")
-		writeResult(rc.ForwardM2(rcAddr, 0), "Stop motor 2")
+		stopMotors(rc, rcAddr)
 
-		return redirect(url_for('root_menu', address=rcAddr))
+		return redirect(url_for('.root_menu', address=rcAddr))
 	except ValueError as ve:
-		return redirect(url_for('root_menu'))
+		return redirect(url_for('.root_menu'))
+
+# Stop watching the move on the address, when a command that drives the
+# motors on and on (velocity, duty, stop) replaces it. Anyone waiting on
+# the move is told it was replaced.
+def endMove(rcAddr):
+	future = moves.pop(rcAddr, None)
+	if future is not None:
+		future.cancel()
+
+def stopMotors(rc, rcAddr):
+	stopTrajectory()
+	endMove(rcAddr)
+	writeResult(rc.ForwardM1(rcAddr, 0), "Stop motor 1")
+	writeResult(rc.ForwardM2(rcAddr, 0), "Stop motor 2")
 
 # Retrieves the current error code from Roboclaw. Zero means no
 # error, decoding nonzero value for the user is a future feature.
 
-@app.route('/rc_error')
+@pibot.route('/rc_error')
 def rc_error():
 	try:
 		rc,rcAddr = checkRoboclawAddress()
@@ -282,11 +493,11 @@ def rc_error():
 
 		return render_template("rc_error.html", rcAddr=rcAddr, errorCode=errorCode)
 	except ValueError as ve:
-		return redirect(url_for('root_menu'))
+		return redirect(url_for('.root_menu'))
 
 # Allows user to set quadrature encoder count to specified values
 
-@app.route('/encoder', methods=['GET', 'POST'])
+@pibot.route('/encoder', methods=['GET', 'POST'])
 def encoder():
 	try:
 		rc,rcAddr = checkRoboclawAddress()
@@ -309,39 +520,71 @@ def encoder():
 			if fm2enc != m2enc:
 				writeResult(rc.SetEncM2(rcAddr, fm2enc), "Set M2 quadrature encoder count")
 
-			return redirect(url_for('root_menu', address=rcAddr))
+			return redirect(url_for('.root_menu', address=rcAddr))
 		else:
 			flash("Unexpected request.method on encoder", errorCategory)
-			return redirect(url_for('encoder',address=rcAddr))
+			return redirect(url_for('.encoder',address=rcAddr))
 
 	except ValueError as ve:
-		return redirect(url_for('root_menu'))
+		return redirect(url_for('.root_menu'))
+
+# True if the client prefers binary telemetry frames (see telemetry.py) to
+# JSON.
+def wantsTelemetry():
+	return request.accept_mimetypes.best_match(['application/json', telemetry.mimetype]) == telemetry.mimetype
 
 # Low overhead method to retrieve encoder values as JSON. For the sake of
 # simple client, ensure the output JSON is always the same format regardless
-# of success or error.
+# of success or error. Clients accepting telemetry get an "encoders" frame
+# on success instead.
 
-@app.route('/encoder_json', methods=['GET'])
+@pibot.route('/encoder_json', methods=['GET'])
 def encoder_json():
 	try:
 		rc,rcAddr = checkRoboclawAddress()
 
-		m1enc, m1encStatus = readResult(rc.ReadEncM1(rcAddr), "Read M1 encoder")
-		m2enc, m2encStatus = readResult(rc.ReadEncM2(rcAddr), "Read M2 encoder")
+		m1 = checkResult(rc.ReadEncM1(rcAddr), "Read M1 encoder")
+		m2 = checkResult(rc.ReadEncM2(rcAddr), "Read M2 encoder")
 
-		return jsonify(m1enc=m1enc, m2enc=m2enc, m1encStatus=m1encStatus, m2encStatus=m2encStatus, result="success")
+		values = dict(m1enc=m1.count, m2enc=m2.count, m1encStatus=m1.status, m2encStatus=m2.status)
+		if wantsTelemetry():
+			return Response(telemetry.encode("encoders", values), mimetype=telemetry.mimetype)
+		return jsonify(result="success", **values)
 	except ValueError as ve:
 		return jsonify(m1enc=0, m2enc=0, m1encStatus=0, m2encStatus=0, result=str(ve))
 
+# Recent serial transactions, oldest first, for post-mortem of link failures.
+
+@pibot.route('/flight_recorder', methods=['GET'])
+def flight_recorder():
+	return jsonify(transactions=flightRecorder.dump())
+
+# Where the time of each route goes, averaged per request. DELETE starts
+# over.
+
+@pibot.route('/request_timing', methods=['GET', 'DELETE'])
+def request_timing():
+	if request.method == 'DELETE':
+		requestTimings.reset()
+	return jsonify(routes=requestTimings.summary(), result="success")
+
+# Error rate, latency and adaptations of the serial link.
+
+@pibot.route('/link_health', methods=['GET'])
+def link_health():
+	if linkHealth is None:
+		return jsonify(result="No serial link to monitor")
+	return jsonify(link=linkHealth.stats(), result="success")
+
 # Velocity menu deals with the parameters involved in moving at a target velocity.
 # Usually in terms of quadrature encoder pulses per second.
 
-@app.route('/velocity', methods=['GET','POST'])
+@pibot.route('/velocity', methods=['GET','POST'])
 def velocity_menu():
 	try:
 		rc,rcAddr = checkRoboclawAddress()
 
-		rcVersion = readResult(rc.ReadVersion(rcAddr), "Read version string")
+		rcVersion = g.rcVersion
 
 		m1P, m1I, m1D, m1qpps = readResult(rc.ReadM1VelocityPID(rcAddr), "Read M1 velocity PID")
 		m2P, m2I, m2D, m2qpps = readResult(rc.ReadM2VelocityPID(rcAddr), "Read M2 velocity PID")
@@ -392,36 +635,40 @@ def velocity_menu():
 			if fm2P != m2P or fm2I != m2I or fm2D != m2D or fm2qpps != m2qpps:
 				writeResult(rc.SetM2VelocityPID(rcAddr, fm2P, fm2I, fm2D, fm2qpps), "Update M2 velocity PID")
 
-			return redirect(url_for('velocity_menu',address=rcAddr))
+			return redirect(url_for('.velocity_menu',address=rcAddr))
 		else:
 			flash("Unexpected request.method on velocity", errorCategory)
-			return redirect(url_for('velocity_menu',address=rcAddr))
+			return redirect(url_for('.velocity_menu',address=rcAddr))
 	except ValueError as ve:
-		return redirect(url_for('root_menu'))
+		return redirect(url_for('.root_menu'))
 
-@app.route('/run_velocity', methods=['POST'])
+@pibot.route('/run_velocity', methods=['POST'])
 def run_velocity():
 	try:
 		rc,rcAddr = checkRoboclawAddress()
 
-		session['m1speed'] = m1speed = int(request.form['m1speed'])
-		session['m2speed'] = m2speed = int(request.form['m2speed'])
-
-		writeResult(rc.SpeedM1M2(rcAddr, m1speed, m2speed), "Run M1+M2 at velocity")
+		runVelocity(rc, rcAddr, request.form)
 
-		return redirect(url_for('velocity_menu',address=rcAddr))
+		return redirect(url_for('.velocity_menu',address=rcAddr))
 	except ValueError as ve:
-		return redirect(url_for('root_menu'))
+		return redirect(url_for('.root_menu'))
+
+def runVelocity(rc, rcAddr, values):
+	session['m1speed'] = m1speed = apiInt(values, 'm1speed')
+	session['m2speed'] = m2speed = apiInt(values, 'm2speed')
+
+	endMove(rcAddr)
+	writeResult(rc.SpeedM1M2(rcAddr, m1speed, m2speed), "Run M1+M2 at velocity")
 
 # Position menu deals with the parameters involved in moving to a target position.
 # With min/max values, it implies positional application like a RC servo motor.
 
-@app.route('/position', methods=['GET','POST'])
+@pibot.route('/position', methods=['GET','POST'])
 def position_menu():
 	try:
 		rc,rcAddr = checkRoboclawAddress()
 
-		rcVersion = readResult(rc.ReadVersion(rcAddr), "Read version string")
+		rcVersion = g.rcVersion
 		m1P, m1I, m1D, m1maxI, m1deadZone, m1minPos, m1maxPos = readResult(rc.ReadM1PositionPID(rcAddr), "Read M1 position PID")
 		m2P, m2I, m2D, m2maxI, m2deadZone, m2minPos, m2maxPos = readResult(rc.ReadM2PositionPID(rcAddr), "Read M2 position PID")
 
@@ -491,46 +738,51 @@ def position_menu():
 			   writeResult(rc.SetM2PositionPID(rcAddr, fm2P, fm2I, fm2D, fm2maxI, 
 			   	fm2deadZone, fm2minPos, fm2maxPos), "Update M2 Position PID")
 
-			return redirect(url_for('position_menu',address=rcAddr))
+			return redirect(url_for('.position_menu',address=rcAddr))
 		else:
 			flash("Unexpected request.method on position", errorCategory)
-			return redirect(url_for('position_menu',address=rcAddr))
+			return redirect(url_for('.position_menu',address=rcAddr))
 	except ValueError as ve:
-		return redirect(url_for('root_menu'))
+		return redirect(url_for('.root_menu'))
 
 # Tell Roboclaw to move with the given acceleration, deceleration, and position.
-@app.route('/to_position', methods=['POST'])
+@pibot.route('/to_position', methods=['POST'])
 def to_position():
 	try:
 		rc,rcAddr = checkRoboclawAddress()
 
-		# TODO sanity validation of these values from the HTML form
-		# Pull values from form, update them in session dictionary.
-		session['m1accel'] = m1accel = int(request.form['m1accel'])
-		session['m2accel'] = m2accel = int(request.form['m2accel'])
-		session['m1speed'] = m1speed = int(request.form['m1speed'])
-		session['m2speed'] = m2speed = int(request.form['m2speed'])
-		session['m1decel'] = m1decel = int(request.form['m1decel'])
-		session['m2decel'] = m2decel = int(request.form['m2decel'])
-
-		session['m1pos'] = m1pos = int(request.form['m1pos'])
-		session['m2pos'] = m2pos = int(request.form['m2pos'])
-
-		writeResult(rc.SpeedAccelDeccelPositionM1M2(rcAddr, 
-			m1accel, m1speed, m1decel, m1pos, 
-			m2accel, m2speed, m2decel, m2pos, 1),
-			"Moving to position (M1 {0} {1} {2} {3}) (M2 {4} {5} {6} {7})".format(
-				m1accel, m1speed, m1decel, m1pos, 
-				m2accel, m2speed, m2decel, m2pos))
+		toPosition(rc, rcAddr, request.form)
 
-		return redirect(url_for('position_menu',address=rcAddr))
+		return redirect(url_for('.position_menu',address=rcAddr))
 	except ValueError as ve:
-		return redirect(url_for('root_menu'))
+		return redirect(url_for('.root_menu'))
+
+def toPosition(rc, rcAddr, values):
+	# TODO sanity validation of these values from the HTML form
+	# Pull values from form, update them in session dictionary.
+	session['m1accel'] = m1accel = apiInt(values, 'm1accel')
+	session['m2accel'] = m2accel = apiInt(values, 'm2accel')
+	session['m1speed'] = m1speed = apiInt(values, 'm1speed')
+	session['m2speed'] = m2speed = apiInt(values, 'm2speed')
+	session['m1decel'] = m1decel = apiInt(values, 'm1decel')
+	session['m2decel'] = m2decel = apiInt(values, 'm2decel')
+
+	session['m1pos'] = m1pos = apiInt(values, 'm1pos')
+	session['m2pos'] = m2pos = apiInt(values, 'm2pos')
+
+	writeResult(rc.SpeedAccelDeccelPositionM1M2(rcAddr, 
+		m1accel, m1speed, m1decel, m1pos, 
+		m2accel, m2speed, m2decel, m2pos, 1),
+		"Moving to position (M1 {0} {1} {2} {3}) (M2 {4} {5} {6} {7})".format(
+			m1accel, m1speed, m1decel, m1pos, 
+			m2accel, m2speed, m2decel, m2pos))
+	moves[rcAddr] = motionWatcher.expect(rcAddr, [MotorMove(m1accel, m1speed, m1decel, position=m1pos),
+		MotorMove(m2accel, m2speed, m2decel, position=m2pos)])
 
 # "Drive" presents a more user-friendly way to drive the robot around,
 # not the big table of numerical inputs of the config/velocity/position menus.
 
-@app.route('/drive_control', methods=['GET','POST'])
+@pibot.route('/drive_control', methods=['GET','POST'])
 def drive_control():
 	try:
 		rc,rcAddr = checkRoboclawAddress()
@@ -540,49 +792,116 @@ def drive_control():
 
 		if request.method == 'GET':
 			return render_template("drive_control.html", rcAddr=rcAddr,
-				speed=speed, eppr=eppr)
+				speed=speed, eppr=eppr, path=session.get('path', ''), teleop=Sock is not None)
 		elif request.method == 'POST':
-			encoderSet = 250000
-			m1delta = m2delta = 0
-			session['speed'] = speed = int(request.form['speed'])
-			if request.form['movement'] == "linear":
-				distance = int(request.form['distanceNumber'])
-				m1delta = m2delta = distance * 7200
-			elif request.form['movement'] == "rotation":
-				session['eppr'] = eppr = int(request.form['rotationPulses'])
-				rotation = int(request.form['rotationNumber'])
-				m1delta = int(rotation * eppr / 360)
-				m2delta = -m1delta
-			else:
-				flash("Unknown movement type", errorCategory)
+			driveRobot(rc, rcAddr, request.form)
 
-			m1accel = session.get('m1accel', defaultAccelDecel)
-			m2accel = session.get('m2accel', defaultAccelDecel)
-			m1decel = session.get('m1decel', defaultAccelDecel)
-			m2decel = session.get('m2decel', defaultAccelDecel)
-
-			writeResult(rc.SetEncM1(rcAddr, encoderSet), "Set M1 quadrature encoder count")
-			writeResult(rc.SetEncM2(rcAddr, encoderSet), "Set M2 quadrature encoder count")
-
-			m1pos = encoderSet + m1delta
-			m2pos = encoderSet + m2delta
-
-			writeResult(rc.SpeedAccelDeccelPositionM1M2(rcAddr, 
-				m1accel, speed, m1decel, m1pos, 
-				m2accel, speed, m2decel, m2pos, 1),
-				"Moving to position (M1 {0} {1} {2} {3}) (M2 {4} {5} {6} {7})".format(
-					m1accel, speed, m1decel, m1pos, 
-					m2accel, speed, m2decel, m2pos))
-
-			return redirect(url_for('drive_control',address=rcAddr))
+			return redirect(url_for('.drive_control',address=rcAddr))
 		else:
 			flash("Unexpected request.method on drive_control", errorCategory)
-			return redirect(url_for('drive_control',address=rcAddr))
+			return redirect(url_for('.drive_control',address=rcAddr))
+	except ValueError as ve:
+		return redirect(url_for('.root_menu'))
+
+# Start the movement described by the drive page form values.
+def driveRobot(rc, rcAddr, values):
+	encoderSet = 250000
+	m1delta = m2delta = 0
+	session['speed'] = speed = apiInt(values, 'speed')
+	eppr = session.get('eppr', 6200)
+
+	m1accel = session.get('m1accel', defaultAccelDecel)
+	m2accel = session.get('m2accel', defaultAccelDecel)
+	m1decel = session.get('m1decel', defaultAccelDecel)
+	m2decel = session.get('m2decel', defaultAccelDecel)
+
+	if values['movement'] == "linear":
+		distance = apiInt(values, 'distanceNumber')
+		m1delta = m2delta = distance * pulsesPerRotation
+	elif values['movement'] == "rotation":
+		session['eppr'] = eppr = apiInt(values, 'rotationPulses')
+		rotation = apiInt(values, 'rotationNumber')
+		m1delta = int(rotation * eppr / 360)
+		m2delta = -m1delta
+	elif values['movement'] == "path":
+		# Plan the whole path up front then stream it in the background
+		try:
+			segments = planPath(parsePath(values['path']),
+				DriveGeometry(pulsesPerRotation, eppr), speed,
+				max(m1accel, m2accel), (m1accel, m2accel))
+		except PathError as pe:
+			flash(str(pe), errorCategory)
+			return
+		session['path'] = values['path']
+		# The streamer tracks the path, not the motion watcher.
+		endMove(rcAddr)
+		startTrajectory(rc, rcAddr, segments)
+		flash("Driving path of {0} segments".format(len(segments)), successCategory)
+		return
+	else:
+		flash("Unknown movement type", errorCategory)
+		return
+
+	stopTrajectory()
+	writeResult(rc.SetEncM1(rcAddr, encoderSet), "Set M1 quadrature encoder count")
+	writeResult(rc.SetEncM2(rcAddr, encoderSet), "Set M2 quadrature encoder count")
+
+	m1pos = encoderSet + m1delta
+	m2pos = encoderSet + m2delta
+
+	writeResult(rc.SpeedAccelDeccelPositionM1M2(rcAddr, 
+		m1accel, speed, m1decel, m1pos, 
+		m2accel, speed, m2decel, m2pos, 1),
+		"Moving to position (M1 {0} {1} {2} {3}) (M2 {4} {5} {6} {7})".format(
+			m1accel, speed, m1decel, m1pos, 
+			m2accel, speed, m2decel, m2pos))
+	moves[rcAddr] = motionWatcher.expect(rcAddr, [MotorMove(m1accel, speed, m1decel, distance=m1delta),
+		MotorMove(m2accel, speed, m2decel, distance=m2delta)])
+
+# Joystick driving over a WebSocket (needs flask-sock). The client sends
+# {"linear": x, "angular": y} 20 to 50 times a second, each between -1 and
+# 1, and gets back encoder counts and speeds as JSON, or with format=binary
+# as "motion" telemetry frames. Errors always come as JSON text. The query
+# may give speed, the top wheel speed, defaulting to the drive page speed.
+def teleop(ws):
+	try:
+		rc, rcAddr = apiRoboclawAddress()
+		maxSpeed = int(request.args.get('speed', session.get('speed', 300)))
+		binary = request.args.get('format', 'json') == 'binary'
 	except ValueError as ve:
-		return redirect(url_for('root_menu'))
+		ws.send(json.dumps(dict(result=str(ve))))
+		return
+	stopTrajectory()
+	endMove(rcAddr)
+	accel = max(session.get('m1accel', defaultAccelDecel), session.get('m2accel', defaultAccelDecel))
+	driver = Teleop(rc, SetpointChannel(rc), rcAddr, maxSpeed, accel, teleopTimeout)
+	lastFeedback = 0.0
+	try:
+		while True:
+			message = ws.receive(timeout=teleopFeedbackInterval)
+			if message is None:
+				driver.expire()
+			else:
+				try:
+					values = json.loads(message)
+					driver.setpoint(values['linear'], values['angular'])
+				except (KeyError, TypeError, ValueError) as e:
+					ws.send(json.dumps(dict(result="Bad setpoint: {0}".format(e))))
+					continue
+			now = time.time()
+			if now - lastFeedback >= teleopFeedbackInterval:
+				lastFeedback = now
+				if binary:
+					ws.send(telemetry.encode("motion", driver.feedback()))
+				else:
+					ws.send(json.dumps(dict(driver.feedback(), result="success")))
+	finally:
+		driver.close()
 
+if Sock is not None:
+	Sock().route('/teleop', bp=pibot)(teleop)
 
-@app.route('/basic_motor', methods=['GET','POST'])
+@pibot.route('/basic_motor', methods=['GET','POST'])
 def basic_motor():
 	try:
 		rc,rcAddr = checkRoboclawAddress()
@@ -596,6 +915,7 @@ def basic_motor():
 		elif request.method == 'POST':
 			motor = int(request.form['motor'])
 			direction = request.form['direction']
+			endMove(rcAddr)
 
 			if motor == 1:
 				if direction == '+':
@@ -612,18 +932,193 @@ def basic_motor():
 				else:
 					rc.ForwardM2(rcAddr, 0)
 
-			return redirect(url_for('basic_motor',address=rcAddr))
+			return redirect(url_for('.basic_motor',address=rcAddr))
 		else:
 			flash("Unexpected request.method on drive_control", errorCategory)
-			return redirect(url_for('basic_motor',address=rcAddr))
+			return redirect(url_for('.basic_motor',address=rcAddr))
+	except ValueError as ve:
+		return redirect(url_for('.root_menu'))
+
+# JSON API behind the in-place updates of the menu pages. Unlike the page
+# routes it skips the ReadVersion probe, and a POST sends only the write
+# commands for the values in the request, with no read back. Responses
+# carry the messages the page routes would have flashed.
+
+# Like checkRoboclawAddress, without talking to the Roboclaw.
+def apiRoboclawAddress():
+	if rc is None:
+		raise ValueError("Roboclaw API not initialized")
+	rcAddr = tryParseAddress(request.args.get('address'), default=None)
+	if rcAddr is None:
+		raise ValueError("Valid address parameter required")
+	return (rc, rcAddr)
+
+def apiValues():
+	return request.get_json(silent=True) or request.form
+
+# Integer value of a field of an API request. Raises ValueError for
+# anything else, JSON null (what an empty field is sent as) and lists
+# included.
+def apiInt(values, field):
+	try:
+		return int(values[field])
+	except (TypeError, ValueError):
+		raise ValueError("{0} must be a whole number".format(field))
+
+def apiResponse(result="success", **values):
+	return jsonify(result=result, messages=get_flashed_messages(with_categories=True), **values)
+
+# GET returns every value on the menu page. POST takes values by field
+# name and writes each setting whose fields are all present.
+@pibot.route('/api/<menu>/settings', methods=['GET', 'POST'])
+def api_settings(menu):
+	if menu not in menuSettings:
+		return apiResponse("Unknown menu " + menu), 404
+	try:
+		rc, rcAddr = apiRoboclawAddress()
+
+		if request.method == 'GET':
+			values = {}
+			for name, settingValues in readSettings(rc, rcAddr, menuSettings[menu]).items():
+				values.update(zip(allSettings[name].fields, settingValues))
+			return apiResponse(values=values)
+
+		values = apiValues()
+		written = []
+		for name in menuSettings[menu]:
+			fields = allSettings[name].fields
+			present = [field for field in fields if field in values]
+			if not present:
+				continue
+			if len(present) != len(fields):
+				raise SettingError("{0} needs all of {1}".format(name, ", ".join(fields)))
+			writeSetting(rc, rcAddr, name, [apiInt(values, field) for field in fields])
+			written.append(name)
+		if written:
+			flash("Updated " + ", ".join(written), successCategory)
+		return apiResponse(written=written)
 	except ValueError as ve:
-		return redirect(url_for('root_menu'))
+		return apiResponse(str(ve))
 
-@app.route('/shutdown')
+# Encoder counts. POST sets only the counts given.
+@pibot.route('/api/encoders', methods=['GET', 'POST'])
+def api_encoders():
+	try:
+		rc, rcAddr = apiRoboclawAddress()
+
+		if request.method == 'POST':
+			values = apiValues()
+			if 'm1enc' in values:
+				writeResult(rc.SetEncM1(rcAddr, apiInt(values, 'm1enc')), "Set M1 quadrature encoder count")
+			if 'm2enc' in values:
+				writeResult(rc.SetEncM2(rcAddr, apiInt(values, 'm2enc')), "Set M2 quadrature encoder count")
+			return apiResponse()
+
+		m1 = checkResult(rc.ReadEncM1(rcAddr))
+		m2 = checkResult(rc.ReadEncM2(rcAddr))
+		return apiResponse(values=dict(m1enc=m1.count, m2enc=m2.count,
+			m1encStatus=m1.status, m2encStatus=m2.status))
+	except ValueError as ve:
+		return apiResponse(str(ve))
+
+# Downsampled encoder and speed history for a chart. series is a comma
+# separated list of history.seriesNames, width the chart width in pixels
+# (one point each), seconds how far back to go. Asking starts sampling the
+# address, so the first request of a chart has little or nothing.
+@pibot.route('/api/history', methods=['GET'])
+def api_history():
+	try:
+		rc, rcAddr = apiRoboclawAddress()
+		names = request.args.get('series', 'm1speed,m2speed').split(',')
+		width = int(request.args.get('width', 300))
+		seconds = float(request.args.get('seconds', 60))
+		series = history.series(rcAddr, names, seconds, width)
+		return apiResponse(series=series)
+	except ValueError as ve:
+		return apiResponse(str(ve))
+
+# Whether the last move started through the app (position move or drive
+# page) has finished. With wait, holds the request up to that many
+# seconds for it to finish, so scripts can sequence moves exactly. While a
+# path runs the reply has its progress as path (see pathProgress), and
+# wait holds the request until the progress changes.
+@pibot.route('/api/motion', methods=['GET'])
+def api_motion():
+	try:
+		rc, rcAddr = apiRoboclawAddress()
+		wait = max(0.0, min(float(request.args.get('wait', 0)), maxMotionWait))
+		future = moves.get(rcAddr)
+		with pathChanged:
+			path = pathProgress.get(rcAddr)
+			if path is not None and path['state'] == "running" and wait:
+				pathChanged.wait(wait)
+				path = pathProgress.get(rcAddr)
+		if path is not None and (path['state'] == "running" or future is None):
+			return apiResponse(done=path['state'] != "running", path=path)
+		if future is None:
+			return apiResponse(done=True)
+		result = resultWithin(future, wait)
+		if result is None:
+			return apiResponse(done=False)
+		return apiResponse(done=True, m1enc=result.m1enc, m2enc=result.m2enc, seconds=result.seconds)
+	except ValueError as ve:
+		return apiResponse(str(ve))
+
+# Read settings from the controller again, after another program changed
+# them.
+def refreshSettings(rc, rcAddr, values):
+	refresh = getattr(rc, 'refresh', None)
+	if refresh is not None:
+		refresh(rcAddr)
+	flash("Settings will be read from the controller again", successCategory)
+
+# Motion commands, taking the same values as the page forms, and refresh.
+apiActions = {
+	'refresh': refreshSettings,
+	'stop': lambda rc, rcAddr, values: stopMotors(rc, rcAddr),
+	'run_velocity': runVelocity,
+	'to_position': toPosition,
+	'drive': driveRobot,
+}
+
+@pibot.route('/api/<action>', methods=['POST'])
+def api_action(action):
+	if action not in apiActions:
+		return apiResponse("Unknown action " + action), 404
+	try:
+		rc, rcAddr = apiRoboclawAddress()
+		apiActions[action](rc, rcAddr, apiValues())
+		return apiResponse()
+	except (KeyError, ValueError) as e:
+		return apiResponse(str(e))
+
+@pibot.route('/shutdown')
 def call_shutdown():
 	r = call("systemctl poweroff", shell=True)
 	if r == 0:
 		flash("Shutting down...", successCategory)
 	else:
 		flash("Shutdown attempt failed with error {0}".format(r), errorCategory)
-	return redirect(url_for('root_menu'))
+	return redirect(url_for('.root_menu'))
+
+# Create the app. FLASK_APP=testconfig.py makes flask run call this.
+# discover: start looking for a Roboclaw right away, in the background.
+def create_app(discover=True):
+	app = Flask(__name__)
+
+	# Randomly generated key means session cookies will not be usable across 
+	# instances. This flaw is acceptable for the test config app.
+	app.secret_key = os.urandom(24)
+
+	# Fingerprinted, precompressed static files so pages load without
+	# network. The .gz copies come from fetch_assets.py.
+	StaticAssets(app)
+
+	requestTimings.init_app(app)
+
+	app.register_blueprint(pibot)
+	flightRecorder.installSignalHandler()
+
+	if discover:
+		startDiscovery()
+	return app
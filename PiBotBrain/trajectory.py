@@ -0,0 +1,116 @@
+# Streams a sequence of buffered motion commands to a Roboclaw, keeping the
+# controller's command buffer topped up so one segment flows into the next
+# without waiting on a host round trip in between.
+
+# Roboclaw distance and position commands take a buffer flag. With buffer=1
+# the command executes immediately, replacing whatever was running. With
+# buffer=0 it is queued behind the commands already buffered. ReadBuffers
+# reports per motor how many commands are queued: 0x80 means the buffer is
+# empty and all commands finished, 0 means the last command is executing.
+
+from collections import namedtuple
+import time
+
+# Value ReadBuffers reports for a motor whose buffer is empty and idle.
+BUFFER_IDLE = 0x80
+
+# Each segment knows how to send itself so the streamer does not care which
+# Roboclaw command is behind it.
+
+# Both motors move the given distance (always positive, direction comes from
+# the sign of the speed) with independent acceleration and speed.
+class DistanceSegment(namedtuple('DistanceSegment', 'accel1 speed1 distance1 accel2 speed2 distance2')):
+	__slots__ = ()
+
+	def send(self, rc, address, buffer):
+		return rc.SpeedAccelDistanceM1M2_2(address,
+			self.accel1, self.speed1, self.distance1,
+			self.accel2, self.speed2, self.distance2, buffer)
+
+# Both motors move to an absolute encoder position.
+class PositionSegment(namedtuple('PositionSegment', 'accel1 speed1 decel1 position1 accel2 speed2 decel2 position2')):
+	__slots__ = ()
+
+	def send(self, rc, address, buffer):
+		return rc.SpeedAccelDeccelPositionM1M2(address,
+			self.accel1, self.speed1, self.decel1, self.position1,
+			self.accel2, self.speed2, self.decel2, self.position2, buffer)
+
+class TrajectoryError(Exception):
+	'Raised when a segment could not be sent or the buffer could not be read'
+
+class TrajectoryStreamer:
+	'Keeps the Roboclaw command buffer fed from a list of segments'
+
+	# rc: Roboclaw API object.
+	# address: Roboclaw address.
+	# segments: sequence of objects with a send(rc, address, buffer) method.
+	# depth: how many commands to keep queued ahead of the executing one.
+	# pollInterval: seconds between ReadBuffers polls in run().
+	# progress: optional callable(completed, sent, total) called after each
+	#   poll that changed either count.
+	def __init__(self, rc, address, segments, depth=4, pollInterval=0.02, progress=None):
+		self.rc = rc
+		self.address = address
+		self.segments = list(segments)
+		self.depth = depth
+		self.pollInterval = pollInterval
+		self.progress = progress
+
+		self.total = len(self.segments)
+		self.sent = 0
+		self.completed = 0
+		self.cancelled = False
+
+	# Number of commands the controller still has to finish, including the
+	# one currently executing, judging from a ReadBuffers result.
+	@staticmethod
+	def outstanding(buffers):
+		pending = 0
+		for count in (buffers[1], buffers[2]):
+			if count != BUFFER_IDLE:
+				pending = max(pending, count + 1)
+		return pending
+
+	def done(self):
+		return self.cancelled or self.completed >= self.total
+
+	# Poll the buffer once and send as many segments as fit. Returns True
+	# once every segment has finished executing.
+	def step(self):
+		if self.done():
+			return True
+
+		buffers = self.rc.ReadBuffers(self.address)
+		if not buffers[0]:
+			raise TrajectoryError("Read buffers from address {0} failed".format(self.address))
+
+		outstanding = self.outstanding(buffers)
+		completed = self.sent - outstanding
+		sent = self.sent
+
+		# Outstanding includes the executing command, which does not take
+		# up a buffer slot.
+		while self.sent < self.total and outstanding <= self.depth:
+			if not self.segments[self.sent].send(self.rc, self.address, 0):
+				raise TrajectoryError("Send segment {0} to address {1} failed".format(self.sent, self.address))
+			self.sent += 1
+			outstanding += 1
+
+		if completed != self.completed or sent != self.sent:
+			self.completed = max(self.completed, completed)
+			if self.progress is not None:
+				self.progress(self.completed, self.sent, self.total)
+
+		return self.done()
+
+	# Stop feeding new segments. Commands already buffered on the controller
+	# keep running; stop the motors to abandon them.
+	def cancel(self):
+		self.cancelled = True
+
+	# Stream every segment, returning when the last one has finished.
+	def run(self):
+		while not self.step():
+			time.sleep(self.pollInterval)
+		return not self.cancelled
@@ -0,0 +1,207 @@
+# Serial transaction budget of every route in testconfig.py.
+
+# Each packet serial transaction is a round trip on the bus, and a page
+# that grows a few more goes unnoticed until the robot feels sluggish.
+# This script sends a request to every route of the app, with the test stub
+# behind a CountingRoboclaw, and compares the commands each request issued
+# against the budget in routeBudgets. It fails if a route goes over its
+# budget or has no budget at all, so a change that adds bus traffic (or
+# a new route) has to update the table on purpose.
+
+# Usage:
+#   python transaction_budget.py [-v]
+# -v lists the commands of every request. Exit status is 1 on failure.
+
+import argparse
+from collections import Counter
+import io
+import sys
+
+# Wraps a Roboclaw API object (Roboclaw, Roboclaw_stub, RoboclawClient) and
+# records the name of every command issued through it, in order. The reads
+# batched by ReadPipelined are recorded one by one, as each is a
+# transaction of its own.
+class CountingRoboclaw:
+	def __init__(self, rc):
+		self._rc = rc
+		self.commands = []
+
+	# Commands recorded since the last call, which starts a new record.
+	def take(self):
+		commands = self.commands
+		self.commands = []
+		return commands
+
+	def __getattr__(self, name):
+		attr = getattr(self._rc, name)
+		if not callable(attr):
+			return attr
+		if name == 'ReadPipelined':
+			def counted(address, names):
+				self.commands.extend(names)
+				return attr(address, names)
+		elif name[0].isupper() and name not in ('Open', 'SendRandomData'):
+			def counted(*args):
+				self.commands.append(name)
+				return attr(*args)
+		else:
+			return attr
+		self.__dict__[name] = counted
+		return counted
+
+# Form values for the POST requests.
+_velocityForm = dict(m1P=100000, m1I=50000, m1D=0, m1qpps=8000, m2values='copym1',
+	m2P=0, m2I=0, m2D=0, m2qpps=0)
+_positionForm = dict(m1P=2000, m1I=0, m1D=400, m1maxI=0, m1deadZone=10, m1minPos=0,
+	m1maxPos=100000, m2values='copym1', m2P=0, m2I=0, m2D=0, m2maxI=0, m2deadZone=0,
+	m2minPos=0, m2maxPos=0)
+_configForm = dict(VmainMin=110, VmainMax=340, AmaxM1=500, AmaxM2=500, pwmMode=1,
+	encModeM1=0, encModeM2=0, s3=0, s4=0, s5=0, rcConfig='0x8003')
+_moveForm = dict(m1accel=2400, m2accel=2400, m1speed=240, m2speed=240, m1decel=2400,
+	m2decel=2400, m1pos=1000, m2pos=1000)
+_driveForm = dict(speed=300, movement='linear', distanceNumber=1)
+
+# Marks a request sent with the settings cache emptied first.
+COLD = "cold"
+
+# (endpoint, method, URL, form or JSON values, budget), optionally followed
+# by COLD. The budget is the most transactions the request may take
+# against the stub. None marks a route that is deliberately not exercised.
+# Listed in the order the requests are sent; /connect goes last since it
+# replaces the Roboclaw. Settings are cached after the first read (see
+# settings_cache.py), so the budgets of the other requests count on the
+# ones before them. Every route that reads settings is also checked COLD,
+# the cost of a fresh page load after a restart or refresh.
+routeBudgets = [
+	('root_menu', 'GET', '/?address=0x80', None, 1),
+	('config_menu', 'GET', '/config?address=0x80', None, 8),
+	('config_menu', 'POST', '/config?address=0x80', _configForm, 5),
+	('settings_snapshot', 'GET', '/snapshot?address=0x80', None, 14, COLD),
+	('settings_snapshot', 'GET', '/snapshot?address=0x80', None, 2),
+	('settings_snapshot', 'POST', '/snapshot?address=0x80', 'snapshot', 9),
+	('writenvm', 'GET', '/writenvm?address=0x80', None, 2),
+	('stop', 'GET', '/stop?address=0x80', None, 3),
+	('rc_error', 'GET', '/rc_error?address=0x80', None, 2),
+	('encoder', 'GET', '/encoder?address=0x80', None, 3),
+	('encoder', 'POST', '/encoder?address=0x80', dict(m1enc=5, m2enc=6), 5),
+	('encoder_json', 'GET', '/encoder_json?address=0x80', None, 3),
+	('flight_recorder', 'GET', '/flight_recorder', None, 0),
+	('link_health', 'GET', '/link_health', None, 0),
+	('request_timing', 'GET', '/request_timing', None, 0),
+	('request_timing', 'DELETE', '/request_timing', None, 0),
+	('api_history', 'GET', '/api/history?address=0x80&series=m1enc,m1speed&width=200', None, 0),
+	('velocity_menu', 'GET', '/velocity?address=0x80', None, 5, COLD),
+	('velocity_menu', 'GET', '/velocity?address=0x80', None, 3),
+	('velocity_menu', 'POST', '/velocity?address=0x80', _velocityForm, 5),
+	('run_velocity', 'POST', '/run_velocity?address=0x80', dict(m1speed=100, m2speed=100), 2),
+	('position_menu', 'GET', '/position?address=0x80', None, 5, COLD),
+	('position_menu', 'GET', '/position?address=0x80', None, 3),
+	('position_menu', 'POST', '/position?address=0x80', _positionForm, 5),
+	('to_position', 'POST', '/to_position?address=0x80', _moveForm, 2),
+	('drive_control', 'GET', '/drive_control?address=0x80', None, 1),
+	('drive_control', 'POST', '/drive_control?address=0x80', _driveForm, 4),
+	('teleop', 'GET', '/teleop?address=0x80', None, None),
+	('basic_motor', 'GET', '/basic_motor?address=0x80', None, 3),
+	('basic_motor', 'POST', '/basic_motor?address=0x80', dict(motor=1, direction='0'), 4),
+	('api_settings', 'GET', '/api/config/settings?address=0x80', None, 7, COLD),
+	('api_settings', 'GET', '/api/config/settings?address=0x80', None, 1),
+	('api_settings', 'POST', '/api/config/settings?address=0x80', {'AmaxM1': 600}, 1),
+	('api_settings', 'GET', '/api/velocity/settings?address=0x80', None, 2, COLD),
+	('api_settings', 'GET', '/api/velocity/settings?address=0x80', None, 0),
+	('api_settings', 'POST', '/api/velocity/settings?address=0x80', _velocityForm, 2),
+	('api_settings', 'GET', '/api/position/settings?address=0x80', None, 2, COLD),
+	('api_settings', 'GET', '/api/position/settings?address=0x80', None, 0),
+	('api_encoders', 'GET', '/api/encoders?address=0x80', None, 2),
+	('api_encoders', 'POST', '/api/encoders?address=0x80', dict(m1enc=0), 1),
+	('api_action', 'POST', '/api/stop?address=0x80', {}, 2),
+	('api_action', 'POST', '/api/run_velocity?address=0x80', dict(m1speed=0, m2speed=0), 1),
+	('api_action', 'POST', '/api/to_position?address=0x80', _moveForm, 1),
+	('api_action', 'POST', '/api/drive?address=0x80', _driveForm, 3),
+	('api_action', 'POST', '/api/refresh?address=0x80', {}, 0),
+	('api_motion', 'GET', '/api/motion?address=0x80', None, 0),
+	('config_menu', 'GET', '/config?address=0x80', None, 8, COLD),
+	('config_menu', 'GET', '/config?address=0x80', None, 2),
+	('call_shutdown', 'GET', '/shutdown', None, None),
+	('connect_menu', 'GET', '/connect', None, 0),
+	('connect_menu', 'POST', '/connect', dict(port='Test_Stub', baudrate=115200,
+		interCharTimeout=0.01, retries=3), 0),
+]
+
+# Send every request in routeBudgets. Returns a list of (endpoint, method,
+# URL, budget, commands, cold) and a list of failure messages.
+def checkBudgets():
+	import testconfig
+	from roboclaw_stub import Roboclaw_stub
+	from snapshot import Snapshot
+
+	app = testconfig.create_app(discover=False)
+	stub = Roboclaw_stub()
+	counter = CountingRoboclaw(stub)
+	testconfig.setRoboclaw(counter)
+	# Background chart sampling and motion polling would count against
+	# whatever request runs at the time.
+	testconfig.history.stop()
+	testconfig.motionWatcher.close()
+	snapshot = Snapshot.read(stub, 0x80).encode()
+	client = app.test_client()
+
+	results = []
+	failures = []
+	for entry in routeBudgets:
+		endpoint, method, url, values, budget = entry[:5]
+		cold = entry[5:] == (COLD,)
+		if budget is None:
+			results.append((endpoint, method, url, budget, [], cold))
+			continue
+		if cold:
+			testconfig.rc.refresh(0x80)
+		counter.take()
+		if values == 'snapshot':
+			response = client.post(url, data={'snapshot': (io.BytesIO(snapshot), 'backup.rcss')},
+				content_type='multipart/form-data')
+		elif method == 'POST' and url.startswith('/api/'):
+			response = client.post(url, json=values)
+		elif method == 'POST':
+			response = client.post(url, data=values)
+		elif method == 'DELETE':
+			response = client.delete(url)
+		else:
+			response = client.get(url)
+		commands = counter.take()
+		results.append((endpoint, method, url, budget, commands, cold))
+		where = "{0} {1}{2}".format(method, url, " (cold)" if cold else "")
+		if response.status_code >= 400:
+			failures.append("{0}: status {1}".format(where, response.status_code))
+		if len(commands) > budget:
+			failures.append("{0}: {1} transactions, budget {2}: {3}".format(
+				where, len(commands), budget, ", ".join(commands)))
+
+	covered = set(entry[0] for entry in routeBudgets)
+	for rule in app.url_map.iter_rules():
+		name = rule.endpoint.split('.')[-1]
+		if rule.endpoint.startswith('pibot.') and name not in covered:
+			failures.append("{0} ({1}) has no transaction budget".format(rule.rule, name))
+	return results, failures
+
+def main():
+	parser = argparse.ArgumentParser(description="Check the serial transactions of every route")
+	parser.add_argument("-v", "--verbose", action="store_true", help="list the commands of every request")
+	args = parser.parse_args()
+
+	results, failures = checkBudgets()
+	for endpoint, method, url, budget, commands, cold in results:
+		if budget is None:
+			print("{0:6} {1:40}       not checked".format(method, url))
+			continue
+		print("{0:6} {1:40} {2:4} {3:3} / {4}".format(method, url, "cold" if cold else "",
+			len(commands), budget))
+		if args.verbose and commands:
+			counts = Counter(commands)
+			print("      " + ", ".join(name if counts[name] == 1 else "{0} x{1}".format(name, counts[name])
+				for name in sorted(counts, key=commands.index)))
+	for failure in failures:
+		print("FAIL " + failure)
+	return 1 if failures else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
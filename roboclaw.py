@@ -1,8 +1,106 @@
+from collections import namedtuple
 import random
-import serial
 import struct
 import time
 
+try:
+	long
+except NameError:
+	# Python 3 has a single integer type
+	long = int
+
+# CRC16 (polynomial 0x1021) of every single byte value, so the checksum
+# can be updated a byte at a time with one table lookup.
+def _crc_table():
+	table = []
+	for byte in range(0,256):
+		crc = byte << 8
+		for bit in range(0,8):
+			if crc&0x8000:
+				crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+			else:
+				crc = (crc << 1) & 0xFFFF
+		table.append(crc)
+	return tuple(table)
+
+_CRC_TABLE = _crc_table()
+
+# Big-endian reply layouts
+_WORD = struct.Struct(">H")
+_LONG = struct.Struct(">L")
+_SLONG_BYTE = struct.Struct(">lB")
+_BYTE = struct.Struct(">B")
+_BYTE2 = struct.Struct(">BB")
+_BYTE3 = struct.Struct(">BBB")
+_SWORD2 = struct.Struct(">hh")
+_WORD2 = struct.Struct(">HH")
+_LONG2 = struct.Struct(">LL")
+_LONG4 = struct.Struct(">4L")
+_LONG7 = struct.Struct(">7L")
+
+# Read results. Each is a tuple whose first element is 1 for success and 0
+# for failure, same as the tuples this API has always returned, so existing
+# callers keep working. New callers can use the field names instead of
+# indexing. FAILED is a shared instance returned on every failure.
+def _result(name, fields):
+	resultType = namedtuple(name, "ok " + fields)
+	resultType.FAILED = resultType(*([0] * len(resultType._fields)))
+	return resultType
+
+ValueResult = _result("ValueResult", "value")
+VersionResult = _result("VersionResult", "version")
+EncoderResult = _result("EncoderResult", "count status")
+SpeedResult = _result("SpeedResult", "speed status")
+BuffersResult = _result("BuffersResult", "m1 m2")
+PWMsResult = _result("PWMsResult", "m1 m2")
+CurrentsResult = _result("CurrentsResult", "m1 m2")
+VoltagesResult = _result("VoltagesResult", "min max")
+DeadBandResult = _result("DeadBandResult", "min max")
+EncoderModesResult = _result("EncoderModesResult", "m1 m2")
+PinFunctionsResult = _result("PinFunctionsResult", "s3 s4 s5")
+VelocityPIDResult = _result("VelocityPIDResult", "p i d qpps")
+PositionPIDResult = _result("PositionPIDResult", "p i d maxI deadZone minPos maxPos")
+
+# Results of the PID reads, which scale P, I and D to floats.
+def _velocityPID(ok,p,i,d,qpps):
+	return VelocityPIDResult(ok,p/65536.0,i/65536.0,d/65536.0,qpps)
+
+def _positionPID(ok,p,i,d,maxI,deadZone,minPos,maxPos):
+	return PositionPIDResult(ok,p/1024.0,i/1024.0,d/1024.0,maxI,deadZone,minPos,maxPos)
+
+# Max current replies carry a second, unused value.
+def _maxCurrent(ok,value,unused):
+	return ValueResult(ok,value)
+
+class RoboclawError(Exception):
+	'Raised by RoboclawChecked when a command fails'
+
+	def __init__(self, command, args, result):
+		Exception.__init__(self, "{0}{1} failed: {2}".format(command, tuple(args), result))
+		self.command = command
+		self.args_ = args
+		self.result = result
+
+# Wraps a Roboclaw (or anything with the same API, like Roboclaw_stub) so
+# a failed read raises RoboclawError instead of returning ok=0, and a failed
+# write raises instead of returning False. Successful calls return the same
+# result the wrapped object did.
+class RoboclawChecked:
+	def __init__(self, rc):
+		self._rc = rc
+
+	def __getattr__(self, name):
+		method = getattr(self._rc, name)
+		if not callable(method):
+			return method
+		def checked(*args):
+			result = method(*args)
+			if result is False or (isinstance(result, tuple) and not result[0]):
+				raise RoboclawError(name, args, result)
+			return result
+		self.__dict__[name] = checked
+		return checked
+
 class Roboclaw:
 	'Roboclaw Interface Class'
 	
@@ -12,6 +110,14 @@ class Roboclaw:
 		self.timeout = timeout;
 		self._trystimeout = retries
 		self._crc = 0;
+		self._recorder = None
+		# Preallocated packet buffers. Longest packet is under 48 bytes
+		# except for the version string, which is at most 48 plus CRC.
+		self._txbuf = bytearray(64)
+		self._txview = memoryview(self._txbuf)
+		self._txlen = 0
+		self._rxbuf = bytearray(64)
+		self._rxview = memoryview(self._rxbuf)
 
 	#Command Enums
 	class Cmd():
@@ -105,6 +211,33 @@ class Roboclaw:
 		SETPWMMODE = 148
 		GETPWMMODE = 149
 		FLAGBOOTLOADER = 255
+
+	# Fixed layout reads that ReadPipelined can batch: method name to
+	# command, reply layout, and what makes the result from (1, *values).
+	_PIPELINED = {
+		'ReadEncM1': (Cmd.GETM1ENC, _SLONG_BYTE, EncoderResult),
+		'ReadEncM2': (Cmd.GETM2ENC, _SLONG_BYTE, EncoderResult),
+		'ReadSpeedM1': (Cmd.GETM1SPEED, _SLONG_BYTE, SpeedResult),
+		'ReadSpeedM2': (Cmd.GETM2SPEED, _SLONG_BYTE, SpeedResult),
+		'ReadMainBatteryVoltage': (Cmd.GETMBATT, _WORD, ValueResult),
+		'ReadLogicBatteryVoltage': (Cmd.GETLBATT, _WORD, ValueResult),
+		'ReadBuffers': (Cmd.GETBUFFERS, _BYTE2, BuffersResult),
+		'ReadCurrents': (Cmd.GETCURRENTS, _SWORD2, CurrentsResult),
+		'ReadError': (Cmd.GETERROR, _WORD, ValueResult),
+		'GetConfig': (Cmd.GETCONFIG, _WORD, ValueResult),
+		'ReadMinMaxMainVoltages': (Cmd.GETMINMAXMAINVOLTAGES, _WORD2, VoltagesResult),
+		'ReadMinMaxLogicVoltages': (Cmd.GETMINMAXLOGICVOLTAGES, _WORD2, VoltagesResult),
+		'GetDeadBand': (Cmd.GETDEADBAND, _BYTE2, DeadBandResult),
+		'ReadPWMMode': (Cmd.GETPWMMODE, _BYTE, ValueResult),
+		'ReadPinFunctions': (Cmd.GETPINFUNCTIONS, _BYTE3, PinFunctionsResult),
+		'ReadM1MaxCurrent': (Cmd.GETM1MAXCURRENT, _LONG2, _maxCurrent),
+		'ReadM2MaxCurrent': (Cmd.GETM2MAXCURRENT, _LONG2, _maxCurrent),
+		'ReadEncoderModes': (Cmd.GETENCODERMODE, _BYTE2, EncoderModesResult),
+		'ReadM1VelocityPID': (Cmd.READM1PID, _LONG4, _velocityPID),
+		'ReadM2VelocityPID': (Cmd.READM2PID, _LONG4, _velocityPID),
+		'ReadM1PositionPID': (Cmd.READM1POSPID, _LONG7, _positionPID),
+		'ReadM2PositionPID': (Cmd.READM2POSPID, _LONG7, _positionPID),
+	}
 			
 	#Private Functions
 	def crc_clear(self):
@@ -112,68 +245,61 @@ class Roboclaw:
 		return
 		
 	def crc_update(self,data):
-		self._crc = self._crc ^ (data << 8)
-		for bit in range(0, 8):
-			if (self._crc&0x8000)  == 0x8000:
-				self._crc = ((self._crc << 1) ^ 0x1021)
-			else:
-				self._crc = self._crc << 1
+		self._crc = ((self._crc << 8) & 0xFFFF) ^ _CRC_TABLE[((self._crc >> 8) ^ data) & 0xFF]
 		return
 
+	# Run the CRC over the first count bytes of the receive buffer.
+	def _crc_rxbuf(self,count):
+		crc = self._crc
+		buf = self._rxbuf
+		for i in range(0,count):
+			crc = ((crc << 8) & 0xFFFF) ^ _CRC_TABLE[((crc >> 8) ^ buf[i]) & 0xFF]
+		self._crc = crc
+
+	# Outgoing bytes are accumulated in a preallocated packet buffer and
+	# written to the port in one call, right before the reply is read.
 	def _sendcommand(self,address,command):
+		if self._recorder is not None:
+			self._recorder.begin(address,command)
 		self.crc_clear()
 		self.crc_update(address)
-		self._port.write(chr(address))
 		self.crc_update(command)
-		self._port.write(chr(command))
+		self._txbuf[0] = address&0xFF
+		self._txbuf[1] = command&0xFF
+		self._txlen = 2
 		return
 
-	def _readchecksumword(self):
-		data = self._port.read(2)
-		if len(data)==2:
-			crc = (ord(data[0])<<8) | ord(data[1])
-			return (1,crc)	
-		return (0,0)
-		
-	def _readbyte(self):
-		data = self._port.read(1)
-		if len(data):
-			val = ord(data)
-			self.crc_update(val)
-			return (1,val)	
-		return (0,0)
-		
-	def _readword(self):
-		val1 = self._readbyte()
-		if val1[0]:
-			val2 = self._readbyte()
-			if val2[0]:
-				return (1,val1[1]<<8|val2[1])
-		return (0,0)
-
-	def _readlong(self):
-		val1 = self._readbyte()
-		if val1[0]:
-			val2 = self._readbyte()
-			if val2[0]:
-				val3 = self._readbyte()
-				if val3[0]:
-					val4 = self._readbyte()
-					if val4[0]:
-						return (1,val1[1]<<24|val2[1]<<16|val3[1]<<8|val4[1])
-		return (0,0)	
-
-	def _readslong(self):
-		val = self._readlong()
-		if val[0]:
-			if val[1]&0x80000000:
-				return (val[0],val[1]-0x100000000)
-			return (val[0],val[1])
-		return (0,0)
+	def _flush(self):
+		if self._txlen:
+			self._port.write(self._txview[:self._txlen])
+			self._txlen = 0
+
+	# Read up to count bytes into the receive buffer starting at offset.
+	# Returns number of bytes actually read.
+	def _readinto(self,count,offset=0):
+		self._flush()
+		readinto = getattr(self._port, 'readinto', None)
+		if readinto is not None:
+			return readinto(self._rxview[offset:offset+count]) or 0
+		data = self._port.read(count)
+		self._rxbuf[offset:offset+len(data)] = data
+		return len(data)
+
+	# Read a reply of count data bytes followed by CRC into the receive
+	# buffer. Returns 1 on success, 0 if the reply was short, -1 if the
+	# CRC did not match.
+	def _readreply(self,count):
+		if self._readinto(count+2) != count+2:
+			return 0
+		self._crc_rxbuf(count)
+		if self._crc != (self._rxbuf[count]<<8 | self._rxbuf[count+1]):
+			return -1
+		return 1
 
 	def _writebyte(self,val):
 		self.crc_update(val&0xFF)
-		self._port.write(chr(val&0xFF))
+		self._txbuf[self._txlen] = val&0xFF
+		self._txlen += 1
 
 	def _writesbyte(self,val):
 		self._writebyte(val)
@@ -194,106 +320,55 @@ class Roboclaw:
 	def _writeslong(self,val):
 		self._writelong(val)
 
-	def _read1(self,address,cmd):
-		trys = self._trystimeout
-		while 1:
-			self._port.flushInput()
-			self._sendcommand(address,cmd)
-			val1 = self._readbyte()
-			if val1[0]:
-				crc = self._readchecksumword()
-				if crc[0]:
-					if self._crc&0xFFFF!=crc[1]&0xFFFF:
-						return (0,0)
-					return (1,val1[1])
-			trys-=1
-			if trys==0:
-				break
-		return (0,0)
-
-	def _read2(self,address,cmd):
-		trys = self._trystimeout
-		while 1:
-			self._port.flushInput()
-			self._sendcommand(address,cmd)
-			val1 = self._readword()
-			if val1[0]:
-				crc = self._readchecksumword()
-				if crc[0]:
-					if self._crc&0xFFFF!=crc[1]&0xFFFF:
-						return (0,0)
-					return (1,val1[1])
-			trys-=1
-			if trys==0:
-				break
-		return (0,0)
-
-	def _read4(self,address,cmd):
-		trys = self._trystimeout
-		while 1:
-			self._port.flushInput()
-			self._sendcommand(address,cmd)
-			val1 = self._readlong()
-			if val1[0]:
-				crc = self._readchecksumword()
-				if crc[0]:
-					if self._crc&0xFFFF!=crc[1]&0xFFFF:
-						return (0,0)
-					return (1,val1[1])
-			trys-=1
-			if trys==0:
-				break
-		return (0,0)
-
-	def _read4_1(self,address,cmd):
+	# Send a read command and read a reply laid out as the given struct,
+	# followed by CRC. On success returns True with the reply left in the
+	# receive buffer for the caller to unpack.
+	def _readstruct(self,address,cmd,layout):
 		trys = self._trystimeout
 		while 1:
 			self._port.flushInput()
 			self._sendcommand(address,cmd)
-			val1 = self._readslong()
-			if val1[0]:
-				val2 = self._readbyte()
-				if val2[0]:
-					crc = self._readchecksumword()
-					if crc[0]:
-						if self._crc&0xFFFF!=crc[1]&0xFFFF:
-							return (0,0)
-						return (1,val1[1],val2[1])
+			result = self._readreply(layout.size)
+			if result<0:
+				return False
+			if result:
+				return True
 			trys-=1
 			if trys==0:
 				break
-		return (0,0)
+		return False
 
-	def _read_n(self,address,cmd,args):
-		trys = self._trystimeout
-		while 1:
-			self._port.flushInput()
-			trys-=1
-			if trys==0:
-				break
-			failed=False
-			self._sendcommand(address,cmd)
-			data = [1,]
-			for i in range(0,args):
-				val = self._readlong()
-				if val[0]==0:
-					failed=True
-					break
-				data.append(val[1])
-			if failed:
-				continue
-			crc = self._readchecksumword()
-			if crc[0]:
-				if self._crc&0xFFFF==crc[1]&0xFFFF:
-					return (data);
-		return (0,0,0,0,0)
+	def _read1(self,address,cmd,result=ValueResult):
+		if self._readstruct(address,cmd,_BYTE):
+			return result(1,self._rxbuf[0])
+		return result.FAILED
+
+	def _read2(self,address,cmd,result=ValueResult):
+		if self._readstruct(address,cmd,_WORD):
+			return result(1,_WORD.unpack_from(self._rxbuf)[0])
+		return result.FAILED
+
+	def _read4(self,address,cmd,result=ValueResult):
+		if self._readstruct(address,cmd,_LONG):
+			return result(1,_LONG.unpack_from(self._rxbuf)[0])
+		return result.FAILED
+
+	def _read4_1(self,address,cmd,result=EncoderResult):
+		if self._readstruct(address,cmd,_SLONG_BYTE):
+			val,status = _SLONG_BYTE.unpack_from(self._rxbuf)
+			return result(1,val,status)
+		return result.FAILED
+
+	# Reads a reply of several values in the given layout into a result.
+	def _readvalues(self,address,cmd,layout,result):
+		if self._readstruct(address,cmd,layout):
+			return result(1,*layout.unpack_from(self._rxbuf))
+		return result.FAILED
 
 	def _writechecksum(self):
 		self._writeword(self._crc&0xFFFF)
-		val = self._readbyte()
-		if(len(val)>0):
-			if val[0]:
-				return True
+		if self._readinto(1):
+			return True
 		return False
 
 	def _write0(self,address,cmd):
@@ -589,7 +664,7 @@ class Roboclaw:
 	def _write4S444S441(self,address,cmd,val1,val2,val3,val4,val5,val6,val7):
 		trys=self._trystimeout
 		while trys:
-			self._sendcommand(self,address,cmd)
+			self._sendcommand(address,cmd)
 			self._writelong(val1)
 			self._writeslong(val2)
 			self._writelong(val3)
@@ -640,7 +715,7 @@ class Roboclaw:
 	def SendRandomData(self,cnt):
 		for i in range(0,cnt):
 			byte = random.getrandbits(8)
-			self._port.write(chr(byte))
+			self._port.write(bytearray((byte,)))
 		return
 
 	def ForwardM1(self,address,val):
@@ -685,50 +760,94 @@ class Roboclaw:
 	def LeftRightMixed(self,address,val):
 		return self._write1(address,self.Cmd.MIXEDLR,val)
 
+	# Send the read commands of several read methods back to back, then
+	# collect the replies in order, so a sweep waits for one turnaround
+	# instead of one per command. names must be keys of _PIPELINED; returns
+	# their results in the same order. If a reply is missing or corrupt the
+	# link is out of step, so the remaining reads are redone one at a time.
+	def ReadPipelined(self,address,names):
+		requests = [self._PIPELINED[name] for name in names]
+		packet = bytearray()
+		for cmd,layout,make in requests:
+			packet.append(address&0xFF)
+			packet.append(cmd&0xFF)
+		# A flight recorder sees each read as its own transaction, so the
+		# batch is written past it and recorded request by request below.
+		port = self._port
+		if self._recorder is not None:
+			port = getattr(port,'unrecorded',port)
+		self._port.flushInput()
+		port.write(packet)
+		results = []
+		for index,(cmd,layout,make) in enumerate(requests):
+			if self._recorder is not None:
+				self._recorder.begin(address,cmd)
+				self._recorder.sent(packet[index*2:index*2+2])
+			self.crc_clear()
+			self.crc_update(address)
+			self.crc_update(cmd)
+			if self._readreply(layout.size)!=1:
+				break
+			results.append(make(1,*layout.unpack_from(self._rxbuf)))
+		if len(results)<len(names):
+			# Let replies still on the way arrive before discarding them.
+			pending = sum(layout.size+2 for cmd,layout,make in requests[len(results)+1:])
+			time.sleep(pending*10.0/self.rate)
+			for name in names[len(results):]:
+				results.append(getattr(self,name)(address))
+		return results
+
 	def ReadEncM1(self,address):
-		return self._read4_1(address,self.Cmd.GETM1ENC)
+		return self._read4_1(address,self.Cmd.GETM1ENC,EncoderResult)
 
 	def ReadEncM2(self,address):
-		return self._read4_1(address,self.Cmd.GETM2ENC)
+		return self._read4_1(address,self.Cmd.GETM2ENC,EncoderResult)
 
 	def ReadSpeedM1(self,address):
-		return self._read4_1(address,self.Cmd.GETM1SPEED)
+		return self._read4_1(address,self.Cmd.GETM1SPEED,SpeedResult)
 
 	def ReadSpeedM2(self,address):
-		return self._read4_1(address,self.Cmd.GETM2SPEED)
+		return self._read4_1(address,self.Cmd.GETM2SPEED,SpeedResult)
 
 	def ResetEncoders(self,address):
 		return self._write0(address,self.Cmd.RESETENC)
 
+	# The version is a NUL terminated string of up to 48 bytes, followed by
+	# CRC. It is read into the receive buffer in chunks of the bytes known
+	# to be still coming (at least the NUL and the CRC), so no read waits
+	# for bytes that will not arrive.
 	def ReadVersion(self,address):
 		trys=self._trystimeout
 		while 1:
 			self._port.flushInput()
 			self._sendcommand(address,self.Cmd.GETVERSION)
-			str = ""
-			passed = True
-			for i in range(0,48):
-				data = self._port.read(1)
-				if len(data):
-					val = ord(data)
-					self.crc_update(val)
-					if(val==0):
-						break
-					str+=data[0]
-				else:
-					passed = False
+			received = 0
+			total = 3
+			while received < total:
+				count = self._readinto(total-received,received)
+				if count != total-received:
 					break
-			if passed:
-				crc = self._readchecksumword()
-				if crc[0]:
-					if self._crc&0xFFFF==crc[1]&0xFFFF:
-						return (1,str)
-					else:
-						time.sleep(0.01)
+				received = total
+				length = self._rxbuf.find(b'\0',0,min(received,48))
+				if length >= 0:
+					total = length+3
+				elif received >= 48:
+					length = 48
+					total = 50
+				else:
+					total = received+3
+			if received == total:
+				self._crc_rxbuf(total-2)
+				if self._crc == (self._rxbuf[total-2]<<8 | self._rxbuf[total-1]):
+					version = bytes(self._rxbuf[:length])
+					if not isinstance(version, str):
+						version = version.decode('ascii', 'replace')
+					return VersionResult(1,version)
+				time.sleep(0.01)
 			trys-=1
 			if trys==0:
 				break
-		return (0,0)
+		return VersionResult.FAILED
 
 	def SetEncM1(self,address,cnt):
 		return self._write4(address,self.Cmd.SETM1ENCCOUNT,cnt)
@@ -755,10 +874,10 @@ class Roboclaw:
 		return self._write4444(address,self.Cmd.SETM2PID,long(d*65536),long(p*65536),long(i*65536),qpps)
 
 	def ReadISpeedM1(self,address):
-		return self._read4_1(address,self.Cmd.GETM1ISPEED)
+		return self._read4_1(address,self.Cmd.GETM1ISPEED,SpeedResult)
 
 	def ReadISpeedM2(self,address):
-		return self._read4_1(address,self.Cmd.GETM2ISPEED)
+		return self._read4_1(address,self.Cmd.GETM2ISPEED,SpeedResult)
 
 	def DutyM1(self,address,val):
 		return self._simplFunctionS2(address,self.Cmd.M1DUTY,val)
@@ -806,34 +925,13 @@ class Roboclaw:
 		return self._write4S44S441(address,self.Cmd.MIXEDSPEEDACCELDIST,accel,speed1,distance1,speed2,distance2,buffer)
 
 	def ReadBuffers(self,address):
-		val = self._read2(address,self.Cmd.GETBUFFERS)
-		if val[0]:
-			return (1,val[1]>>8,val[1]&0xFF)
-		return (0,0,0)
+		return self._readvalues(address,self.Cmd.GETBUFFERS,_BYTE2,BuffersResult)
 
 	def ReadPWMs(self,address):
-		val = self._read4(address,self.Cmd.GETPWMS)
-		if val[0]:
-			pwm1 = val[1]>>16
-			pwm2 = val[1]&0xFFFF
-			if pwm1&0x8000:
-				pwm1-=0x10000
-			if pwm2&0x8000:
-				pwm2-=0x10000
-			return (1,pwm1,pwm2)
-		return (0,0,0)
+		return self._readvalues(address,self.Cmd.GETPWMS,_SWORD2,PWMsResult)
 
 	def ReadCurrents(self,address):
-		val = self._read4(address,self.Cmd.GETCURRENTS)
-		if val[0]:
-			cur1 = val[1]>>16
-			cur2 = val[1]&0xFFFF
-			if cur1&0x8000:
-				cur1-=0x10000
-			if cur2&0x8000:
-				cur2-=0x10000
-			return (1,cur1,cur2)
-		return (0,0,0)
+		return self._readvalues(address,self.Cmd.GETCURRENTS,_SWORD2,CurrentsResult)
 
 	def SpeedAccelM1M2_2(self,address,accel1,speed1,accel2,speed2):
 		return self._write4S44S4(address,self.Cmd.MIXEDSPEED2ACCEL,accel,speed1,accel2,speed2)
@@ -851,22 +949,14 @@ class Roboclaw:
 		return self._writeS24S24(self.Cmd.MIXEDDUTYACCEL,duty1,accel1,duty2,accel2)
 		
 	def ReadM1VelocityPID(self,address):
-		data = self._read_n(address,self.Cmd.READM1PID,4)
-		if data[0]:
-			data[1]/=65536.0
-			data[2]/=65536.0
-			data[3]/=65536.0
-			return data
-		return (0,0,0,0,0)
+		if self._readstruct(address,self.Cmd.READM1PID,_LONG4):
+			return _velocityPID(1,*_LONG4.unpack_from(self._rxbuf))
+		return VelocityPIDResult.FAILED
 
 	def ReadM2VelocityPID(self,address):
-		data = self._read_n(address,self.Cmd.READM2PID,4)
-		if data[0]:
-			data[1]/=65536.0
-			data[2]/=65536.0
-			data[3]/=65536.0
-			return data
-		return (0,0,0,0,0)
+		if self._readstruct(address,self.Cmd.READM2PID,_LONG4):
+			return _velocityPID(1,*_LONG4.unpack_from(self._rxbuf))
+		return VelocityPIDResult.FAILED
 
 	def SetMainVoltages(self,address,min, max):
 		return self._write22(address,self.Cmd.SETMAINVOLTAGES,min,max)
@@ -875,20 +965,10 @@ class Roboclaw:
 		return self._write22(address,self.Cmd.SETLOGICVOLTAGES,min,max)
 		
 	def ReadMinMaxMainVoltages(self,address):
-		val = self._read4(address,self.Cmd.GETMINMAXMAINVOLTAGES)
-		if val[0]:
-			min = val[1]>>16
-			max = val[1]&0xFFFF
-			return (1,min,max)
-		return (0,0,0)
+		return self._readvalues(address,self.Cmd.GETMINMAXMAINVOLTAGES,_WORD2,VoltagesResult)
 
 	def ReadMinMaxLogicVoltages(self,address):
-		val = self._read4(address,self.Cmd.GETMINMAXLOGICVOLTAGES)
-		if val[0]:
-			min = val[1]>>16
-			max = val[1]&0xFFFF
-			return (1,min,max)
-		return (0,0,0)
+		return self._readvalues(address,self.Cmd.GETMINMAXLOGICVOLTAGES,_WORD2,VoltagesResult)
 
 	def SetM1PositionPID(self,address,kp,ki,kd,kimax,deadzone,min,max):
 		return self._write4444444(address,self.Cmd.SETM1POSPID,long(kd*1024),long(kp*1024),long(ki*1024),kimax,deadzone,min,max)
@@ -897,22 +977,14 @@ class Roboclaw:
 		return self._write4444444(address,self.Cmd.SETM2POSPID,long(kd*1024),long(kp*1024),long(ki*1024),kimax,deadzone,min,max)
 
 	def ReadM1PositionPID(self,address):
-		data = self._read_n(address,self.Cmd.READM1POSPID,7)
-		if data[0]:
-			data[1]/=1024.0
-			data[2]/=1024.0
-			data[3]/=1024.0
-			return data
-		return (0,0,0,0,0,0,0,0)
-		
+		if self._readstruct(address,self.Cmd.READM1POSPID,_LONG7):
+			return _positionPID(1,*_LONG7.unpack_from(self._rxbuf))
+		return PositionPIDResult.FAILED
+
 	def ReadM2PositionPID(self,address):
-		data = self._read_n(address,self.Cmd.READM2POSPID,7)
-		if data[0]:
-			data[1]/=1024.0
-			data[2]/=1024.0
-			data[3]/=1024.0
-			return data
-		return (0,0,0,0,0,0,0,0)
+		if self._readstruct(address,self.Cmd.READM2POSPID,_LONG7):
+			return _positionPID(1,*_LONG7.unpack_from(self._rxbuf))
+		return PositionPIDResult.FAILED
 
 	def SpeedAccelDeccelPositionM1(self,address,accel,speed,deccel,position,buffer):
 		return self._write44441(address,self.Cmd.M1SPEEDACCELDECCELPOS,accel,speed,deccel,position,buffer)
@@ -933,34 +1005,14 @@ class Roboclaw:
 		return self._write111(address,self.Cmd.SETPINFUNCTIONS,S3mode,S4mode,S5mode)
 
 	def ReadPinFunctions(self,address):
-		trys = self._trystimeout
-		while 1:
-			self._sendcommand(address,self.Cmd.GETPINFUNCTIONS)
-			val1 = self._readbyte()
-			if val1[0]:
-				val2 = self._readbyte()
-				if val1[0]:
-					val3 = self._readbyte()
-					if val1[0]:
-						crc = self._readchecksumword()
-						if crc[0]:
-							if self._crc&0xFFFF!=crc[1]&0xFFFF:
-								return (0,0)
-							return (1,val1[1],val2[1],val3[1])
-			trys-=1
-			if trys==0:
-				break
-		return (0,0)
+		return self._readvalues(address,self.Cmd.GETPINFUNCTIONS,_BYTE3,PinFunctionsResult)
 
 	def SetDeadBand(self,address,min,max):
 		return self._write11(address,self.Cmd.SETDEADBAND,min,max)
 
 	def GetDeadBand(self,address):
-		val = self._read2(address,self.Cmd.GETDEADBAND)
-		if val[0]:
-			return (1,val[1]>>8,val[1]&0xFF)
-		return (0,0,0)
-		
+		return self._readvalues(address,self.Cmd.GETDEADBAND,_BYTE2,DeadBandResult)
+
 	#Warning(TTL Serial): Baudrate will change if not already set to 38400.  Communications will be lost
 	def RestoreDefaults(self,address):
 		return self._write0(address,self.Cmd.RESTOREDEFAULTS)
@@ -975,11 +1027,8 @@ class Roboclaw:
 		return self._read2(address,self.Cmd.GETERROR)
 
 	def ReadEncoderModes(self,address):
-		val = self._read2(address,self.Cmd.GETENCODERMODE)
-		if val[0]:
-			return (1,val[1]>>8,val[1]&0xFF)
-		return (0,0,0)
-		
+		return self._readvalues(address,self.Cmd.GETENCODERMODE,_BYTE2,EncoderModesResult)
+
 	def SetM1EncoderMode(self,address,mode):
 		return self._write1(address,self.Cmd.SETM1ENCODERMODE,mode)
 
@@ -1010,16 +1059,14 @@ class Roboclaw:
 		return self._write44(address,self.Cmd.SETM2MAXCURRENT,max,0)
 
 	def ReadM1MaxCurrent(self,address):
-		data = self._read_n(address,self.Cmd.GETM1MAXCURRENT,2)
-		if data[0]:
-			return (1,data[1])
-		return (0,0)
+		if self._readstruct(address,self.Cmd.GETM1MAXCURRENT,_LONG2):
+			return _maxCurrent(1,*_LONG2.unpack_from(self._rxbuf))
+		return ValueResult.FAILED
 
 	def ReadM2MaxCurrent(self,address):
-		data = self._read_n(address,self.Cmd.GETM2MAXCURRENT,2)
-		if data[0]:
-			return (1,data[1])
-		return (0,0)
+		if self._readstruct(address,self.Cmd.GETM2MAXCURRENT,_LONG2):
+			return _maxCurrent(1,*_LONG2.unpack_from(self._rxbuf))
+		return ValueResult.FAILED
 
 	def SetPWMMode(self,address,mode):
 		return self._write1(address,self.Cmd.SETPWMMODE,mode)
@@ -1028,6 +1075,10 @@ class Roboclaw:
 		return self._read1(address,self.Cmd.GETPWMMODE)
 
 	def Open(self):
+		# pyserial is imported here rather than at the top so programs that
+		# never open a real port (the test stub, daemon clients) start
+		# without loading it.
+		import serial
 		try:
 			self._port = serial.Serial(port=self.comport, baudrate=self.rate, timeout=1, interCharTimeout=self.timeout)
 		except: